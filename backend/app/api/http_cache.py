@@ -0,0 +1,51 @@
+import gzip
+import hashlib
+from typing import Any
+
+from fastapi import Request, Response
+
+from app.services.structured import dumpb
+
+# Bodies smaller than this are sent uncompressed; gzip framing would outweigh the savings
+GZIP_MIN_BYTES = 256
+
+
+def _accepts_gzip(header: str) -> bool:
+    for coding in header.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.strip()
+            try:
+                return float(q[2:]) > 0 if q.startswith("q=") else True
+            except ValueError:
+                return True
+    return False
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+class CachedPayload:
+    """
+    A JSON response serialized, hashed and gzip-compressed once, then
+    served with ETag and Cache-Control so clients can revalidate with a
+    304 instead of downloading the body again
+    """
+
+    def __init__(self, content: Any, max_age: int):
+        self.body = dumpb(content)
+        self.etag = f'W/"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.compressed = gzip.compress(self.body, mtime=0) if len(self.body) >= GZIP_MIN_BYTES else None
+        self.headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={max_age}", "Vary": "Accept-Encoding"}
+
+    def response(self, request: Request) -> Response:
+        if _etag_matches(request.headers.get("if-none-match", ""), self.etag):
+            return Response(status_code=304, headers=self.headers)
+        if self.compressed is not None and _accepts_gzip(request.headers.get("accept-encoding", "")):
+            return Response(self.compressed, media_type="application/json", headers={**self.headers, "Content-Encoding": "gzip"})
+        return Response(self.body, media_type="application/json", headers=self.headers)
@@ -1,21 +1,158 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Dict
+from fastapi import APIRouter, File, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from app.models.schemas import (
-    PromptRequest, PromptResponse, OptimizationRequest, 
-    OptimizationResponse, ModelInfo, PromptGenerationRequest, PromptGenerationResponse
+    PromptRequest, PromptResponse, OptimizationRequest, BatchPromptRequest,
+    OptimizationResponse, ModelInfo, PromptGenerationRequest, PromptGenerationResponse,
+    JobRequest, JobResponse, ValidateRequest, BatchValidateRequest, EvaluationRequest
 )
 from app.services.openai_service import OpenAIService
+from app.api.http_cache import CachedPayload
+from app.services.batch import BATCH_MAX_ITEMS, run_batch
+from app.services.errors import ServiceError
+from app.services.evaluation import EVAL_MAX_CELLS, Evaluator
+from app.services.jobs import JobQueue, job_view
+from app.services.structured import dumps
+from app.services.usage import GROUP_COLUMNS
 
 router = APIRouter()
 openai_service = OpenAIService()
 
+async def _run_optimize_job(data: dict) -> dict:
+    response = await openai_service.optimize_prompt(PromptRequest(**data))
+    return response.model_dump()
+
+async def _run_generate_job(data: dict) -> dict:
+    response = await openai_service.generate_prompt_from_requirements(PromptGenerationRequest(**data))
+    return PromptGenerationResponse(**response).model_dump()
+
+job_queue = JobQueue.from_env({"optimize": _run_optimize_job, "generate": _run_generate_job})
+evaluator = Evaluator(openai_service)
+JOBS_MAX_WAIT = 60.0
+# Static metadata only changes with a deploy
+METADATA_MAX_AGE = 3600
+
+def _http_error(e: Exception) -> HTTPException:
+    """
+    Map service errors onto their HTTP status, everything else onto a 500
+    """
+    if isinstance(e, ServiceError):
+        return HTTPException(status_code=e.status_code, detail=e.message, headers=e.headers)
+    return HTTPException(status_code=500, detail=str(e))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def _sse_stream(events: AsyncIterator[Tuple[str, dict]]) -> AsyncIterator[str]:
+    """
+    Format (event, data) pairs as server-sent events. When the client
+    disconnects Starlette cancels this generator, and closing ``events``
+    closes the upstream completion stream with it.
+    """
+    try:
+        async for event, data in events:
+            yield f"event: {event}\ndata: {dumps(data)}\n\n"
+    except Exception as e:
+        error = _http_error(e)
+        payload = {"status_code": error.status_code, "detail": error.detail}
+        yield f"event: error\ndata: {dumps(payload)}\n\n"
+    finally:
+        await events.aclose()
+
 @router.get("/")
 async def root():
     return {"message": "Prompt Optimizer API is running"}
 
 @router.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "prompt-optimizer"}
+    # "estimate" means token counts, budgets and costs are approximate
+    return {"status": "healthy", "service": "prompt-optimizer", "tokenizer": openai_service.tokens.backends()}
+
+async def _ndjson_stream(records: AsyncIterator[dict]) -> AsyncIterator[str]:
+    """
+    Format records as newline-delimited JSON
+    """
+    try:
+        async for record in records:
+            yield dumps(record) + "\n"
+    finally:
+        await records.aclose()
+
+def _check_batch_size(size: int):
+    if size > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds the limit of {BATCH_MAX_ITEMS} items")
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Get response cache hit/miss statistics, in-flight request coalescing
+    counters and near-duplicate prompt index statistics
+    """
+    return {
+        **openai_service.cache.stats(),
+        "coalescing": openai_service.inflight.stats(),
+        "similarity": openai_service.similar.stats(),
+    }
+
+@router.get("/admission/stats")
+async def get_admission_stats():
+    """
+    Get upstream concurrency, queue depth and queue wait statistics
+    """
+    return openai_service.admission.stats()
+
+@router.get("/upstream/stats")
+async def get_upstream_stats():
+    """
+    Get retry, hedging and failover counters plus circuit state and latency per upstream target
+    """
+    return openai_service.resilience.snapshot()
+
+@router.get("/router/stats")
+async def get_router_stats():
+    """
+    Get the model router's policy, per-model rolling latency and error rate, and routing counts
+    """
+    return openai_service.router.stats()
+
+@router.get("/usage")
+async def get_usage(
+    tenant: Optional[str] = Query(None, description="Tenant ID (hash of the API key) to restrict to"),
+    model: Optional[str] = None,
+    since: Optional[float] = Query(None, description="Unix time; rounded down to the hour"),
+    until: Optional[float] = Query(None, description="Unix time, exclusive"),
+    group_by: str = Query("tenant,model", description="Comma-separated: tenant, model, hour, day"),
+):
+    """
+    Get tokens, cost, cache savings and average latency from the hourly usage rollups
+    """
+    groups = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in groups if name not in GROUP_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown group_by: {', '.join(unknown)}")
+    rows = await openai_service.usage.query(list(dict.fromkeys(groups)), since, until, tenant, model)
+    return {"group_by": groups, "rows": rows, "ledger": openai_service.usage.stats()}
+
+@router.get("/usage/quotas")
+async def get_usage_quotas():
+    """
+    Get each tenant's usage in the current quota period against its quota
+    """
+    return openai_service.usage.quotas()
+
+@router.get("/templates")
+async def get_templates():
+    """
+    List the registered prompt templates and the active version of each kind
+    """
+    return openai_service.templates.stats()
+
+@router.post("/templates/reload")
+async def reload_templates():
+    """
+    Reload custom prompt templates from PROMPT_TEMPLATE_DIR without restarting
+    """
+    return openai_service.templates.reload()
 
 @router.post("/optimize", response_model=PromptResponse)
 async def optimize_prompt(request: PromptRequest):
@@ -26,7 +163,96 @@ async def optimize_prompt(request: PromptRequest):
         response = await openai_service.optimize_prompt(request)
         return response
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+@router.post("/optimize/stream")
+async def optimize_prompt_stream(request: PromptRequest):
+    """
+    Optimize a prompt and stream the result as server-sent events
+    """
+    return StreamingResponse(
+        _sse_stream(openai_service.optimize_prompt_stream(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+@router.post("/optimize/batch")
+async def optimize_prompt_batch(request: BatchPromptRequest):
+    """
+    Optimize a list of prompts, streaming one NDJSON record per item in completion order
+    """
+    _check_batch_size(len(request.items))
+    return StreamingResponse(
+        _ndjson_stream(run_batch(request.items, openai_service.optimize_prompt, request.concurrency)),
+        media_type="application/x-ndjson"
+    )
+
+@router.post("/optimize/batch/upload")
+async def optimize_prompt_batch_upload(file: UploadFile = File(...), concurrency: Optional[int] = None):
+    """
+    Optimize prompts from an uploaded NDJSON file of PromptRequest objects
+    """
+    items = []
+    content = (await file.read()).decode("utf-8")
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(PromptRequest.model_validate_json(line))
+        except ValidationError as e:
+            # Reported as a failed item instead of rejecting the whole upload
+            items.append(e)
+    _check_batch_size(len(items))
+    return StreamingResponse(
+        _ndjson_stream(run_batch(items, openai_service.optimize_prompt, concurrency)),
+        media_type="application/x-ndjson"
+    )
+
+@router.post("/evaluate")
+async def evaluate_prompts(request: EvaluationRequest):
+    """
+    Run the original and optimized prompt on every test input and target
+    model, streaming one NDJSON record per judged cell in completion order
+    and a final summary with win rates and latency/token/cost deltas
+    """
+    cells = evaluator.cell_count(request)
+    if cells > EVAL_MAX_CELLS:
+        raise HTTPException(status_code=413, detail=f"Evaluation has {cells} cells, above the limit of {EVAL_MAX_CELLS}")
+    return StreamingResponse(_ndjson_stream(evaluator.run(request)), media_type="application/x-ndjson")
+
+@router.post("/jobs", response_model=JobResponse, status_code=202)
+async def create_job(job: JobRequest, request: Request, response: Response):
+    """
+    Queue an optimization or generation and return its job ID immediately
+    """
+    kind = "optimize" if isinstance(job.request, PromptRequest) else "generate"
+    try:
+        created = await job_queue.submit(
+            kind,
+            job.request.model_dump(),
+            str(job.callback_url) if job.callback_url else None
+        )
+    except ServiceError as e:
+        raise _http_error(e)
+    response.headers["Location"] = str(request.url_for("get_job", job_id=created["id"]))
+    return job_view(created)
+
+@router.get("/jobs/stats")
+async def get_job_stats():
+    """
+    Get job counts by status
+    """
+    return await job_queue.stats()
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, wait: float = Query(0, ge=0, le=JOBS_MAX_WAIT, description="Seconds to wait for the job to finish (long-poll)")):
+    """
+    Get the status and result of a job
+    """
+    job = await job_queue.get(job_id, wait)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_view(job)
 
 @router.post("/optimize/advanced", response_model=OptimizationResponse)
 async def optimize_prompt_advanced(request: OptimizationRequest):
@@ -58,79 +284,96 @@ async def optimize_prompt_advanced(request: OptimizationRequest):
             error=str(e)
         )
 
+# (catalog version, model name or None for the listing) -> payload
+_catalog_payloads: Dict[Tuple[int, Optional[str]], CachedPayload] = {}
+
+def _catalog_payload(name: Optional[str] = None) -> Optional[CachedPayload]:
+    """
+    Serialized /models responses, rebuilt only when the catalog changes
+    """
+    catalog = openai_service.catalog
+    key = (catalog.version, name)
+    payload = _catalog_payloads.get(key)
+    if payload is None:
+        content = catalog.models() if name is None else catalog.info(name)
+        if content is None:
+            return None
+        if any(version != catalog.version for version, _ in _catalog_payloads):
+            _catalog_payloads.clear()
+        payload = _catalog_payloads[key] = CachedPayload(content, catalog.max_age)
+    return payload
+
 @router.get("/models", response_model=List[ModelInfo])
-async def get_models():
+async def get_models(request: Request):
     """
     Get available OpenAI models
     """
-    models = openai_service.get_available_models()
-    return [
-        ModelInfo(
-            model_name=model["name"],
-            description=model["description"],
-            max_tokens=4096 if "3.5" in model["name"] else 8192,
-            pricing_per_1k_tokens={
-                "input": 0.0015 if "3.5" in model["name"] else 0.03,
-                "output": 0.002 if "3.5" in model["name"] else 0.06
-            }
-        )
-        for model in models
-    ]
+    return _catalog_payload().response(request)
 
-@router.get("/models/{model_name}")
-async def get_model_details(model_name: str):
+@router.get("/models/{model_name}", response_model=ModelInfo)
+async def get_model_details(model_name: str, request: Request):
     """
     Get details for a specific model
     """
-    models = await get_models()
-    model = next((m for m in models if m.model_name == model_name), None)
-    
-    if not model:
+    payload = _catalog_payload(model_name)
+    if payload is None:
         raise HTTPException(status_code=404, detail="Model not found")
-    
-    return model
+    return payload.response(request)
+
+@router.get("/models/catalog/stats")
+async def get_model_catalog_stats():
+    """
+    Model catalog source, listed models and last upstream refresh
+    """
+    return openai_service.catalog.stats()
+
+OPTIMIZATION_TYPES = CachedPayload({
+    "types": [
+        {"type": "general", "description": "General optimization for clarity and effectiveness"},
+        {"type": "clarity", "description": "Focus on making the prompt clearer"},
+        {"type": "conciseness", "description": "Make the prompt more concise"},
+        {"type": "creativity", "description": "Enhance creativity and innovation"},
+        {"type": "specificity", "description": "Make the prompt more specific and detailed"}
+    ]
+}, METADATA_MAX_AGE)
 
 @router.get("/optimization/types")
-async def get_optimization_types():
+async def get_optimization_types(request: Request):
     """
     Get available optimization types
     """
-    return {
-        "types": [
-            {"type": "general", "description": "General optimization for clarity and effectiveness"},
-            {"type": "clarity", "description": "Focus on making the prompt clearer"},
-            {"type": "conciseness", "description": "Make the prompt more concise"},
-            {"type": "creativity", "description": "Enhance creativity and innovation"},
-            {"type": "specificity", "description": "Make the prompt more specific and detailed"}
-        ]
-    }
+    return OPTIMIZATION_TYPES.response(request)
 
 @router.post("/validate")
-async def validate_prompt(prompt: str):
-    """
-    Validate if a prompt is well-formed
-    """
-    issues = []
-    
-    if len(prompt) < 3:
-        issues.append("Prompt is too short")
-    
-    if len(prompt) > 4000:
-        issues.append("Prompt is too long")
-    
-    if not any(char.isalnum() for char in prompt):
-        issues.append("Prompt contains no alphanumeric characters")
-    
-    return {
-        "is_valid": len(issues) == 0,
-        "issues": issues,
-        "suggestions": [
-            "Be specific about what you want",
-            "Include relevant context",
-            "Use clear and concise language",
-            "Specify the desired format of the response"
-        ] if issues else []
-    }
+async def validate_prompt(
+    body: Optional[ValidateRequest] = None,
+    prompt: Optional[str] = Query(None, description="Prompt to check when no JSON body is sent"),
+    model: str = Query("gpt-4.1"),
+    max_tokens: int = Query(1000)
+):
+    """
+    Check a prompt locally for problems worth fixing before optimizing it
+    """
+    if body is None:
+        if prompt is None:
+            raise HTTPException(status_code=422, detail="prompt is required")
+        body = ValidateRequest(prompt=prompt, model=model, max_tokens=max_tokens)
+    return openai_service.analyzer.analyze(
+        body.prompt, body.model, body.max_tokens, openai_service.length_exempt(body.prompt, body.chunked)
+    )
+
+# A plain def: FastAPI runs it in the threadpool so large batches do not block the event loop
+@router.post("/validate/batch")
+def validate_prompt_batch(request: BatchValidateRequest):
+    """
+    Check many prompts locally in one call; results are in request order
+    """
+    _check_batch_size(len(request.items))
+    results = openai_service.analyzer.analyze_batch([
+        {**item.model_dump(), "exempt": openai_service.length_exempt(item.prompt, item.chunked)} for item in request.items
+    ])
+    valid = sum(1 for result in results if result["is_valid"])
+    return {"total": len(results), "valid": valid, "invalid": len(results) - valid, "results": results}
 
 @router.post("/generate", response_model=PromptGenerationResponse)
 async def generate_prompt(request: PromptGenerationRequest):
@@ -139,42 +382,50 @@ async def generate_prompt(request: PromptGenerationRequest):
     """
     try:
         response = await openai_service.generate_prompt_from_requirements(request)
-        return PromptGenerationResponse(
-            generated_prompt=response["generated_prompt"],
-            prompt_structure=response["prompt_structure"],
-            usage_tips=response["usage_tips"],
-            alternatives=response["alternatives"],
-            model_used=response["model_used"],
-            confidence_score=response["confidence_score"]
-        )
+        return PromptGenerationResponse(**response)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+@router.post("/generate/stream")
+async def generate_prompt_stream(request: PromptGenerationRequest):
+    """
+    Generate a prompt and stream the result as server-sent events
+    """
+    return StreamingResponse(
+        _sse_stream(openai_service.generate_prompt_stream(request)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+TASK_TYPES = CachedPayload({
+    "types": [
+        {"type": "general", "description": "General-purpose prompts for various tasks"},
+        {"type": "creative", "description": "Prompts for creative writing, brainstorming, and innovation"},
+        {"type": "technical", "description": "Prompts for technical tasks, coding, and problem-solving"},
+        {"type": "analytical", "description": "Prompts for data analysis, research, and critical thinking"},
+        {"type": "educational", "description": "Prompts for teaching, learning, and knowledge sharing"}
+    ]
+}, METADATA_MAX_AGE)
 
 @router.get("/task-types")
-async def get_task_types():
+async def get_task_types(request: Request):
     """
     Get available task types for prompt generation
     """
-    return {
-        "types": [
-            {"type": "general", "description": "General-purpose prompts for various tasks"},
-            {"type": "creative", "description": "Prompts for creative writing, brainstorming, and innovation"},
-            {"type": "technical", "description": "Prompts for technical tasks, coding, and problem-solving"},
-            {"type": "analytical", "description": "Prompts for data analysis, research, and critical thinking"},
-            {"type": "educational", "description": "Prompts for teaching, learning, and knowledge sharing"}
-        ]
-    }
+    return TASK_TYPES.response(request)
+
+OUTPUT_FORMATS = CachedPayload({
+    "formats": [
+        {"format": "text", "description": "Free-form text response"},
+        {"format": "json", "description": "Structured JSON format"},
+        {"format": "list", "description": "Numbered or bulleted list"},
+        {"format": "structured", "description": "Specific structured format with sections"}
+    ]
+}, METADATA_MAX_AGE)
 
 @router.get("/output-formats")
-async def get_output_formats():
+async def get_output_formats(request: Request):
     """
     Get available output formats for prompt generation
     """
-    return {
-        "formats": [
-            {"format": "text", "description": "Free-form text response"},
-            {"format": "json", "description": "Structured JSON format"},
-            {"format": "list", "description": "Numbered or bulleted list"},
-            {"format": "structured", "description": "Specific structured format with sections"}
-        ]
-    }
\ No newline at end of file
+    return OUTPUT_FORMATS.response(request)
\ No newline at end of file
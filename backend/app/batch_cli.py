@@ -0,0 +1,69 @@
+"""
+Offline bulk optimization through the upstream batch API.
+
+    python -m app.batch_cli prompts.jsonl results.jsonl
+
+Each input line is a ``PromptRequest`` (has ``prompt``) or a
+``PromptGenerationRequest`` (has ``requirements``), optionally with a
+``custom_id`` that is copied to its result record. Running the same
+command again after an interruption resumes from the checkpoint in the
+work directory (``<output>.work`` by default).
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+from app.services.logs import configure_logging
+from app.services.offline_batch import (
+    OFFLINE_BATCH_COMPLETION_WINDOW, OFFLINE_BATCH_MAX_BYTES, OFFLINE_BATCH_MAX_REQUESTS,
+    OFFLINE_BATCH_POLL_INTERVAL, BatchAPI, OfflineBatchRunner
+)
+from app.services.openai_service import OpenAIService
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompt requests through the upstream batch API")
+    parser.add_argument("input", help="JSONL file of optimization/generation requests")
+    parser.add_argument("output", help="JSONL file the result records are appended to")
+    parser.add_argument("--work-dir", help="Checkpoint and batch file directory (default: <output>.work)")
+    parser.add_argument("--max-requests", type=int, default=OFFLINE_BATCH_MAX_REQUESTS, help="Requests per batch input file")
+    parser.add_argument("--max-bytes", type=int, default=OFFLINE_BATCH_MAX_BYTES, help="Bytes per batch input file")
+    parser.add_argument("--poll-interval", type=float, default=OFFLINE_BATCH_POLL_INTERVAL, help="Seconds between batch status checks")
+    parser.add_argument("--completion-window", default=OFFLINE_BATCH_COMPLETION_WINDOW)
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"))
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+    return parser.parse_args(argv)
+
+
+async def main(args: argparse.Namespace) -> dict:
+    service = OpenAIService()
+    api = BatchAPI(args.base_url, service.default_api_key)
+    runner = OfflineBatchRunner(
+        service,
+        api,
+        args.input,
+        args.output,
+        work_dir=args.work_dir,
+        max_requests=args.max_requests,
+        max_bytes=args.max_bytes,
+        poll_interval=args.poll_interval,
+        completion_window=args.completion_window,
+    )
+    try:
+        return await runner.run(restart=args.restart)
+    finally:
+        await api.aclose()
+        await service.close()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    try:
+        summary = asyncio.run(main(parse_args()))
+    except ValueError as e:
+        # An input that no longer matches its checkpoint
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+    print(json.dumps(summary, ensure_ascii=False))
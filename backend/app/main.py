@@ -1,16 +1,115 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from starlette.routing import Match
 import os
-from app.api.routes import router
+from app.api.routes import router, openai_service, job_queue
+from app.services.logs import configure_logging, log_event, new_request_id, request_id
+from app.services.metrics import CONTENT_TYPE, HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT, REGISTRY
+from app.services.structured import orjson
+
+configure_logging()
+REGISTRY.register_collector(openai_service.collect_metrics)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the BPE vocabularies up front, so a missing one is logged (or,
+    # with TOKENIZER_REQUIRE_VOCAB, fails startup) before the first request
+    openai_service.tokens.backends()
+    # Pick up edited prompt templates without a restart
+    reload_interval = float(os.getenv("TEMPLATE_RELOAD_INTERVAL", "0"))
+    watcher = None
+    if openai_service.templates.directory and reload_interval > 0:
+        watcher = asyncio.create_task(openai_service.templates.watch(reload_interval))
+    # Learn which models the upstream serves, in the background so startup never waits on it
+    catalog_interval = float(os.getenv("MODEL_CATALOG_REFRESH_INTERVAL", "3600"))
+    catalog_refresher = None
+    if catalog_interval > 0:
+        catalog_refresher = asyncio.create_task(
+            openai_service.catalog.watch(catalog_interval, openai_service.list_upstream_models)
+        )
+    # Reload this period's quota counters and start flushing usage records
+    await openai_service.usage.start()
+    # Resume jobs left over from a previous run
+    await job_queue.start()
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    if catalog_refresher is not None:
+        catalog_refresher.cancel()
+    await job_queue.stop()
+    # Close pooled upstream connections on shutdown
+    await openai_service.close()
 
 app = FastAPI(
     title="Prompt Optimizer API",
     description="A FastAPI-based API for optimizing prompts for OpenAI models",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    # orjson serializes response bodies several times faster when it is installed
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse
 )
 
+class RequestMetricsMiddleware:
+    """
+    Assign each request an ID (honouring X-Request-ID), record its latency
+    per route template once the response body has been fully sent, and
+    log it. Written as plain ASGI so streamed responses are not buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _route(scope) -> str:
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        # Unmatched paths share one label to keep cardinality bounded
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or new_request_id()
+        token = request_id.set(rid)
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = self._route(scope)
+            HTTP_REQUEST_DURATION.observe(elapsed, method=scope["method"], route=route, status=str(status["code"]))
+            log_event(
+                "http_request",
+                method=scope["method"],
+                route=route,
+                status=status["code"],
+                latency_ms=round(elapsed * 1000, 1),
+            )
+            request_id.reset(token)
+
+app.add_middleware(RequestMetricsMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +122,13 @@ app.add_middleware(
 # Include API routes
 app.include_router(router, prefix="/api/v1")
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Prometheus text exposition of request, upstream, cache and admission metrics
+    """
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     return {
@@ -1,20 +1,59 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict
+from pydantic import AnyHttpUrl, BaseModel, Field, model_validator
+from typing import Any, Optional, List, Dict, Union
 
 class PromptRequest(BaseModel):
     prompt: str = Field(..., description="The original prompt to optimize")
-    model: str = Field(default="gpt-4.1", description="OpenAI model to use")
+    model: str = Field(default="gpt-4.1", description="OpenAI model to use, or \"auto\" to let the model router choose")
+    routing_policy: Optional[str] = Field(None, pattern="^(cheapest_within_slo|fastest|quality_first)$", description="Routing policy for model \"auto\" (defaults to ROUTER_POLICY)")
     context: Optional[str] = Field(None, description="Additional context for optimization")
     optimization_goal: str = Field(default="general", description="Optimization goal: general, clarity, conciseness, creativity, specificity")
     max_tokens: int = Field(default=1000, description="Maximum tokens for the optimized prompt")
     api_key: Optional[str] = Field(None, description="OpenAI API key (optional, overrides env)")
     base_url: Optional[str] = Field(None, description="OpenAI base URL (optional)")
+    cache: Optional[str] = Field(None, pattern="^(bypass|refresh)$", description="Response cache control: bypass skips the cache, refresh forces a new upstream call and stores it")
+    template_version: Optional[str] = Field(None, description="Prompt template version to use (defaults to the active template)")
+    reuse_similar: Optional[bool] = Field(None, description="Serve a cached optimization of a near-identical prompt (defaults to SIMILARITY_ENABLED)")
+    compress_context: Optional[bool] = Field(None, description="Compress the supplementary text locally before the upstream call (defaults to COMPRESSION_ENABLED)")
+    context_token_budget: Optional[int] = Field(None, ge=0, description="Token budget for the compressed context (defaults to COMPRESSION_TARGET_TOKENS, 0 only deduplicates)")
+    preflight: bool = Field(False, description="Run the local prompt analyzer first and reject prompts with errors before any upstream call")
+    chunked: Optional[bool] = Field(None, description="Optimize a long prompt in concurrently processed chunks merged by a reconciliation pass (defaults to prompts over CHUNK_THRESHOLD_CHARS)")
+    candidates: Optional[int] = Field(None, ge=1, le=10, description="Sample this many optimizations in one upstream call and rank them locally; the best becomes the result")
+
+class BatchPromptRequest(BaseModel):
+    items: List[PromptRequest] = Field(..., min_length=1, description="Prompts to optimize")
+    concurrency: Optional[int] = Field(None, ge=1, description="Maximum number of items optimized concurrently (capped by BATCH_MAX_CONCURRENCY)")
+
+class ValidateRequest(BaseModel):
+    prompt: str = Field(..., description="The prompt to check")
+    model: str = Field(default="gpt-4.1", description="Model whose context window bounds the token budget")
+    max_tokens: int = Field(default=1000, description="Completion tokens to reserve in the token budget")
+    chunked: Optional[bool] = Field(None, description="Whether the prompt will be optimized in chunks, which lifts the length limits (defaults to prompts over CHUNK_THRESHOLD_CHARS)")
+
+class BatchValidateRequest(BaseModel):
+    items: List[ValidateRequest] = Field(..., min_length=1, description="Prompts to check")
 
 class ConfigRequest(BaseModel):
     api_key: Optional[str] = Field(None, description="OpenAI API key")
     base_url: Optional[str] = Field(None, description="OpenAI base URL")
     model_name: Optional[str] = Field(None, description="OpenAI model name to use")
 
+class RouteDecision(BaseModel):
+    model: str = Field(..., description="Model the router chose")
+    policy: str
+    reason: str
+    required_quality: float
+    estimated_input_tokens: int
+    estimated_cost_usd: float = Field(..., description="Upper-bound cost estimate the choice was based on")
+
+class PromptCandidate(BaseModel):
+    optimized_prompt: str
+    suggestions: List[str]
+    reasoning: str
+    confidence_score: float = 0.0
+    tokens: int = Field(0, description="Tokens of the optimized prompt")
+    score: float = Field(0.0, description="Local ranking score, higher is better")
+    issues: List[str] = Field([], description="Problems the local analyzer found in the optimized prompt")
+
 class PromptResponse(BaseModel):
     original_prompt: str
     optimized_prompt: str
@@ -23,11 +62,21 @@ class PromptResponse(BaseModel):
     model_used: str
     tokens_saved: int = 0
     confidence_score: float = 0.0
+    prompt_tokens: int = Field(0, description="Prompt tokens billed by the upstream")
+    completion_tokens: int = Field(0, description="Completion tokens billed by the upstream")
+    cost_usd: float = Field(0.0, description="Estimated upstream cost of this request in USD")
+    cached: bool = Field(False, description="Whether the result was served from the response cache")
+    similarity: Optional[float] = Field(None, description="Similarity to the prompt whose cached optimization was reused, if any")
+    context_tokens_removed: int = Field(0, description="Tokens removed from the supplementary text by local compression")
+    chunks: int = Field(1, description="Number of chunks the prompt was optimized in")
+    candidates: Optional[List[PromptCandidate]] = Field(None, description="Distinct candidates ranked best first, when several were requested")
+    route: Optional[RouteDecision] = Field(None, description="How model \"auto\" was resolved")
 
 class ModelInfo(BaseModel):
     model_name: str
     description: str
-    max_tokens: int
+    max_tokens: int = Field(..., description="Maximum completion tokens of the model")
+    context_window: int = Field(..., description="Prompt plus completion tokens the model accepts")
     pricing_per_1k_tokens: Dict[str, float]
 
 class OptimizationRequest(BaseModel):
@@ -50,10 +99,15 @@ class PromptGenerationRequest(BaseModel):
     context: Optional[str] = Field(None, description="Additional context or background information")
     constraints: Optional[str] = Field(None, description="Specific constraints or limitations")
     examples: Optional[List[str]] = Field(None, description="Example outputs or similar prompts")
-    model: str = Field(default="gpt-4.1", description="OpenAI model to use")
+    model: str = Field(default="gpt-4.1", description="OpenAI model to use, or \"auto\" to let the model router choose")
+    routing_policy: Optional[str] = Field(None, pattern="^(cheapest_within_slo|fastest|quality_first)$", description="Routing policy for model \"auto\" (defaults to ROUTER_POLICY)")
     max_tokens: int = Field(default=1000, description="Maximum tokens for the generated prompt")
     api_key: Optional[str] = Field(None, description="OpenAI API key (optional, overrides env)")
     base_url: Optional[str] = Field(None, description="OpenAI base URL (optional)")
+    cache: Optional[str] = Field(None, pattern="^(bypass|refresh)$", description="Response cache control: bypass skips the cache, refresh forces a new upstream call and stores it")
+    template_version: Optional[str] = Field(None, description="Prompt template version to use (defaults to the active template)")
+    compress_context: Optional[bool] = Field(None, description="Compress the supplementary text locally before the upstream call (defaults to COMPRESSION_ENABLED)")
+    context_token_budget: Optional[int] = Field(None, ge=0, description="Token budget for the compressed context (defaults to COMPRESSION_TARGET_TOKENS, 0 only deduplicates)")
 
 class PromptGenerationResponse(BaseModel):
     generated_prompt: str
@@ -61,4 +115,90 @@ class PromptGenerationResponse(BaseModel):
     usage_tips: List[str] = Field(..., description="Tips for using the generated prompt effectively")
     alternatives: List[str] = Field(..., description="Alternative prompt variations")
     model_used: str
-    confidence_score: float = 0.0
\ No newline at end of file
+    confidence_score: float = 0.0
+    prompt_tokens: int = Field(0, description="Prompt tokens billed by the upstream")
+    completion_tokens: int = Field(0, description="Completion tokens billed by the upstream")
+    cost_usd: float = Field(0.0, description="Estimated upstream cost of this request in USD")
+    cached: bool = Field(False, description="Whether the result was served from the response cache")
+    context_tokens_removed: int = Field(0, description="Tokens removed from the supplementary text by local compression")
+    route: Optional[RouteDecision] = Field(None, description="How model \"auto\" was resolved")
+
+class PolishSchems(BaseModel):
+    """Structured output requested from the model for prompt optimization"""
+    optimized_prompt: str
+    suggestions: List[str]
+    reasoning: str
+    confidence_score: str
+
+class TextReplacement(BaseModel):
+    find: str
+    replace: str
+
+class ReconcileSchema(BaseModel):
+    """Structured output requested from the model when merging separately optimized chunks"""
+    replacements: List[TextReplacement]
+    suggestions: List[str]
+    reasoning: str
+    confidence_score: str
+
+class JudgeSchema(BaseModel):
+    """Structured output requested from the model when judging two outputs for the same input"""
+    winner: str
+    score_a: float
+    score_b: float
+    rationale: str
+
+class PromptGenerationSchema(BaseModel):
+    """Structured output requested from the model for prompt generation"""
+    generated_prompt: str
+    prompt_structure: Dict[str, str]
+    usage_tips: List[str]
+    alternatives: List[str]
+    confidence_score: str
+
+class JobRequest(BaseModel):
+    request: Union[PromptRequest, PromptGenerationRequest] = Field(..., description="An optimization (prompt) or generation (requirements) request")
+    callback_url: Optional[AnyHttpUrl] = Field(None, description="URL that receives the finished job as a JSON POST")
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str = Field(..., description="optimize or generate")
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    result: Optional[Dict[str, Any]] = Field(None, description="PromptResponse or PromptGenerationResponse once succeeded")
+    error: Optional[str] = None
+    error_status: Optional[int] = Field(None, description="HTTP status the synchronous endpoint would have returned for the error")
+    attempts: int = 0
+    callback_status: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    deduplicated: bool = Field(False, description="Whether an identical queued or running job was returned instead of a new one")
+
+class EvaluationCase(BaseModel):
+    input: str = Field(..., description="Test input sent as the user message")
+    expected: Optional[str] = Field(None, description="Reference output the heuristic judge compares against")
+
+class EvaluationRequest(BaseModel):
+    original_prompt: Optional[str] = Field(None, description="Prompt before optimization (defaults to optimization.original_prompt)")
+    optimized_prompt: Optional[str] = Field(None, description="Prompt after optimization (defaults to optimization.optimized_prompt)")
+    optimization: Optional[PromptResponse] = Field(None, description="An /optimize response to take both prompts from")
+    inputs: List[Union[EvaluationCase, str]] = Field([], description="Test inputs; without any, each prompt runs once on its own")
+    models: List[str] = Field(["gpt-4.1-mini"], min_length=1, description="Target models every input runs on")
+    judge: str = Field("heuristic", pattern="^(heuristic|llm)$", description="heuristic scores outputs locally, llm asks judge_model to compare them")
+    judge_model: Optional[str] = Field(None, description="Model of the LLM judge (defaults to EVAL_JUDGE_MODEL)")
+    max_tokens: int = Field(1000, description="Maximum completion tokens per execution")
+    temperature: float = Field(0.0, ge=0.0, le=2.0, description="Sampling temperature of the executions")
+    concurrency: Optional[int] = Field(None, ge=1, description="Maximum upstream calls in flight (capped by EVAL_MAX_CONCURRENCY)")
+    api_key: Optional[str] = Field(None, description="OpenAI API key (optional, overrides env)")
+    base_url: Optional[str] = Field(None, description="OpenAI base URL (optional)")
+    cache: Optional[str] = Field(None, pattern="^(bypass|refresh)$", description="Response cache control for the executions")
+
+    @model_validator(mode="after")
+    def _resolve_prompts(self) -> "EvaluationRequest":
+        if self.optimization is not None:
+            self.original_prompt = self.original_prompt or self.optimization.original_prompt
+            self.optimized_prompt = self.optimized_prompt or self.optimization.optimized_prompt
+        if not self.original_prompt or not self.optimized_prompt:
+            raise ValueError("original_prompt and optimized_prompt are required unless optimization is given")
+        self.inputs = [EvaluationCase(input=case) if isinstance(case, str) else case for case in self.inputs]
+        return self
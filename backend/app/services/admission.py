@@ -0,0 +1,221 @@
+import os
+import time
+import heapq
+import hashlib
+import asyncio
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.services.errors import AdmissionRejected, RateLimited
+from app.services.metrics import ADMISSION_QUEUE_WAIT
+
+# Priority lanes: lower values are served first
+LANE_INTERACTIVE = 0
+LANE_BULK = 1
+LANE_NAMES = {LANE_INTERACTIVE: "interactive", LANE_BULK: "bulk"}
+
+# Lane of the upstream calls made by the current task; batch workers switch to LANE_BULK
+current_lane: ContextVar[int] = ContextVar("admission_lane", default=LANE_INTERACTIVE)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def shortfall(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available (0 when they already are)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class AdmissionController:
+    """
+    Admission control for upstream LLM calls.
+
+    A global limit bounds in-flight upstream calls, per-key token buckets
+    bound request and estimated-token rates, and callers that cannot start
+    immediately wait in a bounded priority queue. A request is rejected up
+    front when the queue is full or its estimated wait already exceeds the
+    wait budget, so callers get a Retry-After instead of a timeout.
+
+    Only upstream calls go through the controller; metadata and validation
+    routes never wait here.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        max_wait: float,
+        key_rpm: float = 0,
+        key_tpm: float = 0,
+        max_keys: int = 10000,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.key_rpm = key_rpm
+        self.key_tpm = key_tpm
+        self.max_keys = max_keys
+        self.in_flight = 0
+        self._waiters: List[tuple] = []
+        self._sequence = itertools.count()
+        self._request_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._token_buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Exponentially weighted mean time a slot is held, used to estimate waits
+        self._service_time = 2.0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "deadline": 0, "timeout": 0, "rate_limited": 0}
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("MAX_CONCURRENT_REQUESTS", "10")),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "100")),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT", os.getenv("REQUEST_TIMEOUT", "30"))),
+            key_rpm=float(os.getenv("KEY_RATE_LIMIT_RPM", "0")),
+            key_tpm=float(os.getenv("KEY_RATE_LIMIT_TPM", "0")),
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter[3].done())
+
+    def _bucket(self, buckets: "OrderedDict[str, TokenBucket]", key: str, per_minute: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(per_minute / 60.0, per_minute)
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
+
+    def _check_rate(self, key: Optional[str], estimated_tokens: int):
+        if not self.key_rpm and not self.key_tpm:
+            return
+        # Only a digest of the API key is kept in memory
+        key = hashlib.sha256((key or "").encode("utf-8")).hexdigest()[:16]
+        checks = []
+        if self.key_rpm:
+            checks.append((self._bucket(self._request_buckets, key, self.key_rpm), 1))
+        if self.key_tpm:
+            checks.append((self._bucket(self._token_buckets, key, self.key_tpm), estimated_tokens))
+        retry_after = max(bucket.shortfall(amount) for bucket, amount in checks)
+        if retry_after > 0:
+            self.rejected["rate_limited"] += 1
+            raise RateLimited("Rate limit exceeded for this API key", retry_after)
+        for bucket, amount in checks:
+            bucket.take(amount)
+
+    def _estimated_wait(self) -> float:
+        ahead = self.queue_depth + 1
+        return self._service_time * ahead / self.max_concurrent
+
+    async def _acquire(self, lane: int):
+        if self.in_flight < self.max_concurrent and not self.queue_depth:
+            self.in_flight += 1
+            return
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected("Server is busy, request queue is full", self._estimated_wait())
+        estimated = self._estimated_wait()
+        if estimated > self.max_wait:
+            self.rejected["deadline"] += 1
+            raise AdmissionRejected("Server is busy, estimated wait exceeds the request deadline", estimated)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._sequence), time.monotonic(), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                return
+            future.cancel()
+            self.rejected["timeout"] += 1
+            raise AdmissionRejected("Server is busy, timed out waiting for a slot", self._estimated_wait())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            else:
+                future.cancel()
+            raise
+
+    def _release(self):
+        while self._waiters:
+            lane, _, enqueued_at, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            # Hand the slot straight to the next waiter; in_flight is unchanged
+            future.set_result(None)
+            self._record_wait(time.monotonic() - enqueued_at)
+            return
+        self.in_flight -= 1
+
+    def _record_wait(self, seconds: float):
+        self.wait_count += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[str] = None, estimated_tokens: int = 0, lane: Optional[int] = None) -> AsyncIterator[None]:
+        """
+        Hold one upstream slot for the duration of the block, raising
+        AdmissionRejected (503) or RateLimited (429) when it cannot be granted
+        """
+        self._check_rate(key, estimated_tokens)
+        lane = current_lane.get() if lane is None else lane
+        requested = time.monotonic()
+        await self._acquire(lane)
+        started = time.monotonic()
+        ADMISSION_QUEUE_WAIT.observe(started - requested, lane=LANE_NAMES[lane])
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._release()
+
+    def stats(self) -> Dict[str, object]:
+        depth_by_lane = {name: 0 for name in LANE_NAMES.values()}
+        for lane, _, _, future in self._waiters:
+            if not future.done():
+                depth_by_lane[LANE_NAMES[lane]] += 1
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "queue_depth": sum(depth_by_lane.values()),
+            "queue_depth_by_lane": depth_by_lane,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queued_requests": self.wait_count,
+            "wait_seconds_avg": round(self.wait_total / self.wait_count, 4) if self.wait_count else 0.0,
+            "wait_seconds_max": round(self.wait_max, 4),
+            "estimated_service_seconds": round(self._service_time, 4),
+        }
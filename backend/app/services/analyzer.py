@@ -0,0 +1,303 @@
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+from app.services.catalog import ModelCatalog
+from app.services.tokenizer import TokenCounter
+
+SEVERITY_ERROR = "error"
+SEVERITY_WARNING = "warning"
+# Length findings that do not apply to a prompt optimized in chunks
+CHUNKED_EXEMPT = ("too_long", "token_overflow")
+
+# Canonical COAST section -> heading names, English and Chinese
+COAST_SECTIONS = {
+    "context": ("context", "背景"),
+    "objectives": ("objectives", "objective", "目标"),
+    "action": ("action", "actions", "行动"),
+    "support": ("support", "支持"),
+    "technology": ("technology", "技术"),
+}
+_SECTION_NAMES = {name: section for section, names in COAST_SECTIONS.items() for name in names}
+
+# "## Context:", "**Objectives (目标)**", "Action：" ... A heading without a
+# markdown marker needs a colon so prose such as "Action items are" is not one
+_HEADING_PATTERN = re.compile(
+    r"^[ \t]*(?P<marker>#{1,6}[ \t]*|\*\*)?[ \t]*(?P<name>"
+    + "|".join(sorted(map(re.escape, _SECTION_NAMES), key=len, reverse=True))
+    + r")[ \t]*(?:\([^)\n]*\)|（[^）\n]*）)?[ \t]*(?:\*\*)?[ \t]*(?P<colon>[:：])?[ \t]*(?:\*\*)?(?P<rest>.*)$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_MARKDOWN_HEADING = re.compile(r"^[ \t]*#{1,6}[ \t]")
+
+_SENTENCE_SPLIT = re.compile(r"[.!?]\s+|[。！？\n]+")
+_SENTENCE_PUNCTUATION = ".!?,;:\"' \t"
+MIN_SENTENCE_CHARS = 12
+
+# (literal every match contains, pattern); the literal lets most prompts skip the regex
+_PLACEHOLDER_PATTERNS = [
+    ("{{", re.compile(r"\{\{\s*[^{}\n]{1,40}?\s*\}\}")),
+    ("${", re.compile(r"\$\{[^{}\n]{1,40}\}")),
+    ("{", re.compile(r"(?<![{\w\"'])\{[A-Za-z_][A-Za-z0-9_]{0,39}\}(?!\})")),
+    ("[", re.compile(r"\[(?:[A-Z][A-Z0-9_]*(?:[ \t]+[A-Z0-9_]+)*|(?i:insert|your|add|enter|put)\b[^\]\n]{0,40})\]")),
+    ("<", re.compile(r"<(?:[A-Z][A-Z0-9_]{2,}|(?i:insert|your)\b[^>\n]{0,40})>")),
+]
+# Bracketed all-caps words that are normal prose, not placeholders
+_PLACEHOLDER_ALLOWED = {"[OK]", "[A]", "[I]", "[X]", "[NOTE]"}
+
+# Output format keywords; a keyword only counts when an instruction asks for it
+_FORMAT_KEYWORDS = re.compile(
+    r"\b(?P<json>json)\b|\b(?P<yaml>yaml)\b|\b(?P<xml>xml)\b|\b(?P<csv>csv)\b|\b(?P<markdown>markdown)\b"
+    r"|\b(?P<plain_text>plain[\s-]+text)\b|(?P<plain_text_zh>纯文本)",
+    re.IGNORECASE,
+)
+_FORMAT_NAMES = ("json", "yaml", "xml", "csv", "markdown", "plain", "纯文本")
+# Looked for in the same sentence just before the keyword ...
+_FORMAT_DIRECTIVE = re.compile(
+    r"(?:\b(?:respond|reply|answer|output|return|format(?:ted)?|write|provide|give|produce)\b.*\b(?:in|as|using|with)\b"
+    r"|以|用|使用|输出)[^.\n。]*$",
+    re.IGNORECASE,
+)
+_FORMAT_NEGATION = re.compile(r"\b(?:no|without|not|never|avoid)\b[^.\n]*$|不要|不使用|避免", re.IGNORECASE)
+# ... or right after it
+_FORMAT_SUFFIX = re.compile(r"\s*(?:format|object|only|格式)", re.IGNORECASE)
+FORMAT_DIRECTIVE_WINDOW = 60
+
+_CJK_CHARS = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_LATIN_CHARS = re.compile(r"[A-Za-z]")
+# A script counts as mixed in when it makes up at least this share of letters
+LANGUAGE_MIX_RATIO = 0.15
+LANGUAGE_MIX_MIN_CHARS = 20
+
+ANALYZER_SUGGESTIONS = {
+    "too_short": "Be specific about what you want",
+    "too_long": "Split the prompt or remove material the model does not need",
+    "no_alphanumeric": "Describe the task in words",
+    "empty_section": "Fill in or remove empty COAST sections",
+    "repeated_sentence": "Remove repeated sentences",
+    "placeholder": "Replace template placeholders with real values",
+    "conflicting_format": "Specify the desired format of the response once",
+    "token_overflow": "Shorten the prompt or lower max_tokens",
+    "language_mix": "Write the prompt in one language where possible",
+}
+
+
+class PromptAnalyzer:
+    """
+    Local, rule-based prompt checks that run before any upstream call.
+
+    Each check is a single regex pass over the prompt, so a prompt is
+    analyzed in well under a millisecond. Findings are ``error`` (the
+    request is not worth sending upstream) or ``warning`` (likely to hurt
+    the result); a prompt is valid when it has no errors.
+    """
+
+    def __init__(
+        self, tokens: Optional[TokenCounter] = None, catalog: Optional[ModelCatalog] = None,
+        min_length: int = 3, max_length: int = 4000, max_input_tokens: int = 0
+    ):
+        self.tokens = tokens or TokenCounter()
+        self.catalog = catalog or ModelCatalog()
+        self.min_length = min_length
+        self.max_length = max_length
+        self.max_input_tokens = max_input_tokens
+
+    @classmethod
+    def from_env(cls, tokens: Optional[TokenCounter] = None, catalog: Optional[ModelCatalog] = None) -> "PromptAnalyzer":
+        return cls(
+            tokens=tokens,
+            catalog=catalog,
+            min_length=int(os.getenv("VALIDATE_MIN_LENGTH", "3")),
+            max_length=int(os.getenv("VALIDATE_MAX_LENGTH", "4000")),
+            max_input_tokens=int(os.getenv("MAX_INPUT_TOKENS", "0")),
+        )
+
+    def _length(self, prompt: str) -> List[dict]:
+        findings = []
+        if len(prompt) < self.min_length:
+            findings.append(_finding("too_short", SEVERITY_ERROR, "Prompt is too short"))
+        if len(prompt) > self.max_length:
+            findings.append(_finding("too_long", SEVERITY_ERROR, "Prompt is too long"))
+        if not any(char.isalnum() for char in prompt):
+            findings.append(_finding("no_alphanumeric", SEVERITY_ERROR, "Prompt contains no alphanumeric characters"))
+        return findings
+
+    def _empty_sections(self, prompt: str) -> List[dict]:
+        headings = list(_HEADING_PATTERN.finditer(prompt))
+        headings = [m for m in headings if m.group("marker") or m.group("colon")]
+        findings = []
+        for i, match in enumerate(headings):
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(prompt)
+            body = match.group("rest") + prompt[match.end():end]
+            # A nested markdown heading of another kind ends the section too
+            lines = [line for line in body.splitlines() if line.strip()]
+            if not lines or _MARKDOWN_HEADING.match(lines[0]):
+                section = _SECTION_NAMES[match.group("name").lower()]
+                findings.append(_finding(
+                    "empty_section", SEVERITY_WARNING, f"COAST section '{section}' is empty", section=section
+                ))
+        return findings
+
+    def _repeated_sentences(self, prompt: str) -> List[dict]:
+        counts = Counter()
+        for sentence in _SENTENCE_SPLIT.split(prompt):
+            normalized = " ".join(sentence.lower().rstrip(_SENTENCE_PUNCTUATION).split())
+            if len(normalized) >= MIN_SENTENCE_CHARS:
+                counts[normalized] += 1
+        return [
+            _finding("repeated_sentence", SEVERITY_WARNING, f"Sentence repeated {count} times: \"{sentence[:60]}\"", count=count)
+            for sentence, count in counts.items() if count > 1
+        ]
+
+    def _placeholders(self, prompt: str) -> List[dict]:
+        found = []
+        for literal, pattern in _PLACEHOLDER_PATTERNS:
+            if literal not in prompt:
+                continue
+            for match in pattern.finditer(prompt):
+                text = match.group()
+                if text not in found and text.upper() not in _PLACEHOLDER_ALLOWED:
+                    found.append(text)
+        if not found:
+            return []
+        return [_finding(
+            "placeholder", SEVERITY_WARNING, f"Unresolved placeholder(s): {', '.join(found[:5])}", placeholders=found
+        )]
+
+    def _conflicting_formats(self, prompt: str) -> List[dict]:
+        lowered = prompt.lower()
+        if sum(1 for name in _FORMAT_NAMES if name in lowered) < 2:
+            return []
+        formats = []
+        for match in _FORMAT_KEYWORDS.finditer(prompt):
+            name = match.lastgroup.replace("_zh", "")
+            before = prompt[max(0, match.start() - FORMAT_DIRECTIVE_WINDOW):match.start()]
+            if name == "markdown" and _FORMAT_NEGATION.search(before):
+                # "no markdown" asks for plain text
+                name = "plain_text"
+            elif not (_FORMAT_DIRECTIVE.search(before) or _FORMAT_SUFFIX.match(prompt, match.end())):
+                continue
+            if name not in formats:
+                formats.append(name)
+        if len(formats) < 2:
+            return []
+        return [_finding(
+            "conflicting_format", SEVERITY_WARNING, f"Conflicting output format instructions: {', '.join(formats)}", formats=formats
+        )]
+
+    def _needs_count(self, prompt: str, model: str, max_tokens: int) -> bool:
+        """
+        Whether the prompt could overflow its budget. A prompt never has more
+        tokens than UTF-8 bytes, so most prompts need no tokenization at all.
+        """
+        upper_bound = len(prompt.encode("utf-8"))
+        if self.max_input_tokens and upper_bound > self.max_input_tokens:
+            return True
+        limits = self.catalog.limits(model)
+        return bool(limits) and upper_bound + max_tokens > limits["context_window"]
+
+    def _token_budget(self, prompt_tokens: Optional[int], model: str, max_tokens: int) -> List[dict]:
+        if prompt_tokens is None:
+            return []
+        findings = []
+        if self.max_input_tokens and prompt_tokens > self.max_input_tokens:
+            findings.append(_finding(
+                "token_overflow", SEVERITY_ERROR,
+                f"Prompt is {prompt_tokens} tokens, above the limit of {self.max_input_tokens}"
+            ))
+        limits = self.catalog.limits(model)
+        if limits and prompt_tokens + max_tokens > limits["context_window"]:
+            findings.append(_finding(
+                "token_overflow", SEVERITY_ERROR,
+                f"Prompt ({prompt_tokens} tokens) plus max_tokens ({max_tokens}) exceeds "
+                f"the {limits['context_window']}-token context window of {model}"
+            ))
+        return findings
+
+    def _language(self, prompt: str) -> dict:
+        cjk = 0 if prompt.isascii() else len(_CJK_CHARS.findall(prompt))
+        if not cjk:
+            has_latin = _LATIN_CHARS.search(prompt) is not None
+            return {"cjk_ratio": 0.0, "latin_ratio": 1.0 if has_latin else 0.0, "mixed": False}
+        latin = len(_LATIN_CHARS.findall(prompt))
+        letters = cjk + latin
+        return {
+            "cjk_ratio": round(cjk / letters, 3) if letters else 0.0,
+            "latin_ratio": round(latin / letters, 3) if letters else 0.0,
+            "mixed": letters > 0 and min(cjk, latin) >= LANGUAGE_MIX_MIN_CHARS
+            and min(cjk, latin) / letters >= LANGUAGE_MIX_RATIO,
+        }
+
+    def _analyze(
+        self, prompt: str, model: str, max_tokens: int, prompt_tokens: Optional[int], started: float, exempt: Sequence[str] = ()
+    ) -> dict:
+        findings = self._length(prompt)
+        findings += self._empty_sections(prompt)
+        findings += self._repeated_sentences(prompt)
+        findings += self._placeholders(prompt)
+        findings += self._conflicting_formats(prompt)
+        findings += self._token_budget(prompt_tokens, model, max_tokens)
+        # Exempt findings are still reported, as warnings
+        findings = [{**f, "severity": SEVERITY_WARNING} if f["code"] in exempt else f for f in findings]
+        language = self._language(prompt)
+        if language["mixed"]:
+            findings.append(_finding(
+                "language_mix", SEVERITY_WARNING,
+                f"Prompt mixes CJK ({language['cjk_ratio']:.0%}) and Latin-script ({language['latin_ratio']:.0%}) text"
+            ))
+        suggestions = []
+        for finding in findings:
+            suggestion = ANALYZER_SUGGESTIONS[finding["code"]]
+            if suggestion not in suggestions:
+                suggestions.append(suggestion)
+        return {
+            "is_valid": not any(f["severity"] == SEVERITY_ERROR for f in findings),
+            "issues": [f["message"] for f in findings],
+            "suggestions": suggestions,
+            "findings": findings,
+            "prompt_tokens": prompt_tokens,
+            "language": language,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def analyze(self, prompt: str, model: str = "gpt-4.1", max_tokens: int = 1000, exempt: Sequence[str] = ()) -> dict:
+        """
+        Check one prompt. Returns ``is_valid``, human-readable ``issues`` and
+        ``suggestions``, and the structured ``findings`` behind them.
+        Findings whose code is in ``exempt`` are downgraded to warnings.
+        ``prompt_tokens`` is None when the prompt is too short to overflow
+        its token budget and was not tokenized.
+        """
+        started = time.perf_counter()
+        prompt_tokens = self.tokens.count(prompt, model) if self._needs_count(prompt, model, max_tokens) else None
+        return self._analyze(prompt, model, max_tokens, prompt_tokens, started, exempt)
+
+    def analyze_batch(self, items: List[Dict[str, object]]) -> List[dict]:
+        """
+        Check many prompts; each item has ``prompt`` and optionally ``model``,
+        ``max_tokens`` and ``exempt``. Prompts that may overflow are tokenized in one
+        batch per model.
+        """
+        counts: List[Optional[int]] = [None] * len(items)
+        by_model: Dict[str, List[int]] = {}
+        for index, item in enumerate(items):
+            model = item.get("model") or "gpt-4.1"
+            if self._needs_count(item["prompt"], model, item.get("max_tokens") or 1000):
+                by_model.setdefault(model, []).append(index)
+        for model, indices in by_model.items():
+            for index, count in zip(indices, self.tokens.count_batch([items[i]["prompt"] for i in indices], model)):
+                counts[index] = count
+        results = []
+        for item, prompt_tokens in zip(items, counts):
+            started = time.perf_counter()
+            results.append(self._analyze(
+                item["prompt"], item.get("model") or "gpt-4.1", item.get("max_tokens") or 1000, prompt_tokens, started,
+                item.get("exempt") or ()
+            ))
+        return results
+
+
+def _finding(code: str, severity: str, message: str, **details) -> dict:
+    return {"code": code, "severity": severity, "message": message, **details}
@@ -0,0 +1,77 @@
+import os
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
+
+from pydantic import BaseModel
+
+from app.services.admission import LANE_BULK, current_lane
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+
+def item_fingerprint(item: BaseModel) -> str:
+    """Stable hash of a request item, used to deduplicate items within a batch"""
+    encoded = json.dumps(item.model_dump(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+async def run_batch(
+    items: List[Union[BaseModel, Exception]],
+    handler: Callable[[BaseModel], Awaitable[BaseModel]],
+    concurrency: Optional[int] = None,
+) -> AsyncIterator[dict]:
+    """
+    Run ``handler`` over the batch items with bounded concurrency and yield
+    one result record per item in completion order.
+
+    Identical items are sent upstream once and their result is reported for
+    every index. An item that failed validation can be passed as the
+    exception itself; it is reported as an error without failing the rest of
+    the batch, as is any exception raised by ``handler``.
+    """
+    concurrency = max(1, min(concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    results: asyncio.Queue = asyncio.Queue()
+    pending: asyncio.Queue = asyncio.Queue()
+    groups: Dict[str, List[int]] = {}
+    total = 0
+
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            results.put_nowait({"index": index, "status": "error", "error": str(item)})
+            total += 1
+            continue
+        key = item_fingerprint(item)
+        if key not in groups:
+            groups[key] = []
+            pending.put_nowait((item, groups[key]))
+        groups[key].append(index)
+        total += 1
+
+    async def worker():
+        # Batch items queue behind interactive requests for upstream slots
+        current_lane.set(LANE_BULK)
+        while True:
+            try:
+                item, indices = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                response = await handler(item)
+                records = [{"index": i, "status": "ok", "result": response.model_dump()} for i in indices]
+            except Exception as e:
+                records = [{"index": i, "status": "error", "error": str(e)} for i in indices]
+            for record in records:
+                results.put_nowait(record)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(groups)))]
+    try:
+        for _ in range(total):
+            yield await results.get()
+    finally:
+        # Stop outstanding upstream calls if the consumer went away early
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
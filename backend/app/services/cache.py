@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.structured import dumpb, loads
+
+
+class CacheStats:
+    """Hit/miss counters for a single cache tier"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class MemoryCache:
+    """
+    In-process LRU cache bounded by entry count and total value bytes,
+    with per-entry TTL expiry.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.size_bytes = 0
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self.size_bytes += len(value)
+        self.stats.writes += 1
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats.evictions += 1
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self.size_bytes -= len(value)
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SharedCache:
+    """
+    Shared cache tier backed by any Redis-compatible async client, i.e. an
+    object exposing ``await get(key)`` and ``await set(key, value, ex=seconds)``.
+    Backend failures are counted and treated as misses so the shared tier
+    can never fail a request.
+    """
+
+    def __init__(self, client, ttl: float, prefix: str = "prompt-optimizer:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = await self.client.get(self.prefix + key)
+        except Exception:
+            self.stats.errors += 1
+            value = None
+        if value is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return value.encode("utf-8") if isinstance(value, str) else value
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        try:
+            await self.client.set(self.prefix + key, value, ex=int(ttl or self.ttl))
+            self.stats.writes += 1
+        except Exception:
+            self.stats.errors += 1
+
+    async def close(self):
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            try:
+                await close()
+            except Exception:
+                pass
+
+
+class ResponseCache:
+    """
+    Two-tier cache for upstream completions: a per-process LRU in front of an
+    optional shared tier. Shared hits are promoted into the local tier.
+    """
+
+    def __init__(self, memory: MemoryCache, shared: Optional[SharedCache] = None, enabled: bool = True):
+        self.memory = memory
+        self.shared = shared
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        ttl = float(os.getenv("CACHE_TTL", "3600"))
+        memory = MemoryCache(
+            max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+            ttl=ttl,
+        )
+        shared = None
+        redis_url = os.getenv("CACHE_REDIS_URL")
+        if redis_url:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError:
+                raise RuntimeError("CACHE_REDIS_URL is set but the 'redis' package is not installed")
+            shared = SharedCache(redis_asyncio.from_url(redis_url), ttl=ttl)
+        enabled = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+        return cls(memory, shared, enabled=enabled)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Normalize line endings and insignificant whitespace"""
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        return "\n".join(" ".join(line.split()) for line in lines).strip()
+
+    @classmethod
+    def make_key(
+        cls,
+        system_prompt: str,
+        user_prompt: str,
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        response_format: Optional[Dict[str, Any]] = None,
+        **extra: Any
+    ) -> str:
+        """
+        Build the request fingerprint: a SHA-256 over the normalized prompts,
+        sampling parameters and response schema
+        """
+        payload = {
+            "system": cls.normalize(system_prompt),
+            "user": cls.normalize(user_prompt),
+            "model": model.strip().lower(),
+            "max_tokens": max_tokens,
+            "temperature": round(float(temperature), 4),
+            "response_format": response_format,
+        }
+        payload.update(extra)
+        encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            value = await self.shared.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return loads(value) if value is not None else None
+
+    async def set(self, key: str, entry: Dict[str, Any]):
+        if not self.enabled:
+            return
+        value = dumpb(entry)
+        self.memory.set(key, value)
+        if self.shared is not None:
+            await self.shared.set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "memory": {
+                **self.memory.stats.as_dict(),
+                "entries": len(self.memory),
+                "size_bytes": self.memory.size_bytes,
+                "max_bytes": self.memory.max_bytes,
+            },
+            "shared": self.shared.stats.as_dict() if self.shared is not None else None,
+        }
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
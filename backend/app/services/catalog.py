@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.logs import log_event
+
+# Context window, output limit, USD price per 1K tokens and a relative
+# quality score (0-1) the model router weighs against price. A model name
+# without an entry of its own (e.g. a dated snapshot) resolves to the
+# longest entry it starts with.
+BUILTIN_MODELS = {
+    "gpt-4.1": {"description": "Latest GPT-4.1 model with enhanced capabilities", "context_window": 1047576, "max_output_tokens": 32768, "input": 0.002, "output": 0.008, "quality": 0.9},
+    "gpt-4o": {"description": "GPT-4 Omni - multimodal capabilities", "context_window": 128000, "max_output_tokens": 16384, "input": 0.0025, "output": 0.01, "quality": 0.85},
+    "gpt-4.1-mini": {"description": "GPT-4.1 Mini - cost-effective GPT-4.1 variant", "context_window": 1047576, "max_output_tokens": 32768, "input": 0.0004, "output": 0.0016, "quality": 0.8},
+    "gpt-4o-mini": {"description": "GPT-4 Omni Mini - fast and cost-effective", "context_window": 128000, "max_output_tokens": 16384, "input": 0.00015, "output": 0.0006, "quality": 0.7},
+    "gpt-4.1-nano": {"description": "GPT-4.1 Nano - fastest and cheapest GPT-4.1 variant", "context_window": 1047576, "max_output_tokens": 32768, "input": 0.0001, "output": 0.0004, "quality": 0.6},
+    "gpt-4-turbo": {"description": "GPT-4 Turbo", "context_window": 128000, "max_output_tokens": 4096, "input": 0.01, "output": 0.03, "quality": 0.8},
+    "gpt-4": {"description": "GPT-4", "context_window": 8192, "max_output_tokens": 8192, "input": 0.03, "output": 0.06, "quality": 0.75},
+    "gpt-3.5-turbo": {"description": "GPT-3.5 Turbo", "context_window": 16385, "max_output_tokens": 4096, "input": 0.0005, "output": 0.0015, "quality": 0.5},
+}
+# Listed by /models as long as the upstream has not said which models it serves
+DEFAULT_LISTED = ("gpt-4.1", "gpt-4o", "gpt-4.1-mini", "gpt-4o-mini")
+SPEC_FIELDS = ("description", "context_window", "max_output_tokens", "input", "output")
+# Quality of catalog-file models that do not state one
+DEFAULT_QUALITY = 0.5
+# Resolved names kept before the memo is reset; bounds memory under arbitrary model names
+MAX_RESOLVED = 4096
+
+
+def _spec(name: str, data: dict) -> dict:
+    missing = [field for field in SPEC_FIELDS if field not in data]
+    if missing:
+        raise ValueError(f"Model {name} is missing {', '.join(missing)}")
+    return {
+        "description": str(data["description"]),
+        "context_window": int(data["context_window"]),
+        "max_output_tokens": int(data["max_output_tokens"]),
+        "input": float(data["input"]),
+        "output": float(data["output"]),
+        "quality": float(data.get("quality", DEFAULT_QUALITY)),
+    }
+
+
+class ModelCatalog:
+    """
+    Models the service knows, with context windows and prices, built once
+    at startup.
+
+    Entries come from the builtin table, extended or overridden by the JSON
+    file at ``MODEL_CATALOG_PATH``::
+
+        {"models": {"my-model": {"description": "...", "context_window": 32768,
+                                 "max_output_tokens": 4096, "input": 0.001, "output": 0.002,
+                                 "quality": 0.7}}}
+
+    ``/models`` lists the builtin defaults plus the file's models until
+    refresh() learns which of the known models the upstream serves. Lookups
+    by exact name are a dict hit; other names resolve by longest prefix once
+    and are memoized. ``version`` changes whenever the listing or the
+    entries do, so callers can cache anything derived from them.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_age: int = 300):
+        self.path = path
+        self.max_age = max_age
+        self.specs: Dict[str, dict] = {}
+        self.file_models: List[str] = []
+        self.discovered: Optional[List[str]] = None
+        self.listed: List[str] = []
+        self.version = 0
+        self.refreshed_at: Optional[float] = None
+        self.errors: List[str] = []
+        self._prefixes: List[str] = []
+        self._resolved: Dict[str, Optional[str]] = {}
+        self._file_signature: Optional[Tuple[int, int]] = None
+        self.load()
+
+    @classmethod
+    def from_env(cls) -> "ModelCatalog":
+        return cls(
+            path=os.getenv("MODEL_CATALOG_PATH") or None,
+            max_age=int(os.getenv("MODEL_CATALOG_MAX_AGE", "300")),
+        )
+
+    def _signature(self) -> Optional[Tuple[int, int]]:
+        if not self.path or not os.path.isfile(self.path):
+            return None
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> bool:
+        """
+        (Re)read the catalog file when it changed. An invalid file is
+        reported and the previous entries are kept. Returns whether the
+        catalog changed.
+        """
+        signature = self._signature()
+        if self.version and signature == self._file_signature:
+            return False
+        specs = dict(BUILTIN_MODELS)
+        file_models: List[str] = []
+        if signature is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for name, spec in data["models"].items():
+                    specs[name] = _spec(name, spec)
+                    file_models.append(name)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                self.errors = [f"{self.path}: {e}"]
+                self._file_signature = signature
+                log_event("model_catalog_invalid", logging.WARNING, path=self.path, error=str(e))
+                if self.version:
+                    return False
+                specs, file_models = dict(BUILTIN_MODELS), []
+            else:
+                self.errors = []
+        self._file_signature = signature
+        self.specs = specs
+        self.file_models = file_models
+        self._prefixes = sorted(specs, key=len, reverse=True)
+        self._resolved = {}
+        self._relist()
+        return True
+
+    def _relist(self):
+        names = list(DEFAULT_LISTED) + [name for name in self.file_models if name not in DEFAULT_LISTED]
+        if self.discovered is not None:
+            served = set(self.discovered)
+            ordered = names + [name for name in self.specs if name not in names]
+            names = [name for name in ordered if name in served] or names
+        self.listed = names
+        self.version += 1
+
+    def resolve(self, model: str) -> Optional[str]:
+        """The catalog entry ``model`` is priced as, or None for unknown models"""
+        if model in self.specs:
+            return model
+        key = model.lower()
+        if key in self._resolved:
+            return self._resolved[key]
+        match = next((prefix for prefix in self._prefixes if key.startswith(prefix)), None)
+        if len(self._resolved) >= MAX_RESOLVED:
+            self._resolved = {}
+        self._resolved[key] = match
+        return match
+
+    def limits(self, model: str) -> Optional[dict]:
+        name = self.resolve(model)
+        return self.specs[name] if name else None
+
+    def estimate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """USD cost of a completion, 0.0 for models without known pricing"""
+        limits = self.limits(model)
+        if not limits:
+            return 0.0
+        return round(prompt_tokens / 1000 * limits["input"] + completion_tokens / 1000 * limits["output"], 8)
+
+    def info(self, name: str) -> Optional[dict]:
+        """The ModelInfo fields of a model with an entry of its own"""
+        spec = self.specs.get(name)
+        if spec is None:
+            return None
+        return {
+            "model_name": name,
+            "description": spec["description"],
+            "max_tokens": spec["max_output_tokens"],
+            "context_window": spec["context_window"],
+            "pricing_per_1k_tokens": {"input": spec["input"], "output": spec["output"]},
+        }
+
+    def models(self) -> List[dict]:
+        return [self.info(name) for name in self.listed]
+
+    async def refresh(self, fetch: Callable[[], Awaitable[List[str]]]) -> bool:
+        """
+        Re-read the catalog file and ask the upstream which models it
+        serves. Returns whether the listing changed.
+        """
+        changed = self.load()
+        discovered = sorted(set(await fetch()))
+        self.refreshed_at = time.time()
+        if discovered != self.discovered:
+            self.discovered = discovered
+            listed = self.listed
+            self._relist()
+            changed = changed or listed != self.listed
+            log_event("model_catalog_refreshed", upstream_models=len(discovered), listed=len(self.listed))
+        return changed
+
+    async def watch(self, interval: float, fetch: Callable[[], Awaitable[List[str]]]):
+        """Refresh now and then every ``interval`` seconds; failures keep the current catalog"""
+        while True:
+            try:
+                await self.refresh(fetch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event("model_catalog_refresh_failed", logging.WARNING, error=str(e))
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "path": self.path,
+            "version": self.version,
+            "listed": list(self.listed),
+            "entries": len(self.specs),
+            "upstream_models": len(self.discovered) if self.discovered is not None else None,
+            "refreshed_at": self.refreshed_at,
+            "errors": list(self.errors),
+        }
@@ -0,0 +1,104 @@
+import os
+import re
+from typing import List, Optional
+
+from app.services.analyzer import COAST_SECTIONS
+from app.services.compression import split_units
+
+# A section starts at a markdown heading or at a COAST heading such as
+# "Context:" or "**目标**"; a bare name needs a colon or bold markers
+_SECTION_START = re.compile(
+    r"^[ \t]*(?:#{1,6}[ \t]|(?:\*\*)?(?:"
+    + "|".join(sorted((re.escape(n) for names in COAST_SECTIONS.values() for n in names), key=len, reverse=True))
+    + r")[ \t]*(?:\([^)\n]*\)|（[^）\n]*）)?[ \t]*(?:\*\*[ \t]*[:：]?|[:：]))",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Paragraphs end at a blank line; the separator stays with the paragraph before it
+_PARAGRAPH = re.compile(r".*?(?:\n[ \t]*\n\s*|$)", re.DOTALL)
+
+
+def _split_at(pattern: re.Pattern, text: str) -> List[str]:
+    """Split ``text`` before every match of ``pattern``; the pieces concatenate back to the text"""
+    starts = [m.start() for m in pattern.finditer(text) if m.start() > 0]
+    bounds = [0] + starts + [len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def _pieces(text: str, max_chars: int) -> List[str]:
+    """
+    Break text into pieces no longer than ``max_chars`` where possible,
+    preferring the coarsest boundary: sections, then paragraphs, then
+    sentences. A single sentence longer than the limit is kept whole.
+    """
+    pieces = []
+    for section in _split_at(_SECTION_START, text):
+        if len(section) <= max_chars:
+            pieces.append(section)
+            continue
+        for paragraph in _PARAGRAPH.findall(section):
+            if not paragraph:
+                continue
+            if len(paragraph) <= max_chars:
+                pieces.append(paragraph)
+            else:
+                pieces.extend(split_units(paragraph))
+    return pieces
+
+
+def split_prompt(text: str, max_chars: int) -> List[str]:
+    """
+    Split a long prompt into chunks of at most ``max_chars`` along
+    structural boundaries. Consecutive small sections are packed together
+    so chunks come out of similar size; joining the chunks gives back the
+    original text exactly.
+    """
+    if len(text) <= max_chars:
+        return [text]
+    chunks: List[str] = []
+    current = ""
+    for piece in _pieces(text, max_chars):
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def outline(chunks: List[str], width: int = 80) -> str:
+    """One line per chunk naming its first line, so each part knows where it sits in the whole"""
+    lines = []
+    for i, chunk in enumerate(chunks, 1):
+        first = next((line.strip() for line in chunk.splitlines() if line.strip()), "")
+        if len(first) > width:
+            first = first[:width - 1] + "…"
+        lines.append(f"{i}. {first}")
+    return "\n".join(lines)
+
+
+class ChunkingPolicy:
+    """
+    When and how finely to optimize a prompt in chunks. Prompts longer than
+    ``threshold`` characters are split into chunks of about ``max_chars``
+    each, optimized concurrently and then reconciled in one pass.
+    """
+
+    def __init__(self, enabled: bool = True, threshold: int = 4000, max_chars: int = 3000):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_chars = max_chars
+
+    @classmethod
+    def from_env(cls) -> "ChunkingPolicy":
+        return cls(
+            enabled=os.getenv("CHUNKING_ENABLED", "true").lower() == "true",
+            threshold=int(os.getenv("CHUNK_THRESHOLD_CHARS", "4000")),
+            max_chars=int(os.getenv("CHUNK_MAX_CHARS", "3000")),
+        )
+
+    def applies(self, prompt: str, requested: Optional[bool] = None) -> bool:
+        """Whether to chunk ``prompt``; ``requested`` overrides the automatic choice"""
+        if requested is None:
+            return self.enabled and len(prompt) > self.threshold
+        return requested and len(prompt) > self.max_chars
@@ -0,0 +1,96 @@
+import os
+import asyncio
+import httpx
+import openai
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2 support when installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+ClientKey = Tuple[Optional[str], str, Optional[str]]
+
+
+class ClientRegistry:
+    """
+    Registry of AsyncOpenAI clients keyed by (api_key, base_url, proxy).
+
+    Every client owns a long-lived httpx.AsyncClient, so requests sharing a
+    key reuse the same keep-alive connection pool instead of opening a new
+    connection per call.
+    """
+
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_clients: Optional[int] = None,
+        http2: Optional[bool] = None,
+    ):
+        self.max_connections = max_connections or int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+        self.max_keepalive_connections = max_keepalive_connections or int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.keepalive_expiry = keepalive_expiry or float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+        self.timeout = timeout or float(os.getenv("REQUEST_TIMEOUT", "120"))
+        self.max_clients = max_clients or int(os.getenv("HTTP_MAX_CLIENTS", "32"))
+        if http2 is None:
+            http2 = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._clients: "OrderedDict[ClientKey, openai.AsyncOpenAI]" = OrderedDict()
+
+    def _build(self, key: ClientKey) -> openai.AsyncOpenAI:
+        api_key, base_url, proxy = key
+        http_client = httpx.AsyncClient(
+            proxy=proxy,
+            http2=self.http2,
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+        )
+        return openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            timeout=self.timeout,
+            # Retries and failover are handled by ResilientExecutor
+            max_retries=0,
+        )
+
+    def get(self, api_key: Optional[str], base_url: str, proxy: Optional[str] = None) -> openai.AsyncOpenAI:
+        """Return the pooled client for the key, creating it on first use"""
+        key = (api_key, base_url, proxy)
+        client = self._clients.get(key)
+        if client is not None:
+            self._clients.move_to_end(key)
+            return client
+
+        client = self._build(key)
+        self._clients[key] = client
+        while len(self._clients) > self.max_clients:
+            _, evicted = self._clients.popitem(last=False)
+            self._close_later(evicted)
+        return client
+
+    def _close_later(self, client: openai.AsyncOpenAI):
+        """Close an evicted client once requests already using it had time to finish"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        loop.call_later(self.timeout, lambda: loop.create_task(client.close()))
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    async def aclose(self):
+        """Close every pooled client; called from the application shutdown hook"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
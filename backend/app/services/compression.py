@@ -0,0 +1,317 @@
+import os
+import re
+import math
+import time
+import string
+import itertools
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from app.services.similarity import tokenize
+from app.services.tokenizer import TokenCounter
+
+_ZERO_WIDTH = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+_BLANK_LINES = re.compile(r"\n{3,}")
+# Page furniture and web chrome that pasted documents drag along
+_BOILERPLATE = re.compile(
+    r"^(?=[^\n]{0,120}$)(?:(?:page|p\.)\s*\d+(?:\s*(?:of|/)\s*\d+)?|\d+\s*/\s*\d+|(?:copyright|\(c\)|©).*|all rights reserved\.?"
+    r"|.*\b(?:accept|use)\b.*\bcookies\b.*|(?:share|follow us|subscribe|sign up)\b.{0,40}|click here\b.{0,40}"
+    r"|第\s*\d+\s*页.*|版权所有.*)$\n?",
+    re.IGNORECASE | re.MULTILINE,
+)
+# A unit is one sentence with its trailing whitespace, or a run of newlines
+_UNIT = re.compile(r"[^.!?。！？\n]*(?:[.!?]+[\"')\]]*[ \t]*|[。！？]+[”’」』）]*|\n+|$)")
+_ASCII_PUNCTUATION = str.maketrans(string.punctuation, " " * len(string.punctuation))
+
+# Sentences whose term sets overlap at least this much are near-duplicates;
+# sentences with fewer distinct terms than MIN_TERMS are only deduplicated exactly
+NEAR_DUPLICATE_JACCARD = 0.8
+MIN_TERMS = 6
+# Sentences kept per signature, and earlier sentences compared per sentence;
+# templated text, whose sentences share most draws, would otherwise make
+# dedup quadratic
+MAX_CANDIDATES = 8
+MAX_COMPARISONS = 4
+# Derives the second hash function for the MinHash draws
+_SIGNATURE_SALT = 0x5BD1E9955BD1E995
+# Bonus for sentences near the start, where documents state their point
+POSITION_WEIGHT = 0.1
+
+
+def normalize(text: str) -> str:
+    """Collapse whitespace and blank lines and drop zero-width characters and boilerplate lines"""
+    # str.split() covers every Unicode space, including NBSP and the ideographic space
+    text = "\n".join(" ".join(line.split()) for line in _ZERO_WIDTH.sub("", text).split("\n"))
+    text = _BOILERPLATE.sub("", text)
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def split_units(text: str) -> List[str]:
+    """Split text into sentence units that concatenate back to the text"""
+    return [unit for unit in _UNIT.findall(text) if unit]
+
+
+def _terms(units: List[str]) -> List[List[str]]:
+    """Lower-cased word terms of each unit; CJK text is split per character"""
+    text = "".join(units)
+    if not text.isascii():
+        return [tokenize(unit) for unit in units]
+    # Lower-casing and stripping ASCII punctuation keep offsets, so do it once
+    prepared = text.lower().translate(_ASCII_PUNCTUATION)
+    terms = []
+    start = 0
+    for unit in units:
+        terms.append(prepared[start:start + len(unit)].split())
+        start += len(unit)
+    return terms
+
+
+def _tfidf_scores(terms: List[List[str]]) -> List[float]:
+    """
+    Cosine similarity of each sentence's TF-IDF vector to the document
+    centroid, the extractive-summary score of a sentence
+    """
+    documents = sum(1 for t in terms if t)
+    df: Dict[str, int] = {}
+    for unit_terms in terms:
+        for term in set(unit_terms):
+            df[term] = df.get(term, 0) + 1
+    idf = {term: math.log((1 + documents) / (1 + count)) + 1 for term, count in df.items()}
+    vectors = []
+    centroid: Dict[str, float] = {}
+    for unit_terms in terms:
+        vector: Dict[str, float] = {}
+        for term in unit_terms:
+            vector[term] = vector.get(term, 0.0) + idf[term]
+        vectors.append(vector)
+        for term, weight in vector.items():
+            centroid[term] = centroid.get(term, 0.0) + weight
+    centroid_norm = math.sqrt(sum(w * w for w in centroid.values())) or 1.0
+    scores = []
+    for vector in vectors:
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        scores.append(sum(w * centroid[t] for t, w in vector.items()) / (norm * centroid_norm) if norm else 0.0)
+    return scores
+
+
+def _pair_signatures(terms: List[List[str]]) -> List[Optional[Tuple[int, ...]]]:
+    """
+    Four MinHash draws (smallest and largest hash under two hash functions)
+    over each sentence's word pairs, or None for sentences too short to
+    compare. Word pairs keep a common word from putting most sentences in
+    one bucket.
+    """
+    signatures = []
+    for unit_terms in terms:
+        if len(unit_terms) < MIN_TERMS:
+            signatures.append(None)
+            continue
+        hashes = list(map(hash, zip(unit_terms, unit_terms[1:])))
+        salted = [h ^ _SIGNATURE_SALT for h in hashes]
+        signatures.append((min(hashes), max(hashes), min(salted), max(salted)))
+    return signatures
+
+
+def _vectorized_scores(terms: List[List[str]]) -> Tuple[List[float], List[Optional[Tuple[int, ...]]]]:
+    """NumPy version of _tfidf_scores and _pair_signatures"""
+    flat = list(itertools.chain.from_iterable(terms))
+    if not flat:
+        return [0.0] * len(terms), [None] * len(terms)
+    vocabulary = {term: i for i, term in enumerate(dict.fromkeys(flat))}
+    size = len(vocabulary)
+    lengths = np.fromiter((len(t) for t in terms), dtype=np.int64, count=len(terms))
+    units = np.repeat(np.arange(len(terms)), lengths)
+    term_ids = np.fromiter(map(vocabulary.__getitem__, flat), dtype=np.int64, count=len(flat))
+    # One row per distinct (sentence, term) pair with its count
+    pairs, counts = np.unique(units * size + term_ids, return_counts=True)
+    pair_units, pair_terms = pairs // size, pairs % size
+    documents = int(np.count_nonzero(lengths))
+    df = np.bincount(pair_terms, minlength=size)
+    idf = np.log((1 + documents) / (1 + df)) + 1
+    weights = counts * idf[pair_terms]
+    centroid = np.bincount(pair_terms, weights=weights, minlength=size)
+    norms = np.sqrt(np.bincount(pair_units, weights=weights * weights, minlength=len(terms)))
+    dots = np.bincount(pair_units, weights=weights * centroid[pair_terms], minlength=len(terms))
+    scores = np.divide(dots, norms * (np.linalg.norm(centroid) or 1.0), out=np.zeros(len(terms)), where=norms > 0)
+
+    # Word pairs that do not straddle a sentence boundary, hashed by two multiplicative hashes
+    same_unit = units[1:] == units[:-1]
+    pair_ids = (term_ids[:-1] * size + term_ids[1:])[same_unit].astype(np.uint64)
+    pair_owner = units[1:][same_unit]
+    signatures: List[Optional[Tuple[int, ...]]] = [None] * len(terms)
+    if pair_ids.size:
+        with np.errstate(over="ignore"):
+            first = pair_ids * np.uint64(0x9E3779B97F4A7C15)
+            second = (pair_ids ^ np.uint64(_SIGNATURE_SALT)) * np.uint64(0xC2B2AE3D27D4EB4F)
+        starts = np.flatnonzero(np.r_[True, pair_owner[1:] != pair_owner[:-1]])
+        draws = np.stack([
+            np.minimum.reduceat(first, starts), np.maximum.reduceat(first, starts),
+            np.minimum.reduceat(second, starts), np.maximum.reduceat(second, starts),
+        ], axis=1).tolist()
+        for unit, draw in zip(pair_owner[starts].tolist(), draws):
+            if len(terms[unit]) >= MIN_TERMS:
+                signatures[unit] = tuple(draw)
+    return scores.tolist(), signatures
+
+
+class ContextCompressor:
+    """
+    Shrinks supplementary text (context, constraints, examples) before it
+    is sent upstream.
+
+    The pipeline normalizes whitespace and strips boilerplate lines, drops
+    exact and near-duplicate sentences, and, when the text is still above
+    the token budget, keeps the sentences closest to the TF-IDF centroid
+    of the document in their original order. Scoring is vectorized with NumPy when it is installed.
+    The text is counted once; sentences are selected by a token-per-character
+    rate prorated from that count, and only the selection, which is about the
+    size of the budget, is counted again. A text whose scoring or
+    deduplication outruns ``time_budget_ms`` (COMPRESSION_TIME_BUDGET_MS, 0
+    for none) is sent uncompressed.
+    """
+
+    def __init__(
+        self, tokens: Optional[TokenCounter] = None, enabled: bool = False, target_tokens: int = 2000, time_budget_ms: float = 50.0
+    ):
+        self.tokens = tokens or TokenCounter()
+        self.enabled = enabled
+        self.target_tokens = target_tokens
+        self.time_budget_ms = time_budget_ms
+
+    @classmethod
+    def from_env(cls, tokens: Optional[TokenCounter] = None) -> "ContextCompressor":
+        return cls(
+            tokens=tokens,
+            enabled=os.getenv("COMPRESSION_ENABLED", "false").lower() == "true",
+            target_tokens=int(os.getenv("COMPRESSION_TARGET_TOKENS", "2000")),
+            time_budget_ms=float(os.getenv("COMPRESSION_TIME_BUDGET_MS", "50")),
+        )
+
+    def _deduplicate(self, terms: List[List[str]], signatures: List[Optional[Tuple[int, ...]]]) -> List[bool]:
+        """
+        Mark sentences to keep, dropping repeats of an earlier sentence.
+        Near-duplicate candidates share a MinHash draw over word pairs with
+        an earlier sentence (with four draws a pair with word-pair Jaccard
+        similarity J is found with probability about 1 - (1 - J)^4) and are
+        confirmed by the exact Jaccard similarity of their term sets.
+        """
+        keep = []
+        seen = set()
+        kept_sets: List[frozenset] = []
+        buckets: Dict[Tuple[int, int], List[int]] = {}
+        for unit_terms, signature in zip(terms, signatures):
+            key = " ".join(unit_terms)
+            if not key:
+                keep.append(True)
+                continue
+            duplicate = key in seen
+            seen.add(key)
+            if not duplicate and signature is not None:
+                term_set = frozenset(unit_terms)
+                size = len(term_set)
+                candidates = list(enumerate(signature))
+                # Earlier sentences sharing more than one draw are the likeliest
+                # near-duplicates; with none, only the newest candidate is compared
+                ids = [other_id for candidate in candidates for other_id in buckets.get(candidate, ())]
+                found, repeated = set(), []
+                for other_id in ids:
+                    if other_id in found:
+                        repeated.append(other_id)
+                    found.add(other_id)
+                for other_id in list(dict.fromkeys(repeated or ids[-1:]))[:MAX_COMPARISONS]:
+                    other = kept_sets[other_id]
+                    # Sizes bound the Jaccard similarity, which skips most set operations
+                    if NEAR_DUPLICATE_JACCARD * len(other) <= size and NEAR_DUPLICATE_JACCARD * size <= len(other):
+                        common = len(term_set & other)
+                        if common >= NEAR_DUPLICATE_JACCARD * (size + len(other) - common):
+                            duplicate = True
+                            break
+                if not duplicate:
+                    kept_sets.append(term_set)
+                    for candidate in candidates:
+                        bucket = buckets.setdefault(candidate, [])
+                        bucket.append(len(kept_sets) - 1)
+                        if len(bucket) > MAX_CANDIDATES:
+                            del bucket[0]
+            keep.append(not duplicate)
+        return keep
+
+    def _select(self, units: List[str], terms: List[List[str]], keep: List[bool], ranked: List[int], max_chars: float) -> List[bool]:
+        """Take sentences in rank order while they fit ``max_chars``, keeping their original order"""
+        # Units without terms (blank lines, stray punctuation) stay so the
+        # kept sentences keep their paragraph structure
+        selected = [kept and not terms[i] for i, kept in enumerate(keep)]
+        used = sum(len(units[i]) for i, chosen in enumerate(selected) if chosen)
+        for i in ranked:
+            if used + len(units[i]) <= max_chars:
+                selected[i] = True
+                used += len(units[i])
+        return selected
+
+    def _out_of_time(self, started: float) -> bool:
+        return bool(self.time_budget_ms) and (time.perf_counter() - started) * 1000 > self.time_budget_ms
+
+    def compress(self, text: str, target_tokens: Optional[int] = None, model: str = "gpt-4.1") -> dict:
+        """
+        Compress ``text`` to at most ``target_tokens`` (default
+        COMPRESSION_TARGET_TOKENS; 0 only normalizes and deduplicates).
+        Returns the text, token counts before and after, tokens removed,
+        sentences removed, elapsed milliseconds and whether the time budget
+        ran out, in which case the text is returned unchanged.
+        """
+        started = time.perf_counter()
+        budget = self.target_tokens if target_tokens is None else target_tokens
+        original_tokens = self.tokens.count(text, model)
+        units = split_units(normalize(text))
+        terms = _terms(units)
+        if np is not None:
+            scores, signatures = _vectorized_scores(terms)
+        else:
+            scores, signatures = _tfidf_scores(terms), _pair_signatures(terms)
+        if self._out_of_time(started):
+            return self._result(text, original_tokens, original_tokens, 0, started, timed_out=True)
+        keep = self._deduplicate(terms, signatures)
+        if self._out_of_time(started):
+            return self._result(text, original_tokens, original_tokens, 0, started, timed_out=True)
+
+        tokens_per_char = original_tokens / max(1, len(text))
+        kept_chars = sum(len(unit) for unit, kept in zip(units, keep) if kept)
+        if budget and kept_chars * tokens_per_char > budget:
+            ranked = sorted(
+                (i for i, kept in enumerate(keep) if kept and terms[i]),
+                key=lambda i: scores[i] + POSITION_WEIGHT * (1 - i / len(units)),
+                reverse=True,
+            )
+            # Only the selection, which is about the size of the budget, is counted again
+            target = budget
+            for _ in range(2):
+                selected = self._select(units, terms, keep, ranked, target / tokens_per_char)
+                compressed = normalize("".join(unit for unit, kept in zip(units, selected) if kept))
+                tokens = self.tokens.count(compressed, model)
+                if tokens <= budget:
+                    break
+                # The prorated estimate was low for the sentences kept; tighten once
+                target = budget * budget / tokens
+            keep = selected
+        else:
+            compressed = normalize("".join(unit for unit, kept in zip(units, keep) if kept))
+            tokens = self.tokens.count(compressed, model) if compressed != text else original_tokens
+        return self._result(
+            compressed, original_tokens, tokens, sum(1 for i, kept in enumerate(keep) if not kept and terms[i]), started
+        )
+
+    def _result(self, text: str, original_tokens: int, tokens: int, sentences_removed: int, started: float, timed_out: bool = False) -> dict:
+        # The caller records the metrics: compress may run on a worker thread
+        return {
+            "text": text,
+            "original_tokens": original_tokens,
+            "tokens": tokens,
+            "tokens_removed": max(0, original_tokens - tokens),
+            "sentences_removed": sentences_removed,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+            "timed_out": timed_out,
+        }
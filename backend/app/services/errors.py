@@ -0,0 +1,78 @@
+import math
+from typing import Dict, Optional
+
+
+class ServiceError(Exception):
+    """
+    Base class for service errors that map onto a specific HTTP status.
+    Routes translate these into HTTPException instead of a generic 500.
+    """
+    status_code = 500
+
+    def __init__(self, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.message = message
+        self.headers = headers or {}
+
+
+class AdmissionRejected(ServiceError):
+    """The request could not be admitted before its deadline"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, {"Retry-After": str(max(1, math.ceil(retry_after)))})
+        self.retry_after = retry_after
+
+
+class RateLimited(AdmissionRejected):
+    """The API key exceeded its request or token rate"""
+    status_code = 429
+
+
+class TokenBudgetExceeded(ServiceError):
+    """The prompt cannot fit the model's context window or the configured input budget"""
+    status_code = 413
+
+
+class TemplateNotFound(ServiceError):
+    """The requested prompt template version is not registered"""
+    status_code = 400
+
+
+class CallbackRejected(ServiceError):
+    """The job's callback URL is not an allowed public HTTP(S) endpoint"""
+    status_code = 422
+
+
+class JobCredentialsLost(ServiceError):
+    """The job's API key, which is only held in memory, was lost in a restart"""
+    status_code = 409
+
+
+class PreflightFailed(ServiceError):
+    """The local prompt analyzer found errors in the prompt"""
+    status_code = 422
+
+
+class UpstreamError(ServiceError):
+    """The upstream LLM call failed after retries and failover"""
+    status_code = 502
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        if status_code is not None:
+            self.status_code = status_code
+
+
+class UpstreamUnavailable(AdmissionRejected):
+    """Every upstream target has an open circuit"""
+    status_code = 503
+
+
+class QuotaExceeded(ServiceError):
+    """The tenant has used up its hard usage quota for the current period"""
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message, {"Retry-After": str(max(1, math.ceil(retry_after)))})
+        self.retry_after = retry_after
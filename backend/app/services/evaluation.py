@@ -0,0 +1,257 @@
+import os
+import re
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.models.schemas import EvaluationCase, EvaluationRequest
+from app.services.admission import LANE_BULK, current_lane
+from app.services.compression import normalize
+from app.services.logs import log_event
+from app.services.metrics import JSON_PARSE_FALLBACKS
+from app.services.similarity import shingles
+from app.services.structured import loads
+
+EVAL_MAX_CONCURRENCY = int(os.getenv("EVAL_MAX_CONCURRENCY", "8"))
+EVAL_MAX_CELLS = int(os.getenv("EVAL_MAX_CELLS", "1000"))
+EVAL_JUDGE_MODEL = os.getenv("EVAL_JUDGE_MODEL", "gpt-4.1-mini")
+# A prompt containing this field gets the test input substituted into it
+INPUT_FIELD = "{input}"
+# Score difference below which a cell is a tie
+TIE_MARGIN = 0.05
+# Weights of the heuristic score; the reference weight only applies when the case has an expected output
+COMPLETION_WEIGHT = 0.4
+FORMAT_WEIGHT = 0.3
+REFERENCE_WEIGHT = 0.3
+JUDGE_MAX_TOKENS = 400
+
+_WANTS_JSON = re.compile(r"\bjson\b", re.IGNORECASE)
+_REFUSAL = re.compile(r"^\s*(i'?m sorry|i am sorry|sorry, i can|i can(?:no|')t help|as an ai\b|抱歉|对不起)", re.IGNORECASE)
+
+
+class Execution:
+    """Sampling parameters of one evaluation call, shaped like the requests the service sends"""
+
+    def __init__(self, model: str, max_tokens: int, temperature: float, api_key: Optional[str], base_url: Optional[str], cache: Optional[str]):
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache = cache
+
+
+def render(prompt: str, case: Optional[EvaluationCase]) -> Tuple[str, str]:
+    """
+    System and user message of one execution: the prompt is the system
+    message and the input the user message, unless the prompt has an
+    ``{input}`` field; without a case the prompt runs on its own
+    """
+    if case is None:
+        return "", prompt
+    if INPUT_FIELD in prompt:
+        return "", prompt.replace(INPUT_FIELD, case.input)
+    return prompt, case.input
+
+
+def _winner(original: float, optimized: float) -> str:
+    if abs(optimized - original) < TIE_MARGIN:
+        return "tie"
+    return "optimized" if optimized > original else "original"
+
+
+class HeuristicJudge:
+    """
+    Scores each output locally: it finished without being truncated or
+    refused, it is valid JSON when the task asks for JSON, and it overlaps
+    the expected output when the case has one. It cannot tell which of two
+    good open-ended answers is better; use the LLM judge for that.
+    """
+
+    name = "heuristic"
+
+    def score(self, task: str, case: Optional[EvaluationCase], run: dict) -> Tuple[float, List[str]]:
+        output = run["output"] or ""
+        problems = []
+        completed = 1.0
+        if run["finish_reason"] != "stop":
+            completed, problems = 0.0, problems + [f"finish_reason {run['finish_reason']}"]
+        elif not output.strip() or _REFUSAL.match(output):
+            completed, problems = 0.0, problems + ["empty or refused"]
+        formatted = 1.0
+        if _WANTS_JSON.search(task):
+            try:
+                loads(output)
+            except ValueError:
+                formatted, problems = 0.0, problems + ["not valid JSON"]
+        score = COMPLETION_WEIGHT * completed + FORMAT_WEIGHT * formatted
+        if case is None or case.expected is None:
+            return score / (COMPLETION_WEIGHT + FORMAT_WEIGHT), problems
+        produced, expected = set(shingles(normalize(output))), set(shingles(normalize(case.expected)))
+        overlap = len(produced & expected) / len(produced | expected) if produced | expected else 1.0
+        return score + REFERENCE_WEIGHT * overlap, problems
+
+    async def judge(self, task: str, case: Optional[EvaluationCase], original: dict, optimized: dict, execution: Execution) -> dict:
+        original_score, original_problems = self.score(task, case, original)
+        optimized_score, optimized_problems = self.score(task, case, optimized)
+        notes = [f"{side}: {', '.join(problems)}" for side, problems in (("original", original_problems), ("optimized", optimized_problems)) if problems]
+        return {
+            "winner": _winner(original_score, optimized_score),
+            "scores": {"original": round(original_score, 4), "optimized": round(optimized_score, 4)},
+            "rationale": "; ".join(notes) or "both outputs pass the local checks",
+        }
+
+
+class LLMJudge:
+    """
+    Asks a judge model to compare the two outputs with the ``judge``
+    template. The answers are shown in an order derived from their content,
+    so position bias does not favour either prompt across a run, and the
+    verdict goes through the response cache like any other completion.
+    """
+
+    name = "llm"
+
+    def __init__(self, service, model: str):
+        self.service = service
+        self.model = model
+
+    async def judge(self, task: str, case: Optional[EvaluationCase], original: dict, optimized: dict, execution: Execution) -> dict:
+        outputs = {"original": original["output"] or "", "optimized": optimized["output"] or ""}
+        digest = hashlib.sha256("\x00".join([task, case.input if case else "", outputs["original"], outputs["optimized"]]).encode("utf-8")).digest()
+        order = ("optimized", "original") if digest[0] % 2 else ("original", "optimized")
+        template = self.service.templates.get("judge")
+        user_prompt = template.render_user(
+            "general", task=task, input=case.input if case else "(none)", answer_a=outputs[order[0]], answer_b=outputs[order[1]]
+        )
+        judge = Execution(self.model, JUDGE_MAX_TOKENS, 0.0, execution.api_key, execution.base_url, execution.cache)
+        completion = await self.service._chat_completion(judge, template.system_prompt, user_prompt, template.response_format)
+        try:
+            verdict = loads(completion["content"])
+            scores = {order[0]: float(verdict["score_a"]), order[1]: float(verdict["score_b"])}
+            winner = {"A": order[0], "B": order[1]}.get(str(verdict["winner"]).strip().upper(), "tie")
+        except (ValueError, KeyError, TypeError):
+            JSON_PARSE_FALLBACKS.inc(kind="judge")
+            log_event("json_parse_fallback", logging.WARNING, kind="judge", model=self.model)
+            return {"winner": "tie", "scores": {"original": None, "optimized": None}, "rationale": "The judge's verdict could not be parsed"}
+        return {
+            "winner": winner,
+            "scores": {side: round(score, 4) for side, score in scores.items()},
+            "rationale": verdict.get("rationale", ""),
+        }
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+def _delta(original: Optional[float], optimized: Optional[float]) -> Optional[float]:
+    return round(optimized - original, 8) if original is not None and optimized is not None else None
+
+
+def summarize(cells: List[dict]) -> Dict[str, object]:
+    """Win rates and latency, token and cost deltas (optimized minus original) over completed cells"""
+    total = len(cells)
+    wins = {side: sum(1 for cell in cells if cell["winner"] == side) for side in ("optimized", "original", "tie")}
+    latency = {side: _mean([cell[side]["latency_ms"] for cell in cells]) for side in ("original", "optimized")}
+    tokens = {side: _mean([cell[side]["prompt_tokens"] + cell[side]["completion_tokens"] for cell in cells]) for side in ("original", "optimized")}
+    cost = {side: round(sum(cell[side]["cost_usd"] for cell in cells), 8) for side in ("original", "optimized")}
+    return {
+        "cells": total,
+        "win_rate": {side: round(count / total, 4) if total else None for side, count in wins.items()},
+        "score": {side: _mean([cell["scores"][side] for cell in cells]) for side in ("original", "optimized")},
+        "latency_ms": {**latency, "delta": _delta(latency["original"], latency["optimized"])},
+        "tokens": {**tokens, "delta": _delta(tokens["original"], tokens["optimized"])},
+        "cost_usd": {**cost, "delta": _delta(cost["original"], cost["optimized"])},
+    }
+
+
+class Evaluator:
+    """
+    Runs the original and optimized prompt on every (input, model) cell
+    with at most ``concurrency`` upstream calls in flight, judges each cell
+    as soon as both outputs are in and yields the cell records in
+    completion order, followed by a summary.
+
+    Executions go through the response cache, so re-running an evaluation
+    only pays for what changed. A cached execution reports the latency of
+    the upstream call that produced it.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    @staticmethod
+    def cell_count(request: EvaluationRequest) -> int:
+        return max(1, len(request.inputs)) * len(request.models)
+
+    def _judge(self, request: EvaluationRequest):
+        if request.judge == "llm":
+            return LLMJudge(self.service, request.judge_model or EVAL_JUDGE_MODEL)
+        return HeuristicJudge()
+
+    async def _execute(self, execution: Execution, prompt: str, case: Optional[EvaluationCase], slots: asyncio.Semaphore) -> dict:
+        system_prompt, user_prompt = render(prompt, case)
+        async with slots:
+            completion = await self.service._chat_completion(execution, system_prompt, user_prompt, None)
+        usage = completion["usage"]
+        model = completion.get("model") or execution.model
+        return {
+            "output": completion["content"],
+            "finish_reason": completion["finish_reason"],
+            "model": model,
+            "latency_ms": completion.get("latency_ms"),
+            "prompt_tokens": usage["prompt_tokens"] or 0,
+            "completion_tokens": usage["completion_tokens"] or 0,
+            "cost_usd": self.service.catalog.estimate_cost(model, usage["prompt_tokens"] or 0, usage["completion_tokens"] or 0),
+            "cached": bool(completion.get("cached")),
+        }
+
+    async def _cell(self, request: EvaluationRequest, judge, index: int, case_index: Optional[int], model: str, slots: asyncio.Semaphore) -> dict:
+        # Evaluations queue behind interactive requests for upstream slots
+        current_lane.set(LANE_BULK)
+        record = {"type": "cell", "index": index, "input_index": case_index, "model": model}
+        case = request.inputs[case_index] if case_index is not None else None
+        execution = Execution(model, request.max_tokens, request.temperature, request.api_key, request.base_url, request.cache)
+        try:
+            original, optimized = await asyncio.gather(
+                self._execute(execution, request.original_prompt, case, slots),
+                self._execute(execution, request.optimized_prompt, case, slots),
+            )
+            async with slots:
+                verdict = await judge.judge(request.original_prompt, case, original, optimized, execution)
+        except Exception as e:
+            return {**record, "status": "error", "error": getattr(e, "message", None) or str(e)}
+        return {**record, "status": "ok", "original": original, "optimized": optimized, **verdict}
+
+    async def run(self, request: EvaluationRequest) -> AsyncIterator[dict]:
+        concurrency = max(1, min(request.concurrency or EVAL_MAX_CONCURRENCY, EVAL_MAX_CONCURRENCY))
+        slots = asyncio.Semaphore(concurrency)
+        judge = self._judge(request)
+        case_indices = list(range(len(request.inputs))) or [None]
+        cells = [(case_index, model) for model in request.models for case_index in case_indices]
+        tasks = [
+            asyncio.ensure_future(self._cell(request, judge, index, case_index, model, slots))
+            for index, (case_index, model) in enumerate(cells)
+        ]
+        completed: List[dict] = []
+        errors = 0
+        try:
+            for next_cell in asyncio.as_completed(tasks):
+                record = await next_cell
+                if record["status"] == "ok":
+                    completed.append(record)
+                else:
+                    errors += 1
+                yield record
+        finally:
+            # Stop outstanding upstream calls if the client went away early
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        summary = {"type": "summary", "judge": judge.name, "total": len(cells), "errors": errors, **summarize(completed)}
+        summary["by_model"] = {model: summarize([cell for cell in completed if cell["model"] == model]) for model in request.models}
+        log_event("evaluation_finished", cells=len(cells), errors=errors, judge=judge.name, win_rate=summary["win_rate"])
+        yield summary
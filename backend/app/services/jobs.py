@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.services.admission import LANE_BULK, current_lane
+from app.services.errors import AdmissionRejected, CallbackRejected, JobCredentialsLost, ServiceError
+from app.services.logs import log_event
+from app.services.storage import connect, transaction
+from app.services.tenants import DEFAULT_TENANT, tenant_id
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+# Stored in place of a job's API key, which is only held in memory
+API_KEY_WITHHELD = "withheld"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    request TEXT NOT NULL,
+    callback_url TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    error_status INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    callback_status TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_fingerprint ON jobs (fingerprint) WHERE status IN ('queued', 'running');
+"""
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+def job_fingerprint(kind: str, request: Dict[str, Any], callback_url: Optional[str], tenant: str = DEFAULT_TENANT) -> str:
+    encoded = json.dumps([kind, request, callback_url, tenant], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class JobStore:
+    """
+    SQLite job table in WAL mode. All statements run on one dedicated
+    thread, which serializes access without blocking the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.path, SCHEMA)
+        return self._conn
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connect()))
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        return dict(row) if row is not None else None
+
+    async def recover(self, max_attempts: int) -> int:
+        """Requeue jobs that were running when the process stopped; fail those out of attempts"""
+        def recover(conn: sqlite3.Connection) -> int:
+            with transaction(conn):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = 'Interrupted too many times', finished_at = ? "
+                    "WHERE status = ? AND attempts >= ?",
+                    (JOB_FAILED, time.time(), JOB_RUNNING, max_attempts),
+                )
+                return conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (JOB_QUEUED, JOB_RUNNING)
+                ).rowcount
+        return await self._run(recover)
+
+    async def submit(
+        self, kind: str, request: Dict[str, Any], callback_url: Optional[str], tenant: str = DEFAULT_TENANT
+    ) -> Dict[str, Any]:
+        """Insert a job, or return the identical job of the same tenant that is still queued or running"""
+        fingerprint = job_fingerprint(kind, request, callback_url, tenant)
+
+        def submit(conn: sqlite3.Connection) -> Dict[str, Any]:
+            with transaction(conn):
+                existing = conn.execute(
+                    "SELECT * FROM jobs WHERE fingerprint = ? AND status IN (?, ?)", (fingerprint, *ACTIVE_STATUSES)
+                ).fetchone()
+                if existing is not None:
+                    return {**dict(existing), "deduplicated": True}
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, fingerprint, request, callback_url, status, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, fingerprint, json.dumps(request, ensure_ascii=False), callback_url, JOB_QUEUED, time.time()),
+                )
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                return {**dict(row), "deduplicated": False}
+        return await self._run(submit)
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        """Mark the oldest queued job as running and return it"""
+        def claim(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            with transaction(conn):
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (JOB_RUNNING, time.time(), row["id"]),
+                )
+                return self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+        return await self._run(claim)
+
+    async def finish(self, job_id: str, result: Optional[Dict[str, Any]], error: Optional[str] = None, error_status: Optional[int] = None):
+        status = JOB_FAILED if error is not None else JOB_SUCCEEDED
+        payload = json.dumps(result, ensure_ascii=False) if result is not None else None
+
+        def finish(conn: sqlite3.Connection):
+            with transaction(conn):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, error_status = ?, finished_at = ? WHERE id = ?",
+                    (status, payload, error, error_status, time.time(), job_id),
+                )
+        await self._run(finish)
+
+    async def requeue(self, job_id: str, count_attempt: bool = True):
+        """Put a claimed job back in the queue; ``count_attempt=False`` takes back the attempt the claim counted"""
+        def requeue(conn: sqlite3.Connection):
+            with transaction(conn):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL, attempts = attempts - ? WHERE id = ?",
+                    (JOB_QUEUED, 0 if count_attempt else 1, job_id),
+                )
+        await self._run(requeue)
+
+    async def set_callback_status(self, job_id: str, callback_status: str):
+        def update(conn: sqlite3.Connection):
+            with transaction(conn):
+                conn.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id))
+        await self._run(update)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(lambda conn: self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()))
+
+    async def purge(self, older_than: float) -> int:
+        def purge(conn: sqlite3.Connection) -> int:
+            with transaction(conn):
+                return conn.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                    (JOB_SUCCEEDED, JOB_FAILED, time.time() - older_than),
+                ).rowcount
+        return await self._run(purge)
+
+    async def counts(self) -> Dict[str, int]:
+        rows = await self._run(lambda conn: conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall())
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED)}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    async def close(self):
+        def close(_conn: sqlite3.Connection):
+            self._conn.close()
+            self._conn = None
+        if self._conn is not None:
+            await self._run(close)
+        self._executor.shutdown(wait=False)
+
+
+class JobQueue:
+    """
+    Durable background job queue for long optimizations and generations.
+
+    Jobs are persisted in SQLite before they are acknowledged and run on a
+    bounded pool of worker tasks in the bulk admission lane. Jobs that were
+    running when the process stopped are requeued on start. Submitting a job
+    identical to one still queued or running returns the existing job.
+    Results can be polled, long-polled, or pushed to a callback URL.
+
+    A job's API key is held in memory only and never written to the
+    database; a job recovered after a restart that needed one fails and
+    has to be submitted again. Callback URLs must resolve to public
+    addresses, or name a host in ``callback_hosts``
+    (JOBS_CALLBACK_HOSTS), checked on submit and again before delivery.
+
+    Recovery on start assumes one backend process owns the database file.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: Dict[str, JobHandler],
+        workers: int = 4,
+        max_attempts: int = 3,
+        retention: float = 7 * 86400,
+        callback_timeout: float = 10.0,
+        callback_attempts: int = 3,
+        callback_hosts: Optional[List[str]] = None,
+    ):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.callback_timeout = callback_timeout
+        self.callback_attempts = callback_attempts
+        self.callback_hosts = {host.lower() for host in callback_hosts or ()}
+        self._wakeup = asyncio.Event()
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+        self._api_keys: Dict[str, str] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._callbacks: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def from_env(cls, handlers: Dict[str, JobHandler]) -> "JobQueue":
+        return cls(
+            JobStore(os.getenv("JOBS_DB_PATH", "data/jobs.db")),
+            handlers,
+            workers=int(os.getenv("JOBS_WORKERS", "4")),
+            max_attempts=int(os.getenv("JOBS_MAX_ATTEMPTS", "3")),
+            retention=float(os.getenv("JOBS_RETENTION", str(7 * 86400))),
+            callback_timeout=float(os.getenv("JOBS_CALLBACK_TIMEOUT", "10")),
+            callback_hosts=[host.strip() for host in os.getenv("JOBS_CALLBACK_HOSTS", "").split(",") if host.strip()],
+        )
+
+    async def start(self):
+        recovered = await self.store.recover(self.max_attempts)
+        await self.store.purge(self.retention)
+        if recovered:
+            log_event("jobs_recovered", count=recovered)
+        self._callbacks = httpx.AsyncClient(timeout=self.callback_timeout)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._callbacks is not None:
+            await self._callbacks.aclose()
+        await self.store.close()
+
+    async def submit(self, kind: str, request: Dict[str, Any], callback_url: Optional[str] = None) -> Dict[str, Any]:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if callback_url:
+            await self._check_callback(callback_url)
+        api_key = request.get("api_key")
+        stored = {**request, "api_key": API_KEY_WITHHELD if api_key else None}
+        job = await self.store.submit(kind, stored, callback_url, tenant_id(api_key))
+        if api_key and job["status"] in ACTIVE_STATUSES:
+            # A deduplicated job belongs to the same tenant, so the key is the same
+            self._api_keys.setdefault(job["id"], api_key)
+        self._wakeup.set()
+        return job
+
+    async def _check_callback(self, url: str):
+        """Raise CallbackRejected unless ``url`` is allowed to receive job results"""
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        if parts.scheme not in ("http", "https") or not host:
+            raise CallbackRejected("Callback URL must be an http or https URL")
+        if self.callback_hosts:
+            if host not in self.callback_hosts:
+                raise CallbackRejected(f"Callback host {host} is not in JOBS_CALLBACK_HOSTS")
+            return
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or (443 if parts.scheme == "https" else 80))
+        except OSError:
+            raise CallbackRejected(f"Callback host {host} cannot be resolved")
+        # Loopback, private, link-local and reserved addresses would let callers reach internal services
+        if not all(ipaddress.ip_address(info[4][0].split("%")[0]).is_global for info in infos):
+            raise CallbackRejected(f"Callback host {host} does not resolve to a public address")
+
+    async def get(self, job_id: str, wait: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Return the job, waiting up to ``wait`` seconds for it to finish"""
+        job = await self.store.get(job_id)
+        if job is None or wait <= 0 or job["status"] not in ACTIVE_STATUSES:
+            return job
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            # Re-read after registering so a job finishing in between is not missed
+            job = await self.store.get(job_id)
+            if job["status"] not in ACTIVE_STATUSES:
+                return job
+            try:
+                await asyncio.wait_for(event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            return await self.store.get(job_id)
+        finally:
+            # The last waiter to leave drops the event, whether or not the job finished
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                self._finished.pop(job_id, None)
+
+    async def _worker(self):
+        # Background jobs queue behind interactive requests for upstream slots
+        current_lane.set(LANE_BULK)
+        while True:
+            try:
+                job = await self.store.claim()
+            except Exception as e:
+                # A locked or unavailable database must not stop the worker for good
+                log_event("job_claim_failed", logging.ERROR, error=str(e))
+                await asyncio.sleep(5.0)
+                continue
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                log_event("job_run_failed", logging.ERROR, job_id=job["id"], error=str(e))
+
+    async def _run(self, job: Dict[str, Any]):
+        started = time.perf_counter()
+        try:
+            request = json.loads(job["request"])
+            if request.get("api_key") == API_KEY_WITHHELD:
+                request["api_key"] = self._api_keys.get(job["id"])
+                if request["api_key"] is None:
+                    raise JobCredentialsLost("The job's API key is not kept across restarts; submit the job again")
+            result = await self.handlers[job["kind"]](request)
+            await self.store.finish(job["id"], result)
+        except asyncio.CancelledError:
+            # Shutting down: leave the job for the next start
+            await asyncio.shield(self.store.requeue(job["id"]))
+            raise
+        except AdmissionRejected as e:
+            # The server is saturated with interactive traffic; jobs can wait,
+            # and waiting does not count towards JOBS_MAX_ATTEMPTS
+            await self.store.requeue(job["id"], count_attempt=False)
+            await asyncio.sleep(e.retry_after)
+            return
+        except ServiceError as e:
+            await self.store.finish(job["id"], None, e.message, e.status_code)
+        except Exception as e:
+            await self.store.finish(job["id"], None, str(e), 500)
+        self._api_keys.pop(job["id"], None)
+        finished = await self.store.get(job["id"])
+        log_event(
+            "job_finished",
+            job_id=job["id"],
+            kind=job["kind"],
+            status=finished["status"],
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        event = self._finished.pop(job["id"], None)
+        if event is not None:
+            event.set()
+        if finished["callback_url"]:
+            await self._deliver(finished)
+
+    async def _deliver(self, job: Dict[str, Any]):
+        """POST the finished job to its callback URL, retrying with backoff"""
+        try:
+            # Checked again: the host may resolve elsewhere by now
+            await self._check_callback(job["callback_url"])
+        except CallbackRejected as e:
+            await self.store.set_callback_status(job["id"], f"rejected: {e.message}")
+            return
+        status = "failed"
+        for attempt in range(self.callback_attempts):
+            try:
+                response = await self._callbacks.post(job["callback_url"], json=job_view(job))
+                if response.status_code < 300:
+                    status = "delivered"
+                    break
+                status = f"failed: HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                status = f"failed: {type(e).__name__}"
+            if attempt < self.callback_attempts - 1:
+                await asyncio.sleep(2 ** attempt)
+        await self.store.set_callback_status(job["id"], status)
+
+    async def _maintenance(self):
+        while True:
+            await asyncio.sleep(3600)
+            await self.store.purge(self.retention)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "jobs": await self.store.counts()}
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public representation of a job row; the stored request is never returned"""
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "result": json.loads(job["result"]) if job.get("result") else None,
+        "error": job.get("error"),
+        "error_status": job.get("error_status"),
+        "attempts": job.get("attempts", 0),
+        "callback_status": job.get("callback_status"),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "deduplicated": bool(job.get("deduplicated", False)),
+    }
@@ -0,0 +1,245 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+# Parser events:
+#   ("delta", key, text)          new characters of a top-level string value
+#   ("item", key, index, value)   a completed element of a top-level array
+#   ("field", key, value)         a completed top-level field
+Event = Tuple[Any, ...]
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """
+    Incremental parser for the flat JSON objects returned by structured
+    completions.
+
+    Text is fed chunk by chunk as it streams from the upstream and the parser
+    reports top-level string values while they are still being written,
+    array elements as soon as each one is closed and every field once its
+    value is complete. Anything before the opening brace (for example a
+    markdown code fence) is ignored.
+    """
+
+    def __init__(self):
+        self.text_parts: List[str] = []
+        self.done = False
+        self.fields = {}
+        self._started = False
+        self._depth = 0
+        self._expect = "key"          # key | colon | value | comma (top level only)
+        self._key: Optional[str] = None
+        self._key_raw: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._unicode_left = 0
+        self._string_role: Optional[str] = None   # key | value | item | nested
+        self._value_raw: Optional[List[str]] = None
+        self._value_kind: Optional[str] = None    # string | container | scalar
+        self._array_index = 0
+        self._item_raw: Optional[List[str]] = None
+        self._item_kind: Optional[str] = None
+        self._delta_raw: List[str] = []
+        self._delta_safe = 0
+        self._pending_surrogate = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.text_parts)
+
+    def open_string(self) -> Optional[Tuple[str, str]]:
+        """
+        Key and text so far of a top-level string value that is still open,
+        e.g. because the completion was cut off inside it
+        """
+        if self._string_role != "value" or not self._value_raw:
+            return None
+        raw = "".join(self._value_raw[1:])
+        # Drop an escape sequence that was cut off midway
+        for end in range(len(raw), max(-1, len(raw) - 12), -1):
+            try:
+                text = json.loads('"' + raw[:end] + '"')
+            except ValueError:
+                continue
+            if text and "\ud800" <= text[-1] <= "\udbff":
+                # Half of a surrogate pair cannot be encoded on its own
+                text = text[:-1]
+            return self._key, text
+        return None
+
+    def feed(self, chunk: str) -> List[Event]:
+        """Consume the next chunk of completion text and return new events"""
+        self.text_parts.append(chunk)
+        events: List[Event] = []
+        for char in chunk:
+            if self.done:
+                break
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._in_string:
+                self._string_char(char, events)
+            else:
+                self._structural_char(char, events)
+        self._flush_delta(events)
+        return events
+
+    # -- strings -------------------------------------------------------------
+
+    def _string_char(self, char: str, events: List[Event]):
+        closing = not self._escape and self._unicode_left == 0 and char == '"'
+        if self._value_raw is not None:
+            self._value_raw.append(char)
+        if self._item_raw is not None:
+            self._item_raw.append(char)
+        if closing:
+            self._in_string = False
+            self._close_string(events)
+            return
+
+        if self._string_role == "key":
+            self._key_raw.append(char)
+        elif self._string_role == "value":
+            self._delta_raw.append(char)
+
+        if self._escape:
+            self._escape = False
+            if char == "u":
+                self._unicode_left = 4
+            else:
+                self._mark_safe()
+        elif self._unicode_left:
+            self._unicode_left -= 1
+            if self._unicode_left == 0:
+                code = int("".join(self._delta_raw[-4:]), 16) if self._string_role == "value" else 0
+                if 0xD800 <= code <= 0xDBFF:
+                    self._pending_surrogate = True
+                else:
+                    self._pending_surrogate = False
+                    self._mark_safe()
+        elif char == "\\":
+            self._escape = True
+        else:
+            self._mark_safe()
+
+    def _mark_safe(self):
+        if self._string_role == "value" and not self._pending_surrogate:
+            self._delta_safe = len(self._delta_raw)
+
+    def _flush_delta(self, events: List[Event]):
+        if self._string_role == "value":
+            self._emit_delta(events, self._delta_safe)
+
+    def _emit_delta(self, events: List[Event], end: int):
+        if not end:
+            return
+        raw = "".join(self._delta_raw[:end])
+        del self._delta_raw[:end]
+        self._delta_safe = 0
+        events.append(("delta", self._key, json.loads('"' + raw + '"')))
+
+    def _close_string(self, events: List[Event]):
+        role = self._string_role
+        self._string_role = None
+        if role == "key":
+            self._key = json.loads('"' + "".join(self._key_raw) + '"')
+            self._key_raw = []
+            self._expect = "colon"
+        elif role == "value":
+            self._emit_delta(events, len(self._delta_raw))
+            self._complete_value(events)
+        elif role == "item":
+            self._complete_item(events)
+
+    # -- structure -----------------------------------------------------------
+
+    def _structural_char(self, char: str, events: List[Event]):
+        # A bare scalar (number, true, false, null) ends at the next delimiter
+        if self._item_kind == "scalar" and (char in _WHITESPACE or char in ",]"):
+            self._complete_item(events)
+        elif self._value_kind == "scalar" and (char in _WHITESPACE or char in ",}"):
+            self._complete_value(events)
+
+        if self._depth == 1:
+            self._top_level_char(char, events)
+            return
+
+        in_top_array = self._depth == 2 and self._value_kind == "container" and self._value_raw[0] == "["
+        if in_top_array and self._item_raw is None and char not in _WHITESPACE and char not in ",]":
+            self._item_raw = []
+            self._item_kind = "string" if char == '"' else "container" if char in "[{" else "scalar"
+
+        if self._value_raw is not None:
+            self._value_raw.append(char)
+        if self._item_raw is not None:
+            self._item_raw.append(char)
+
+        if char == '"':
+            self._in_string = True
+            self._string_role = "item" if in_top_array else "nested"
+        elif char in "[{":
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+            if self._item_kind == "container" and self._depth == 2:
+                self._complete_item(events)
+            if self._depth == 1:
+                self._complete_value(events)
+
+    def _top_level_char(self, char: str, events: List[Event]):
+        if self._value_kind == "scalar":
+            self._value_raw.append(char)
+            return
+        if char in _WHITESPACE:
+            return
+        if char == "}":
+            self.done = True
+            return
+        if self._expect == "key":
+            if char == '"':
+                self._in_string = True
+                self._string_role = "key"
+        elif self._expect == "colon":
+            if char == ":":
+                self._expect = "value"
+        elif self._expect == "value":
+            self._value_raw = [char]
+            if char == '"':
+                self._value_kind = "string"
+                self._in_string = True
+                self._string_role = "value"
+            elif char in "[{":
+                self._value_kind = "container"
+                self._array_index = 0
+                self._depth += 1
+            else:
+                self._value_kind = "scalar"
+        elif self._expect == "comma":
+            if char == ",":
+                self._expect = "key"
+
+    def _complete_item(self, events: List[Event]):
+        raw = "".join(self._item_raw).strip()
+        self._item_raw = None
+        self._item_kind = None
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        events.append(("item", self._key, self._array_index, value))
+        self._array_index += 1
+
+    def _complete_value(self, events: List[Event]):
+        raw = "".join(self._value_raw).strip()
+        self._value_raw = None
+        self._value_kind = None
+        self._expect = "comma"
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        self.fields[self._key] = value
+        events.append(("field", self._key, value))
@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import uuid
+import zlib
+import logging
+from contextvars import ContextVar
+from typing import Optional
+
+# Request ID of the HTTP request being served by the current task
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+logger = logging.getLogger("app")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line with the request ID and any structured fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            "request_id": request_id.get(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestSampler(logging.Filter):
+    """
+    Keep a fraction of requests' info/debug logs. The decision hashes the
+    request ID, so a sampled request keeps all of its lines; warnings and
+    errors are always kept.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        if self.rate <= 0.0:
+            return False
+        rid = request_id.get()
+        return zlib.crc32(rid.encode("utf-8")) % 10000 < self.rate * 10000
+
+
+def configure_logging(level: Optional[str] = None, sample_rate: Optional[float] = None):
+    """Configure the ``app`` logger from LOG_LEVEL and LOG_SAMPLE_RATE"""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    if sample_rate is None:
+        sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JSONFormatter())
+    handler.addFilter(RequestSampler(sample_rate))
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """Log a structured event; fields become top-level JSON keys"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
@@ -0,0 +1,227 @@
+import math
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+# Upstream LLM calls take seconds to minutes, so the buckets reach further than the usual web defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricFamily(NamedTuple):
+    """Samples gathered at scrape time by a collector"""
+    name: str
+    type: str
+    help: str
+    samples: List[Tuple[Dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self._labels(k))} {_format_value(v)}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self._labels(k))} {_format_value(v)}" for k, v in self.values.items()]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label set: [bucket counts..., sum, count]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, state in self.values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(round(state[-2], 6))}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text
+    exposition format. Metrics are updated from the event loop only, so
+    no locking is needed. Collectors are called at scrape time to export
+    state that other components already track (cache, admission, upstream).
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for family in collector():
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.type}")
+                for labels, value in family.samples:
+                    lines.append(f"{family.name}{_format_labels(labels)} {_format_value(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route, including streamed bodies",
+    ["method", "route", "status"]
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served"
+)
+UPSTREAM_REQUEST_DURATION = REGISTRY.histogram(
+    "upstream_request_duration_seconds", "Upstream completion latency including retries, by answering target",
+    ["model", "base_url", "mode"]
+)
+UPSTREAM_TTFT = REGISTRY.histogram(
+    "upstream_time_to_first_token_seconds", "Time from sending a streamed completion to its first content token",
+    ["model", "base_url"]
+)
+UPSTREAM_TOKENS = REGISTRY.counter(
+    "upstream_tokens_total", "Tokens billed by the upstream", ["model", "type"]
+)
+UPSTREAM_OUTPUT_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "upstream_output_tokens_per_second", "Completion tokens per second after the first token of a stream",
+    ["model"], buckets=THROUGHPUT_BUCKETS
+)
+JSON_PARSE_FALLBACKS = REGISTRY.counter(
+    "json_parse_fallbacks_total", "Structured completions still missing fields after repair, returned with empty values or dropped", ["kind"]
+)
+STRUCTURED_OUTPUT_REPAIRS = REGISTRY.counter(
+    "structured_output_repairs_total",
+    "Structured completions that were truncated or missing fields, by whether local repair sufficed, a continuation call recovered them or they stayed incomplete",
+    ["kind", "outcome"]
+)
+COALESCED_REQUESTS = REGISTRY.counter(
+    "coalesced_requests_total", "Requests that shared an identical in-flight upstream call instead of sending their own"
+)
+SIMILARITY_LOOKUPS = REGISTRY.counter(
+    "similarity_lookups_total", "Near-duplicate prompt index lookups", ["result"]
+)
+COMPRESSION_TOKENS_REMOVED = REGISTRY.counter(
+    "compression_tokens_removed_total", "Context tokens removed by local compression before the upstream call"
+)
+ADMISSION_QUEUE_WAIT = REGISTRY.histogram(
+    "admission_queue_wait_seconds", "Time spent waiting for an upstream slot", ["lane"]
+)
+
+USAGE_COST = REGISTRY.counter(
+    "usage_cost_usd_total", "Estimated upstream spend recorded by the usage ledger, and spend avoided by cache hits",
+    ["model", "type"]
+)
+USAGE_QUOTA_EXCEEDED = REGISTRY.counter(
+    "usage_quota_exceeded_total", "Upstream calls over a tenant quota: rejected (hard) or let through and flagged (soft)",
+    ["mode"]
+)
+USAGE_RECORDS_DROPPED = REGISTRY.counter(
+    "usage_records_dropped_total", "Usage records dropped because the ledger buffer was full while the database was unavailable"
+)
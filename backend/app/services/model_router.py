@@ -0,0 +1,185 @@
+import os
+from typing import Dict, List, Optional
+
+from app.services.catalog import ModelCatalog
+from app.services.errors import TokenBudgetExceeded
+from app.services.resilience import ResilientExecutor
+from app.services.tenants import SpendTracker, tenant_id
+
+AUTO_MODEL = "auto"
+POLICIES = ("cheapest_within_slo", "fastest", "quality_first")
+
+# Catalog quality a model needs per optimization goal / generation task type
+REQUIRED_QUALITY = {
+    "conciseness": 0.6,
+    "clarity": 0.65,
+    "general": 0.7,
+    "educational": 0.7,
+    "specificity": 0.75,
+    "creativity": 0.8,
+    "creative": 0.8,
+    "analytical": 0.8,
+    "technical": 0.85,
+}
+# Long inputs need a stronger model to keep track of everything in them
+LONG_INPUT_TOKENS = 4000
+LONG_INPUT_QUALITY = 0.1
+
+
+class ModelRouter:
+    """
+    Picks the model for requests sent with ``model: "auto"``.
+
+    Candidates are the catalog's listed models (or ``ROUTER_MODELS``) whose
+    context window fits the request. Models whose circuit is open or whose
+    rolling error rate is above ``max_error_rate`` are skipped, as are
+    models the tenant's remaining budget cannot pay for and models below
+    the quality the goal or task type needs. The policy then chooses:
+
+    - ``cheapest_within_slo``: the lowest estimated cost among models whose
+      rolling p95 latency is within ``slo_seconds``
+    - ``fastest``: the lowest rolling p50 latency
+    - ``quality_first``: the highest catalog quality within the SLO
+
+    Models without latency samples yet count as within the SLO so new
+    models get tried. Each filter is relaxed when it would leave nothing,
+    and the reason says so.
+    """
+
+    def __init__(
+        self,
+        catalog: ModelCatalog,
+        resilience: ResilientExecutor,
+        policy: str = "cheapest_within_slo",
+        models: Optional[List[str]] = None,
+        slo_seconds: float = 10.0,
+        max_error_rate: float = 0.2,
+        tenant_budget: float = 0.0,
+        budget_window: float = 86400.0,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy: {policy}")
+        self.catalog = catalog
+        self.resilience = resilience
+        self.policy = policy
+        self.models = models or []
+        self.slo_seconds = slo_seconds
+        self.max_error_rate = max_error_rate
+        self.tenant_budget = tenant_budget
+        self.spend = SpendTracker(window=budget_window)
+        self.routed: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls, catalog: ModelCatalog, resilience: ResilientExecutor) -> "ModelRouter":
+        return cls(
+            catalog,
+            resilience,
+            policy=os.getenv("ROUTER_POLICY", "cheapest_within_slo"),
+            models=[m.strip() for m in os.getenv("ROUTER_MODELS", "").split(",") if m.strip()],
+            slo_seconds=float(os.getenv("ROUTER_SLO_SECONDS", "10")),
+            max_error_rate=float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.2")),
+            tenant_budget=float(os.getenv("ROUTER_TENANT_BUDGET_USD", "0")),
+            budget_window=float(os.getenv("ROUTER_BUDGET_WINDOW", "86400")),
+        )
+
+    def required_quality(self, goal: str, input_tokens: int) -> float:
+        required = REQUIRED_QUALITY.get(goal, REQUIRED_QUALITY["general"])
+        if input_tokens > LONG_INPUT_TOKENS:
+            required += LONG_INPUT_QUALITY
+        return round(min(required, 1.0), 2)
+
+    def _options(self, input_tokens: int, max_tokens: int) -> List[dict]:
+        options = []
+        for name in self.models or self.catalog.listed:
+            spec = self.catalog.limits(name)
+            if spec is None or input_tokens + max_tokens > spec["context_window"]:
+                continue
+            stats = self.resilience.model_stats(name)
+            options.append({
+                "model": name,
+                "quality": spec["quality"],
+                # Upper bound: the whole completion budget is used
+                "cost": self.catalog.estimate_cost(name, input_tokens, max_tokens),
+                "p50": stats["p50_seconds"],
+                "p95": stats["p95_seconds"],
+                "error_rate": stats["error_rate"],
+                "circuit_open": stats["circuit_open"],
+            })
+        return options
+
+    def choose(self, input_tokens: int, max_tokens: int, goal: str, api_key: Optional[str] = None, policy: Optional[str] = None) -> Dict[str, object]:
+        """Pick a model and explain why; raises TokenBudgetExceeded when no model can fit the request"""
+        policy = policy or self.policy
+        options = self._options(input_tokens, max_tokens)
+        if not options:
+            raise TokenBudgetExceeded(
+                f"No routable model has a context window for {input_tokens} prompt tokens plus max_tokens ({max_tokens})"
+            )
+        required = self.required_quality(goal, input_tokens)
+        notes = []
+
+        healthy = [o for o in options if not o["circuit_open"] and (o["error_rate"] or 0.0) <= self.max_error_rate]
+        if not healthy:
+            healthy = options
+            notes.append("every model is failing, health ignored")
+        if self.tenant_budget:
+            remaining = self.tenant_budget - self.spend.spent(tenant_id(api_key))
+            affordable = [o for o in healthy if o["cost"] <= remaining]
+            if not affordable:
+                affordable = [min(healthy, key=lambda o: o["cost"])]
+                notes.append("tenant budget nearly exhausted, cheapest model used")
+        else:
+            affordable = healthy
+        capable = [o for o in affordable if o["quality"] >= required]
+        quality = f" with quality >= {required:.2f}"
+        if not capable:
+            capable = [max(affordable, key=lambda o: (o["quality"], -o["cost"]))]
+            quality = ""
+            notes.append(f"no affordable model reaches quality {required:.2f}")
+        within_slo = [o for o in capable if o["p95"] is None or o["p95"] <= self.slo_seconds]
+        slo = f" within the {self.slo_seconds:g}s p95 SLO"
+        if not within_slo and policy != "fastest":
+            within_slo = capable
+            slo = ""
+            notes.append(f"no model meets the {self.slo_seconds:g}s p95 SLO")
+
+        if policy == "fastest":
+            chosen = min(capable, key=lambda o: (o["p50"] is None, o["p50"] or 0.0, o["cost"]))
+            latency = f"p50 {chosen['p50']:.2f}s" if chosen["p50"] is not None else "no latency samples yet"
+            reason = f"fastest model{quality} ({latency})"
+        elif policy == "quality_first":
+            chosen = max(within_slo, key=lambda o: (o["quality"], -o["cost"]))
+            reason = f"highest-quality model ({chosen['quality']:.2f}){slo}"
+        else:
+            chosen = min(within_slo, key=lambda o: (o["cost"], o["p50"] if o["p50"] is not None else float("inf")))
+            reason = f"cheapest model{quality}{slo}"
+        if notes:
+            reason += "; " + "; ".join(notes)
+        self.routed[chosen["model"]] = self.routed.get(chosen["model"], 0) + 1
+        return {
+            "model": chosen["model"],
+            "policy": policy,
+            "reason": reason,
+            "required_quality": required,
+            "estimated_input_tokens": input_tokens,
+            "estimated_cost_usd": chosen["cost"],
+        }
+
+    def record_spend(self, api_key: Optional[str], usd: float):
+        """Charge a finished request to its tenant's budget"""
+        self.spend.add(tenant_id(api_key), usd)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "policy": self.policy,
+            "slo_seconds": self.slo_seconds,
+            "max_error_rate": self.max_error_rate,
+            "tenant_budget_usd": self.tenant_budget or None,
+            "routed": dict(self.routed),
+            "models": [
+                {"model": o["model"], "quality": o["quality"], "p50_seconds": o["p50"], "p95_seconds": o["p95"],
+                 "error_rate": o["error_rate"], "circuit_open": o["circuit_open"]}
+                for o in self._options(0, 0)
+            ],
+            "spend": self.spend.stats(),
+        }
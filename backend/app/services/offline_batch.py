@@ -0,0 +1,380 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from pydantic import ValidationError
+
+from app.models.schemas import PromptGenerationRequest, PromptRequest
+from app.services.errors import ServiceError
+from app.services.logs import log_event
+from app.services.openai_service import OpenAIService
+
+# Upstream batch API limits per input file (OpenAI allows 50,000 requests and 200 MB)
+OFFLINE_BATCH_MAX_REQUESTS = int(os.getenv("OFFLINE_BATCH_MAX_REQUESTS", "50000"))
+OFFLINE_BATCH_MAX_BYTES = int(os.getenv("OFFLINE_BATCH_MAX_BYTES", str(100 * 1024 * 1024)))
+OFFLINE_BATCH_POLL_INTERVAL = float(os.getenv("OFFLINE_BATCH_POLL_INTERVAL", "30"))
+OFFLINE_BATCH_COMPLETION_WINDOW = os.getenv("OFFLINE_BATCH_COMPLETION_WINDOW", "24h")
+# Batch API requests are billed at half the interactive price
+BATCH_PRICE_FACTOR = 0.5
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Attempts per batch/file API call on connection errors, 429 and 5xx
+API_ATTEMPTS = 5
+CHECKPOINT_VERSION = 1
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_line(line: str) -> dict:
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("Each line must be a JSON object")
+    return data
+
+
+def parse_item(data: dict):
+    """
+    Build the optimization request (has ``prompt``) or generation request
+    (has ``requirements``) of one parsed input line, without its custom_id
+    """
+    if "requirements" in data:
+        return PromptGenerationRequest(**data)
+    return PromptRequest(**data)
+
+
+class BatchAPI:
+    """Minimal client for the upstream ``/files`` and ``/batches`` endpoints"""
+
+    def __init__(self, base_url: str, api_key: Optional[str], timeout: float = 120.0):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(base_url=base_url.rstrip("/") + "/", headers=headers, timeout=timeout)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        for attempt in range(1, API_ATTEMPTS + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == API_ATTEMPTS:
+                    raise
+                log_event("batch_api_retry", logging.WARNING, path=path, attempt=attempt, error=str(e))
+                await asyncio.sleep(2 ** attempt)
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt < API_ATTEMPTS:
+                    delay = float(response.headers.get("retry-after") or 2 ** attempt)
+                    log_event("batch_api_retry", logging.WARNING, path=path, attempt=attempt, status=response.status_code)
+                    await asyncio.sleep(delay)
+                    continue
+            response.raise_for_status()
+            return response
+
+    async def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            response = await self._request(
+                "POST", "files", data={"purpose": "batch"},
+                files={"file": (os.path.basename(path), f, "application/jsonl")},
+            )
+        return response.json()["id"]
+
+    async def create_batch(self, file_id: str, completion_window: str, metadata: Dict[str, str]) -> dict:
+        response = await self._request("POST", "batches", json={
+            "input_file_id": file_id,
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": completion_window,
+            "metadata": metadata,
+        })
+        return response.json()
+
+    async def find_batch(self, file_id: str) -> Optional[dict]:
+        """A batch already created from ``file_id``, if any"""
+        response = await self._request("GET", "batches", params={"limit": 100})
+        return next((batch for batch in response.json().get("data", []) if batch.get("input_file_id") == file_id), None)
+
+    async def get_batch(self, batch_id: str) -> dict:
+        return (await self._request("GET", f"batches/{batch_id}")).json()
+
+    async def download(self, file_id: str, path: str):
+        """Stream a file's content to ``path``"""
+        async with self.client.stream("GET", f"files/{file_id}/content") as response:
+            response.raise_for_status()
+            with open(path + ".tmp", "wb") as f:
+                async for block in response.aiter_bytes():
+                    f.write(block)
+        os.replace(path + ".tmp", path)
+
+
+class OfflineBatchRunner:
+    """
+    Runs a JSONL file of optimization/generation requests through the
+    upstream batch API and writes one result record per input line.
+
+    The input is read line by line and packed into batch input files of at
+    most ``max_requests`` lines and ``max_bytes`` bytes; each file is
+    uploaded and submitted as soon as it is full, so the upstream starts
+    on the first part while the rest is prepared. Results are written in
+    input order, in the record format of ``/optimize/batch`` plus the
+    line's ``custom_id``. Lines that fail validation, pre-flight or the
+    token budget are reported without being sent.
+
+    Progress is checkpointed in ``work_dir``: running again with the same
+    input resumes where the previous run stopped, without uploading or
+    submitting anything twice and without duplicating output records.
+    Requests are sent under the runner's API key; per-line ``api_key`` and
+    ``base_url`` are ignored and never written to disk.
+    """
+
+    def __init__(
+        self,
+        service: OpenAIService,
+        api: BatchAPI,
+        input_path: str,
+        output_path: str,
+        work_dir: Optional[str] = None,
+        max_requests: int = OFFLINE_BATCH_MAX_REQUESTS,
+        max_bytes: int = OFFLINE_BATCH_MAX_BYTES,
+        poll_interval: float = OFFLINE_BATCH_POLL_INTERVAL,
+        completion_window: str = OFFLINE_BATCH_COMPLETION_WINDOW,
+    ):
+        self.service = service
+        self.api = api
+        self.input_path = input_path
+        self.output_path = output_path
+        self.work_dir = work_dir or output_path + ".work"
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.checkpoint_path = os.path.join(self.work_dir, "checkpoint.json")
+        self.state: dict = {}
+
+    def _chunk_path(self, index: int, kind: str) -> str:
+        return os.path.join(self.work_dir, f"chunk-{index:05d}.{kind}.jsonl")
+
+    def _save(self):
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    def _load(self, restart: bool):
+        os.makedirs(self.work_dir, exist_ok=True)
+        digest = file_sha256(self.input_path)
+        if not restart and os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("input_sha256") != digest:
+                raise ValueError(f"{self.input_path} changed since the checkpoint in {self.work_dir}; rerun with --restart")
+            self.state = state
+            log_event("offline_batch_resumed", work_dir=self.work_dir, chunks=len(state["chunks"]), next_line=state["next_line"])
+        else:
+            self.state = {
+                "version": CHECKPOINT_VERSION,
+                "input": os.path.abspath(self.input_path),
+                "input_sha256": digest,
+                "completion_window": self.completion_window,
+                "next_line": 0,
+                "prepared": False,
+                "output_bytes": 0,
+                "chunks": [],
+            }
+            self._save()
+        # Drop records written after the last checkpoint; they are written again
+        mode = "r+b" if os.path.exists(self.output_path) else "wb"
+        with open(self.output_path, mode) as f:
+            f.truncate(self.state["output_bytes"])
+
+    def _items(self, start: int) -> Iterator[Tuple[int, dict, Optional[str]]]:
+        """
+        Input lines from ``start`` on as (index, item record, batch line).
+        Items that cannot be sent get an ``error`` and no batch line.
+        """
+        with open(self.input_path, "r", encoding="utf-8") as f:
+            for index, line in enumerate(f):
+                if index < start:
+                    continue
+                if not line.strip():
+                    continue
+                custom_id = None
+                try:
+                    data = parse_line(line)
+                    # Taken first so a line that fails validation is still reported under its id
+                    custom_id = data.pop("custom_id", None)
+                    request = parse_item(data)
+                    request, body, route, removed = self.service.build_batch_body(request)
+                except (ValueError, ValidationError, ServiceError) as e:
+                    yield index, {"index": index, "custom_id": custom_id, "error": getattr(e, "message", None) or str(e)}, None
+                    continue
+                item = {
+                    "index": index,
+                    "custom_id": custom_id,
+                    "kind": "optimize" if isinstance(request, PromptRequest) else "generate",
+                    "request": request.model_copy(update={"api_key": None, "base_url": None}).model_dump(),
+                    "route": route,
+                    "context_tokens_removed": removed,
+                }
+                batch_line = json.dumps(
+                    {"custom_id": str(index), "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                    ensure_ascii=False,
+                )
+                yield index, item, batch_line
+
+    def _write_chunk(self, items: List[dict], lines: List[str], next_line: int) -> dict:
+        index = len(self.state["chunks"])
+        for kind, rows in (("items", [json.dumps(item, ensure_ascii=False) for item in items]), ("requests", lines)):
+            path = self._chunk_path(index, kind)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(row + "\n")
+            os.replace(path + ".tmp", path)
+        chunk = {"index": index, "items": len(items), "requests": len(lines), "file_id": None, "batch_id": None,
+                 "status": "prepared" if lines else "local", "written": False}
+        self.state["chunks"].append(chunk)
+        self.state["next_line"] = next_line
+        self._save()
+        log_event("offline_batch_chunk_prepared", chunk=index, items=len(items), requests=len(lines))
+        return chunk
+
+    async def _submit(self, chunk: dict):
+        if chunk["status"] != "prepared":
+            return
+        if chunk["file_id"] is None:
+            chunk["file_id"] = await self.api.upload(self._chunk_path(chunk["index"], "requests"))
+            self._save()
+        # A run that stopped right after creating the batch must not create it twice
+        batch = await self.api.find_batch(chunk["file_id"])
+        if batch is None:
+            batch = await self.api.create_batch(chunk["file_id"], self.state["completion_window"], {
+                "source": "prompt-optimizer", "input_sha256": self.state["input_sha256"][:16], "chunk": str(chunk["index"]),
+            })
+        chunk["batch_id"] = batch["id"]
+        chunk["status"] = batch.get("status", "validating")
+        self._save()
+        log_event("offline_batch_submitted", chunk=chunk["index"], batch_id=batch["id"], requests=chunk["requests"])
+
+    async def _prepare(self):
+        """Pack the unread input into chunks, submitting each one as soon as it is full"""
+        for chunk in self.state["chunks"]:
+            await self._submit(chunk)
+        if self.state["prepared"]:
+            return
+        items: List[dict] = []
+        lines: List[str] = []
+        size = 0
+        end = self.state["next_line"]
+        for index, item, line in self._items(self.state["next_line"]):
+            end = index + 1
+            if line is not None:
+                line_bytes = len(line.encode("utf-8")) + 1
+                if lines and (len(lines) >= self.max_requests or size + line_bytes > self.max_bytes):
+                    await self._submit(self._write_chunk(items, lines, index))
+                    items, lines, size = [], [], 0
+                lines.append(line)
+                size += line_bytes
+            items.append(item)
+        if items:
+            await self._submit(self._write_chunk(items, lines, end))
+        self.state["prepared"] = True
+        self._save()
+
+    async def _wait(self, chunk: dict) -> dict:
+        counts = None
+        while True:
+            batch = await self.api.get_batch(chunk["batch_id"])
+            if batch.get("request_counts") != counts:
+                counts = batch.get("request_counts")
+                log_event("offline_batch_progress", chunk=chunk["index"], batch_id=chunk["batch_id"], status=batch["status"], **(counts or {}))
+            if batch["status"] in TERMINAL_STATUSES:
+                return batch
+            await asyncio.sleep(self.poll_interval)
+
+    def _outputs(self, chunk: dict, batch: dict) -> Dict[str, dict]:
+        outputs: Dict[str, dict] = {}
+        for kind in ("output", "errors"):
+            path = self._chunk_path(chunk["index"], kind)
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        outputs[record["custom_id"]] = record
+        return outputs
+
+    def _record(self, item: dict, output: Optional[dict], batch: dict) -> dict:
+        record = {"index": item["index"], "custom_id": item["custom_id"]}
+        if "error" in item:
+            return {**record, "status": "error", "error": item["error"]}
+        if output is None:
+            errors = (batch.get("errors") or {}).get("data") or []
+            message = "; ".join(e.get("message", "") for e in errors) or f"Batch {batch.get('status', 'failed')} before the request ran"
+            return {**record, "status": "error", "error": message}
+        response = output.get("response") or {}
+        body = response.get("body") or {}
+        if output.get("error") or response.get("status_code") != 200:
+            error = output.get("error") or body.get("error") or {}
+            return {**record, "status": "error", "error": error.get("message") or f"Upstream returned {response.get('status_code')}"}
+        request_type = PromptRequest if item["kind"] == "optimize" else PromptGenerationRequest
+        try:
+            result = self.service.build_batch_result(request_type(**item["request"]), body, item["context_tokens_removed"])
+        except Exception as e:
+            return {**record, "status": "error", "error": getattr(e, "message", None) or str(e)}
+        result["cost_usd"] = round(result["cost_usd"] * BATCH_PRICE_FACTOR, 8)
+        if item["route"] is not None:
+            result["route"] = item["route"]
+        return {**record, "status": "ok", "result": result}
+
+    async def _collect(self, chunk: dict, out) -> Dict[str, int]:
+        batch = {"status": "local"}
+        if chunk["status"] != "local":
+            batch = await self._wait(chunk)
+            chunk["status"] = batch["status"]
+            for kind, field in (("output", "output_file_id"), ("errors", "error_file_id")):
+                if batch.get(field):
+                    await self.api.download(batch[field], self._chunk_path(chunk["index"], kind))
+        outputs = self._outputs(chunk, batch)
+        counts = {"ok": 0, "error": 0}
+        with open(self._chunk_path(chunk["index"], "items"), "r", encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                record = self._record(item, outputs.get(str(item["index"])), batch)
+                counts[record["status"]] += 1
+                out.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        out.flush()
+        os.fsync(out.fileno())
+        chunk["written"] = True
+        self.state["output_bytes"] = out.tell()
+        self._save()
+        log_event("offline_batch_chunk_written", chunk=chunk["index"], status=chunk["status"], **counts)
+        return counts
+
+    async def run(self, restart: bool = False) -> Dict[str, object]:
+        """Prepare, submit and collect every chunk; returns per-status record counts"""
+        self._load(restart)
+        await self._prepare()
+        totals = {"ok": 0, "error": 0}
+        with open(self.output_path, "ab") as out:
+            for chunk in self.state["chunks"]:
+                if chunk["written"]:
+                    continue
+                counts = await self._collect(chunk, out)
+                for status, count in counts.items():
+                    totals[status] += count
+        summary = {"chunks": len(self.state["chunks"]), "written_this_run": totals, "output": self.output_path}
+        log_event("offline_batch_finished", **summary)
+        return summary
+
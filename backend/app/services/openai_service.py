@@ -1,10 +1,40 @@
 import os
-import httpx
+import asyncio
+import time
+import logging
 import openai
-from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from app.models.schemas import PromptResponse, PromptRequest
+from app.models.schemas import (
+    PolishSchems, PromptGenerationResponse, PromptGenerationSchema, PromptResponse, PromptRequest, RouteDecision
+)
+from app.services.client_pool import ClientRegistry
+from app.services.cache import ResponseCache
+from app.services.json_stream import IncrementalJSONParser
+from app.services.admission import AdmissionController
+from app.services.errors import PreflightFailed, ServiceError, TokenBudgetExceeded, UpstreamError
+from app.services.resilience import ResilientExecutor, Target, parse_model_fallbacks, to_service_error
+from app.services.tokenizer import TokenCounter
+from app.services.catalog import ModelCatalog
+from app.services.templates import TemplateRegistry
+from app.services.logs import log_event
+from app.services.coalesce import SingleFlight
+from app.services.similarity import SimilarityIndex
+from app.services.analyzer import CHUNKED_EXEMPT, PromptAnalyzer
+from app.services.compression import ContextCompressor, normalize
+from app.services.chunking import ChunkingPolicy, outline, split_prompt
+from app.services.ranking import CandidateRanker
+from app.services.model_router import AUTO_MODEL, ModelRouter
+from app.services.tenants import tenant_id
+from app.services.usage import UsageLedger
+from app.services.structured import (
+    continuation_format, continuation_prompt, continuation_schema, dumps, loads, merge_continuation, parse_confidence,
+    parse_structured, salvage
+)
+from app.services.metrics import (
+    COMPRESSION_TOKENS_REMOVED, JSON_PARSE_FALLBACKS, STRUCTURED_OUTPUT_REPAIRS, UPSTREAM_OUTPUT_TOKENS_PER_SECOND,
+    UPSTREAM_REQUEST_DURATION, UPSTREAM_TOKENS, UPSTREAM_TTFT, MetricFamily
+)
 
 load_dotenv()
 
@@ -12,210 +42,857 @@ class OpenAIService:
     def __init__(self):
         self.default_api_key = os.getenv("OPENAI_API_KEY")
         self.default_base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        self.default_proxy = os.getenv("OPENAI_PROXY") or None
+        self.temperature = 0.7
+        self.clients = ClientRegistry()
+        self.cache = ResponseCache.from_env()
+        self.admission = AdmissionController.from_env()
+        self.resilience = ResilientExecutor.from_env()
+        self.failover_base_urls = [url.strip() for url in os.getenv("OPENAI_FAILOVER_BASE_URLS", "").split(",") if url.strip()]
+        self.model_fallbacks = parse_model_fallbacks(os.getenv("MODEL_FALLBACKS", ""))
+        self.tokens = TokenCounter()
+        self.max_input_tokens = int(os.getenv("MAX_INPUT_TOKENS", "0"))
+        self.stream_include_usage = os.getenv("STREAM_INCLUDE_USAGE", "true").lower() == "true"
+        self.templates = TemplateRegistry.from_env()
+        self.inflight = SingleFlight()
+        self.similar = SimilarityIndex.from_env()
+        self.similarity_enabled = os.getenv("SIMILARITY_ENABLED", "true").lower() == "true"
+        self.catalog = ModelCatalog.from_env()
+        self.analyzer = PromptAnalyzer.from_env(self.tokens, self.catalog)
+        self.compressor = ContextCompressor.from_env(self.tokens)
+        self.chunking = ChunkingPolicy.from_env()
+        self.ranker = CandidateRanker(self.analyzer)
+        self.router = ModelRouter.from_env(self.catalog, self.resilience)
+        self.usage = UsageLedger.from_env()
     
-    def get_client(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
-        """Get OpenAI client with optional custom API key and base URL"""
-        return openai.OpenAI(
-                    api_key=api_key or self.default_api_key,
-                    base_url=base_url or self.default_base_url,
-                    http_client=httpx.Client(proxy="http://192.168.28.46:8118")
-                )
-        
-    async def optimize_prompt(self, request: PromptRequest) -> PromptResponse:
+    def get_client(self, api_key: Optional[str] = None, base_url: Optional[str] = None) -> openai.AsyncOpenAI:
+        """Get pooled async OpenAI client with optional custom API key and base URL"""
+        return self.clients.get(
+            api_key or self.default_api_key,
+            base_url or self.default_base_url,
+            self.default_proxy
+        )
+
+    async def close(self):
         """
-        Optimize a prompt using OpenAI's API
+        Release pooled upstream connections
         """
-        optimization_prompts = {
-            "general": """Optimize this prompt for better clarity, effectiveness, and results. 
-                        Provide the optimized prompt along with specific suggestions for improvement.
-                        Original prompt: {prompt}""",
-            
-            "clarity": """Rewrite this prompt to be exceptionally clear and unambiguous. 
-                         Focus on precise language, clear instructions, and logical structure.
-                         Original prompt: {prompt}""",
-            
-            "conciseness": """Optimize this prompt to be more concise while maintaining its effectiveness.
-                             Remove redundancy and unnecessary words without losing important details.
-                             Original prompt: {prompt}""",
-            
-            "creativity": """Enhance this prompt to encourage more creative and innovative responses.
-                           Add elements that stimulate creative thinking and unique perspectives.
-                           Original prompt: {prompt}""",
-            
-            "specificity": """Make this prompt more specific and detailed to get more targeted and accurate responses.
-                             Add specific constraints, examples, or requirements where appropriate.
-                             Original prompt: {prompt}"""
+        await self.clients.aclose()
+        await self.cache.close()
+        await self.usage.stop()
+
+    def _targets(self, request) -> List[Target]:
+        """
+        Ordered upstream targets for a request: the requested model on the
+        primary and failover endpoints, then its configured fallback models
+        """
+        api_key = request.api_key or self.default_api_key
+        if request.base_url:
+            # A caller-supplied endpoint is never failed over to our own endpoints
+            base_urls = [request.base_url]
+        else:
+            base_urls = [self.default_base_url] + self.failover_base_urls
+        models = [request.model] + self.model_fallbacks.get(request.model, [])
+        return [Target(base_url, model, api_key) for model in models for base_url in base_urls]
+
+    def _prompt_tokens(self, request, system_prompt: str, user_prompt: str) -> int:
+        """
+        Count prompt tokens locally and reject requests that cannot fit the
+        model's context window (or MAX_INPUT_TOKENS) before any network call
+        """
+        prompt_tokens = self.tokens.count_messages(
+            [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+            request.model
+        )
+        if self.max_input_tokens and prompt_tokens > self.max_input_tokens:
+            raise TokenBudgetExceeded(
+                f"Prompt is {prompt_tokens} tokens, above the limit of {self.max_input_tokens}"
+            )
+        limits = self.catalog.limits(request.model)
+        if limits and prompt_tokens + request.max_tokens > limits["context_window"]:
+            raise TokenBudgetExceeded(
+                f"Prompt ({prompt_tokens} tokens) plus max_tokens ({request.max_tokens}) exceeds "
+                f"the {limits['context_window']}-token context window of {request.model}"
+            )
+        return prompt_tokens
+
+    def _usage(self, usage, prompt_tokens: int, content: str, model: str) -> Dict[str, int]:
+        """
+        Token usage reported by the upstream, falling back to local counts
+        when the upstream omits it
+        """
+        if isinstance(usage, dict):
+            usage = {k: usage.get(k) for k in ("prompt_tokens", "completion_tokens")}
+        elif usage is not None:
+            usage = {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+        if not usage or usage["prompt_tokens"] is None:
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.tokens.count(content or "", model)}
+        return usage
+
+    def _metric_model(self, model: str) -> str:
+        """
+        Metric label for a model: its catalog entry, or "other". Callers
+        choose the model, so the raw name would let them add series at will.
+        """
+        return self.catalog.resolve(model) or "other"
+
+    def _metric_base_url(self, base_url: str) -> str:
+        """Metric label for an endpoint: our own endpoints by URL, caller-supplied ones as custom"""
+        return base_url if base_url == self.default_base_url or base_url in self.failover_base_urls else "custom"
+
+    def _record_upstream(self, target: Target, mode: str, seconds: float, completion: dict, first_token: Optional[float] = None):
+        """
+        Record latency and token metrics for a finished upstream call and log it
+        """
+        usage = completion["usage"]
+        model, base_url = self._metric_model(target.model), self._metric_base_url(target.base_url)
+        UPSTREAM_REQUEST_DURATION.observe(seconds, model=model, base_url=base_url, mode=mode)
+        UPSTREAM_TOKENS.inc(usage["prompt_tokens"] or 0, model=model, type="prompt")
+        UPSTREAM_TOKENS.inc(usage["completion_tokens"] or 0, model=model, type="completion")
+        if first_token is not None and seconds > first_token and usage["completion_tokens"]:
+            UPSTREAM_OUTPUT_TOKENS_PER_SECOND.observe(usage["completion_tokens"] / (seconds - first_token), model=model)
+        log_event(
+            "upstream_call",
+            model=target.model,
+            base_url=target.base_url,
+            mode=mode,
+            latency_ms=round(seconds * 1000, 1),
+            ttft_ms=round(first_token * 1000, 1) if first_token is not None else None,
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            finish_reason=completion["finish_reason"],
+        )
+
+    def _check_quota(self, request, prompt_tokens: int, n: int = 1):
+        """
+        Reject (or flag, for a soft quota) a call that could take the tenant
+        over its usage quota, assuming it uses all of max_tokens
+        """
+        max_completion = request.max_tokens * n
+        self.usage.check(
+            request.api_key,
+            self.catalog.estimate_cost(request.model, prompt_tokens, max_completion),
+            prompt_tokens + max_completion,
+        )
+
+    def _account(self, request, completion: dict) -> dict:
+        """
+        Add a completion to the tenant's usage ledger. A cached or coalesced
+        result made no upstream call, so it is recorded with the cost it saved.
+        """
+        usage = completion.get("usage") or {}
+        model = completion.get("model") or request.model
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+        cost = self.catalog.estimate_cost(model, prompt_tokens, completion_tokens)
+        if completion.get("cached") or completion.get("coalesced"):
+            self.usage.record(request.api_key, model, 0, 0, 0.0, cached=True, saved_usd=cost, model_label=self._metric_model(model))
+        else:
+            self.usage.record(
+                request.api_key, model, prompt_tokens, completion_tokens, cost,
+                latency_ms=completion.get("latency_ms"), model_label=self._metric_model(model)
+            )
+        return completion
+
+    def _temperature(self, request) -> float:
+        # Only evaluation executions set their own temperature
+        temperature = getattr(request, "temperature", None)
+        return self.temperature if temperature is None else temperature
+
+    def _cache_key(self, request, system_prompt: str, user_prompt: str, response_format: Optional[dict], n: int = 1) -> str:
+        # n and base_url only enter the key when set, so existing keys stay valid
+        extra = {"n": n} if n > 1 else {}
+        if request.base_url:
+            # A caller-supplied endpoint may serve another model under the same name
+            extra["base_url"] = request.base_url.rstrip("/")
+        return self.cache.make_key(
+            system_prompt, user_prompt, request.model, request.max_tokens, self._temperature(request), response_format, **extra
+        )
+
+    async def _chat_completion(self, request, system_prompt: str, user_prompt: str, response_format: Optional[dict], n: int = 1) -> dict:
+        """
+        Run a chat completion through the response cache.
+
+        ``request.cache`` controls the cache per request: ``bypass`` skips it
+        entirely, ``refresh`` skips the lookup but stores the fresh result.
+        Concurrent identical requests of one tenant are coalesced into one upstream call.
+        With ``n`` above 1 the upstream samples that many choices in the same
+        call and ``choices`` lists each one's content and finish_reason.
+        An empty system prompt is left out of the messages and a None
+        response_format asks for plain text.
+        Returns content (of the first choice), finish_reason, the model that answered, token usage,
+        the upstream latency, whether the result came from the cache and
+        whether it was shared with an identical in-flight request.
+        """
+        cache_mode = getattr(request, "cache", None)
+        cache_key = self._cache_key(request, system_prompt, user_prompt, response_format, n)
+        if cache_mode is None:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                return self._account(request, {**cached, "cached": True})
+
+        if cache_mode is None:
+            # Identical requests of the same tenant already in flight share one upstream call.
+            # Other tenants start their own, so each call runs under its caller's key, quota and
+            # rate limits, and a caller-specific upstream error (401, 429) is not passed on.
+            completion, shared = await self.inflight.do(
+                f"{tenant_id(request.api_key)}:{cache_key}", lambda: self._fetch_completion(request, system_prompt, user_prompt, response_format, cache_key, n)
+            )
+            return self._account(request, {**completion, "cached": False, "coalesced": shared})
+        return self._account(request, {**await self._fetch_completion(request, system_prompt, user_prompt, response_format, cache_key, n), "cached": False})
+
+    async def _fetch_completion(self, request, system_prompt: str, user_prompt: str, response_format: Optional[dict], cache_key: str, n: int = 1) -> dict:
+        """
+        Send one chat completion upstream and store a cacheable result
+        """
+        prompt_tokens = self._prompt_tokens(request, system_prompt, user_prompt)
+        self._check_quota(request, prompt_tokens, n)
+        messages = ([{"role": "system", "content": system_prompt}] if system_prompt else []) + [{"role": "user", "content": user_prompt}]
+
+        async def attempt(target: Target):
+            client = self.get_client(target.api_key, target.base_url)
+            return await client.chat.completions.create(
+                model=target.model,
+                messages=messages,
+                max_tokens=request.max_tokens,
+                temperature=self._temperature(request),
+                **({"response_format": response_format} if response_format else {}),
+                # The prompt is prefilled once and shared by all n choices
+                **({"n": n} if n > 1 else {}),
+            )
+
+        async with self.admission.slot(request.api_key, prompt_tokens + request.max_tokens * n):
+            started = time.perf_counter()
+            response, target = await self.resilience.call(self._targets(request), attempt)
+            elapsed = time.perf_counter() - started
+        choice = response.choices[0]
+        completion = {
+            "content": choice.message.content,
+            "finish_reason": choice.finish_reason,
+            "model": target.model,
+            "usage": self._usage(response.usage, prompt_tokens, choice.message.content, target.model),
+            "latency_ms": round(elapsed * 1000, 1),
         }
-        
-        system_prompt = """You are a prompt optimization expert. Your task is to rewrite and enhance user-provided prompts to achieve clearer, more effective, and higher-quality outputs.
-
-# **Rules:**
-Follow the COAST framework and format when optimizing prompts:
-
-## Context (背景)
-- Understand the purpose, target audience, domain, and constraints of the original prompt.
-- Extract and incorporate relevant details from any supplementary text or user-provided background.
-
-## Objectives (目标)
-1. Ensure the optimized prompt is clear, specific, and unambiguous.
-2. Improve contextual richness for better model understanding.
-3. Break down complex tasks into manageable steps.
-4. Include examples, constraints, or formatting instructions when beneficial.
-5. If the original prompt is empty, generate a suitable prompt based on the supplementary text and user needs.
-
-## Action (行动)
-- Rewrite the prompt to maximize clarity, relevance, and usability.
-- Structure the prompt logically, following COAST principles.
-- Integrate relevant examples or reference points when needed.
-- Maintain alignment with user intent.
-
-## Support (支持)
-- Suggest additional information that could improve the prompt.
-- Provide recommendations for constraints, formats, or tone adjustments.
-- Highlight missing details that may hinder optimal results.
-
-## Technology (技术)
-- Leverage prompt-engineering best practices.
-- Apply domain-specific terminology when relevant.
-- Use structured response formatting to ensure consistency.
-
-# **Output format:**
-Return your results in the following JSON format:
-{
-    "optimized_prompt": "your optimized prompt here, output format: ## Context: ## Objectives: ## Action: ## Support: ## Technology:",
-    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
-    "reasoning": "explanation of why these changes improve the prompt",
-    "confidence_score": 0.0-1.0
-}
-"""
-
-        user_prompt = optimization_prompts.get(request.optimization_goal, optimization_prompts["general"])
-        formatted_prompt = user_prompt.format(prompt=request.prompt)
-        
-        if request.context:
-            formatted_prompt += f"\n\nAdditional context / User demand: {request.context}"
-        
-        try:
-            class PolishSchems(BaseModel):
-                optimized_prompt: str
-                suggestions: List[str]
-                reasoning: str
-                confidence_score: str
-            client = self.get_client(request.api_key, request.base_url)
-            print("Sending request to OpenAI...")
-            print(f"Base URL: {request.base_url}")
-            response = client.chat.completions.create(
-                model=request.model,
+        if n > 1:
+            completion["choices"] = [
+                {"content": c.message.content, "finish_reason": c.finish_reason} for c in response.choices
+            ]
+        self._record_upstream(target, "complete", elapsed, completion)
+        # Truncated, filtered or fallback-model completions are not worth serving again
+        finished = all(c.finish_reason == "stop" for c in response.choices)
+        if getattr(request, "cache", None) != "bypass" and finished and target.model == request.model:
+            await self.cache.set(cache_key, completion)
+        return completion
+
+    async def _chat_completion_stream(
+        self, request, system_prompt: str, user_prompt: str, response_format: dict, completion: Optional[dict] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream completion content chunks, sharing the response cache with
+        _chat_completion. Closing the generator (e.g. on client disconnect)
+        closes the upstream stream so no further tokens are generated.
+
+        Retries and failover only apply until the stream is established.
+        Once the stream ends ``completion`` holds the same fields that
+        _chat_completion returns.
+        """
+        completion = completion if completion is not None else {}
+        cache_mode = getattr(request, "cache", None)
+        cache_key = self._cache_key(request, system_prompt, user_prompt, response_format)
+        if cache_mode is None:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                completion.update(cached, cached=True)
+                self._account(request, completion)
+                yield cached["content"]
+                return
+
+        prompt_tokens = self._prompt_tokens(request, system_prompt, user_prompt)
+        self._check_quota(request, prompt_tokens)
+        extra_body = {"stream_options": {"include_usage": True}} if self.stream_include_usage else None
+
+        async def attempt(target: Target):
+            client = self.get_client(target.api_key, target.base_url)
+            return await client.chat.completions.create(
+                model=target.model,
                 messages=[
                     {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": formatted_prompt}
+                    {"role": "user", "content": user_prompt}
                 ],
                 max_tokens=request.max_tokens,
-                temperature=0.7,
-                response_format={
-                                "type": "json_schema",
-                                "json_schema": {
-                                    "name": "PolishSchems",
-                                    "schema": PolishSchems.model_json_schema()
-                                }
-                            },
+                temperature=self.temperature,
+                response_format=response_format,
+                stream=True,
+                extra_body=extra_body,
             )
-            
-            content = response.choices[0].message.content
-            import json
+
+        parts = []
+        finish_reason = None
+        usage = None
+        first_token = None
+        async with self.admission.slot(request.api_key, prompt_tokens + request.max_tokens):
+            started = time.perf_counter()
+            stream, target = await self.resilience.call(self._targets(request), attempt, hedge=False)
             try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
-                # Fallback if JSON parsing fails
-                result = {
-                    "optimized_prompt": content,
-                    "suggestions": ["Review the optimized prompt for clarity"],
-                    "reasoning": "AI-generated optimization",
-                    "confidence_score": 0.8
-                }
-            
-            original_length = len(request.prompt.split())
-            optimized_length = len(result["optimized_prompt"].split())
-            tokens_saved = max(0, original_length - optimized_length)
-            
-            return PromptResponse(
-                original_prompt=request.prompt,
-                optimized_prompt=result["optimized_prompt"],
-                suggestions=result["suggestions"],
-                reasoning=result["reasoning"],
-                model_used=request.model,
-                tokens_saved=tokens_saved,
-                confidence_score=result.get("confidence_score", 0.8)
-            )
-            
-        except Exception as e:
-            raise Exception(f"Error optimizing prompt: {str(e)}")
-    
-    def get_available_models(self) -> List[Dict[str, str]]:
+                async for chunk in stream:
+                    # The final chunk carries usage and no choices when include_usage is set
+                    usage = getattr(chunk, "usage", None) or usage
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                    if choice.delta.content:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                            UPSTREAM_TTFT.observe(
+                                first_token, model=self._metric_model(target.model), base_url=self._metric_base_url(target.base_url)
+                            )
+                        parts.append(choice.delta.content)
+                        yield choice.delta.content
+            except openai.APIError as e:
+                raise to_service_error(e)
+            finally:
+                await stream.response.aclose()
+            elapsed = time.perf_counter() - started
+
+        content = "".join(parts)
+        result = {
+            "content": content,
+            "finish_reason": finish_reason,
+            "model": target.model,
+            "usage": self._usage(usage, prompt_tokens, content, target.model),
+            "latency_ms": round(elapsed * 1000, 1),
+        }
+        self._record_upstream(target, "stream", elapsed, result, first_token)
+        if cache_mode != "bypass" and finish_reason == "stop" and target.model == request.model:
+            await self.cache.set(cache_key, result)
+        completion.update(result, cached=False)
+        self._account(request, completion)
+
+    def _build_optimize_messages(self, request: PromptRequest) -> Tuple[str, str, dict]:
         """
-        Get list of available OpenAI models
+        Build the system prompt, user prompt and response format for an optimization request
         """
-        return [
-            {"name": "gpt-4.1", "description": "Latest GPT-4.1 model with enhanced capabilities"},
-            {"name": "gpt-4o", "description": "GPT-4 Omni - multimodal capabilities"},
-            {"name": "gpt-4.1-mini", "description": "GPT-4.1 Mini - cost-effective GPT-4.1 variant"},
-            {"name": "gpt-4o-mini", "description": "GPT-4 Omni Mini - fast and cost-effective"},
-        ]
-    
-    async def generate_prompt_from_requirements(self, request) -> dict:
+        template = self.templates.get("optimize", request.template_version)
+        formatted_prompt = template.render_user(request.optimization_goal, prompt=request.prompt)
+        
+        if request.context:
+            formatted_prompt += f"\n\nAdditional context / User demand: {request.context}"
+        
+        return template.system_prompt, formatted_prompt, template.response_format
+
+    def _build_optimize_response(self, request: PromptRequest, completion: dict, context_tokens_removed: int = 0) -> PromptResponse:
         """
-        Generate a prompt based on user requirements using the COAST framework structure
+        Turn the completion of an optimization request into a PromptResponse
+        """
+        model = completion.get("model") or request.model
+        candidates = None
+        if completion.get("choices"):
+            results = [self._parse_optimize_result(choice["content"], model) for choice in completion["choices"]]
+            results = [result for result in results if result is not None]
+            if not results:
+                raise UpstreamError("None of the sampled optimizations contained an optimized_prompt")
+            candidates = self.ranker.rank(results, model, request.max_tokens)
+            result = candidates[0]
+        else:
+            result = self._parse_optimize_result(completion["content"], model)
+            if result is None:
+                raise UpstreamError("The optimization response did not contain an optimized_prompt")
+
+        original_tokens, optimized_tokens = self.tokens.count_batch(
+            [request.prompt, result["optimized_prompt"]], model
+        )
+        tokens_saved = max(0, original_tokens - optimized_tokens)
+        usage = completion.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        
+        return PromptResponse(
+            original_prompt=request.prompt,
+            optimized_prompt=result["optimized_prompt"],
+            suggestions=result["suggestions"],
+            reasoning=result["reasoning"],
+            model_used=model,
+            tokens_saved=tokens_saved,
+            confidence_score=result["confidence_score"],
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=0.0 if completion.get("cached") or completion.get("coalesced") else self.catalog.estimate_cost(model, prompt_tokens, completion_tokens),
+            cached=bool(completion.get("cached")),
+            similarity=completion.get("similarity"),
+            context_tokens_removed=context_tokens_removed,
+            candidates=candidates
+        )
+
+    def _parse_optimize_result(self, content: str, model: str) -> Optional[dict]:
+        """
+        Validated fields of an optimization completion, repairing truncated
+        JSON. An optimized_prompt that was cut off is kept as far as it got;
+        other fields that are still missing come back empty. Either way
+        ``parsed`` is false. Without any optimized_prompt there is no result.
         """
-        task_type_prompts = {
-            "general": "Create a general-purpose prompt that clearly communicates the user's needs.",
-            "creative": "Design a prompt that encourages creative, innovative, and imaginative responses.",
-            "technical": "Develop a precise technical prompt suitable for technical analysis or problem-solving.",
-            "analytical": "Create a structured prompt for analytical thinking and data-driven responses.",
-            "educational": "Design an educational prompt that facilitates learning and knowledge transfer."
+        output = parse_structured(content, PolishSchems)
+        fields = output.fields
+        if not output.complete:
+            JSON_PARSE_FALLBACKS.inc(kind="optimize")
+            log_event("json_parse_fallback", logging.WARNING, kind="optimize", model=model, missing=output.missing)
+            fields = salvage(content, output, "optimized_prompt")
+        if "optimized_prompt" not in fields:
+            return None
+        return {
+            "optimized_prompt": fields["optimized_prompt"],
+            "suggestions": fields.get("suggestions", []),
+            "reasoning": fields.get("reasoning", ""),
+            "confidence_score": parse_confidence(fields.get("confidence_score")),
+            "parsed": output.complete
+        }
+
+    async def _complete_structured(self, request, system_prompt: str, user_prompt: str, completion: dict, schema, kind: str) -> dict:
+        """
+        Make sure a structured completion has every field of ``schema``.
+        JSON cut off by max_tokens is repaired locally, keeping every field
+        that was completed and the text of a field it was cut off inside.
+        Fields still missing are requested in one continuation call that
+        asks only for them, and for just the rest of a field that was cut
+        off, instead of regenerating the whole answer. Whatever the
+        continuation cannot supply is left to the partial text. Returns the
+        completion with the merged fields as its content and the token
+        usage of both calls.
+        """
+        output = parse_structured(completion["content"], schema)
+        if output.complete:
+            if not output.repaired:
+                return completion
+            STRUCTURED_OUTPUT_REPAIRS.inc(kind=kind, outcome="repaired")
+            return {**completion, "content": dumps(output.fields)}
+        missing = frozenset(output.missing)
+        try:
+            continuation = await self._chat_completion(
+                request, system_prompt, continuation_prompt(user_prompt, output), continuation_format(schema, missing)
+            )
+        except ServiceError as e:
+            STRUCTURED_OUTPUT_REPAIRS.inc(kind=kind, outcome="incomplete")
+            log_event("structured_continuation_failed", logging.WARNING, kind=kind, model=request.model, missing=output.missing, error=e.message)
+            return completion
+        recovered = parse_structured(continuation["content"], continuation_schema(schema, missing))
+        fields = merge_continuation(output, recovered)
+        STRUCTURED_OUTPUT_REPAIRS.inc(kind=kind, outcome="continued" if recovered.complete else "incomplete")
+        log_event(
+            "structured_output_continued", kind=kind, model=request.model, missing=output.missing,
+            recovered=sorted(recovered.fields), still_cut_off=sorted(recovered.partial)
+        )
+        usage = {
+            key: (completion["usage"].get(key) or 0) + (continuation["usage"].get(key) or 0)
+            for key in ("prompt_tokens", "completion_tokens")
+        }
+        return {
+            **completion,
+            "content": dumps(fields),
+            "usage": usage,
+            "cached": bool(completion.get("cached") and continuation.get("cached")),
+            "coalesced": bool(completion.get("coalesced") and continuation.get("coalesced")),
         }
 
-        system_prompt = """You are an expert prompt engineer. Your task is to create high-quality prompts based on user requirements using the COAST framework. 
+    def _similarity_scope(self, request: PromptRequest, system_prompt: str, response_format: dict) -> str:
+        """
+        Key of everything but the prompt text: only prompts optimized with the
+        same template, goal, context, endpoint and sampling parameters may
+        share a result
+        """
+        extra = {"base_url": request.base_url.rstrip("/")} if request.base_url else {}
+        return self.cache.make_key(
+            system_prompt, "", request.model, request.max_tokens, self.temperature, response_format,
+            goal=request.optimization_goal, context=request.context or "", **extra
+        )
+
+    async def _similar_completion(self, request: PromptRequest, scope: str) -> Optional[dict]:
+        """
+        Cached completion of a near-identical prompt, or None. Entries live
+        in the response cache, so they expire and are evicted with it.
+        """
+        match = self.similar.lookup(scope, request.prompt)
+        if match is None:
+            return None
+        cache_key, similarity = match
+        cached = await self.cache.get(cache_key)
+        if cached is None:
+            return None
+        log_event("similar_prompt_reused", similarity=similarity, model=request.model)
+        return self._account(request, {**cached, "cached": True, "similarity": similarity})
 
-# **Rules:**
-Follow the COAST framework and format when generating prompts:
+    def length_exempt(self, prompt: str, chunked: Optional[bool] = None) -> Tuple[str, ...]:
+        """Analyzer findings to waive for ``prompt``: length limits do not apply to prompts optimized in chunks"""
+        return CHUNKED_EXEMPT if self.chunking.applies(prompt, chunked) else ()
 
-## Context (背景)
-- Establish the background, purpose, and relevant domain knowledge
-- Define the target audience and their expertise level
-- Include any necessary environmental or situational context
+    def _preflight(self, request: PromptRequest):
+        """
+        Reject a prompt the local analyzer finds errors in, when the request asks for it
+        """
+        if not request.preflight:
+            return
+        analysis = self.analyzer.analyze(request.prompt, request.model, request.max_tokens, self.length_exempt(request.prompt, request.chunked))
+        errors = [f["message"] for f in analysis["findings"] if f["severity"] == "error"]
+        if errors:
+            raise PreflightFailed(f"Prompt failed pre-flight checks: {'; '.join(errors)}")
 
-## Objectives (目标)
-- Clearly state what the AI should accomplish
-- Define specific, measurable outcomes
-- Break complex tasks into clear, sequential steps when needed
+    def _compress_request(self, request):
+        """
+        Compress the supplementary text of a request (context, constraints,
+        examples) when compression is enabled for it. Returns the request to
+        send upstream and the number of tokens removed. May run on a worker
+        thread, so the caller records COMPRESSION_TOKENS_REMOVED.
+        """
+        enabled = self.compressor.enabled if request.compress_context is None else request.compress_context
+        if not enabled:
+            return request, 0
+        updates = {}
+        removed = 0
+        if request.context:
+            result = self.compressor.compress(request.context, request.context_token_budget, request.model)
+            if result["timed_out"]:
+                log_event("compression_timed_out", logging.WARNING, model=request.model,
+                          tokens=result["original_tokens"], elapsed_ms=result["elapsed_ms"])
+            updates["context"] = result["text"]
+            removed += result["tokens_removed"]
+        # Constraints and examples are short and specific, so they are only normalized and deduplicated
+        if getattr(request, "constraints", None):
+            result = self.compressor.compress(request.constraints, 0, request.model)
+            updates["constraints"] = result["text"]
+            removed += result["tokens_removed"]
+        if getattr(request, "examples", None):
+            examples = list(dict.fromkeys(normalize(example) for example in request.examples))
+            removed += max(0, sum(self.tokens.count_batch(request.examples, request.model)) - sum(self.tokens.count_batch(examples, request.model)))
+            updates["examples"] = examples
+        if removed:
+            log_event("context_compressed", model=request.model, tokens_removed=removed)
+        return request.model_copy(update=updates), removed
 
-## Action (行动)
-- Provide clear, actionable instructions
-- Specify the format and structure of the response
-- Include examples or templates when helpful
-- Define any constraints or limitations
+    async def _compress_request_async(self, request):
+        """
+        _compress_request on a worker thread: compressing a long context is
+        CPU-bound for tens of milliseconds and would stall every other
+        request on the event loop
+        """
+        enabled = self.compressor.enabled if request.compress_context is None else request.compress_context
+        if not enabled:
+            return request, 0
+        # to_thread keeps the request id context for the compression log line
+        request, removed = await asyncio.to_thread(self._compress_request, request)
+        # Metrics are only updated from the event loop
+        COMPRESSION_TOKENS_REMOVED.inc(removed)
+        return request, removed
+
+    def _parse_chunk(self, request: PromptRequest, chunk: str, completion: dict) -> dict:
+        """
+        Optimization result of one chunk. A chunk whose completion cannot be
+        parsed keeps its original text so the merged prompt stays complete.
+        """
+        output = parse_structured(completion["content"], PolishSchems)
+        result = output.fields
+        if "optimized_prompt" not in result:
+            JSON_PARSE_FALLBACKS.inc(kind="optimize_chunk")
+            log_event("json_parse_fallback", logging.WARNING, kind="optimize_chunk", model=completion.get("model") or request.model)
+            result = {**result, "optimized_prompt": chunk}
+        return result
+
+    async def _reconcile(self, request: PromptRequest, optimized: str, suggestions: List[str]) -> Tuple[str, Optional[dict], Optional[dict]]:
+        """
+        Reconciliation pass over the joined chunks. The model returns short
+        replacements rather than the whole prompt again, so the pass costs
+        little output time. A replacement is applied only when its text
+        occurs exactly once, so a short or repeated ``find`` cannot rewrite
+        unrelated parts of the prompt. Returns the reconciled prompt, the
+        parsed result and the completion; when the pass fails the joined
+        chunks are kept.
+        """
+        template = self.templates.get("reconcile")
+        user_prompt = template.render_user(
+            "general",
+            goal=request.optimization_goal,
+            prompt=optimized,
+            suggestions="\n".join(f"- {suggestion}" for suggestion in suggestions) or "- (none)",
+        )
+        try:
+            completion = await self._chat_completion(request, template.system_prompt, user_prompt, template.response_format)
+            result = loads(completion["content"])
+            replacements = result.get("replacements") or []
+        except (ServiceError, TypeError, ValueError, AttributeError) as e:
+            log_event("reconcile_failed", model=request.model, error=str(e))
+            return optimized, None, None
+        skipped = 0
+        for replacement in replacements:
+            if not isinstance(replacement, dict):
+                continue
+            find, replace = replacement.get("find"), replacement.get("replace")
+            if not (isinstance(find, str) and find and isinstance(replace, str)):
+                continue
+            if optimized.count(find) != 1:
+                skipped += 1
+                continue
+            optimized = optimized.replace(find, replace, 1)
+        if skipped:
+            log_event("reconcile_replacements_skipped", model=request.model, skipped=skipped, total=len(replacements))
+        return optimized, result, completion
+
+    async def _optimize_chunked(self, request: PromptRequest, context_tokens_removed: int = 0) -> PromptResponse:
+        """
+        Map-reduce optimization of a long prompt. The chunks are optimized
+        concurrently, so wall-clock time follows the slowest chunk instead of
+        the whole document, then one reconciliation pass merges them.
+        """
+        started = time.perf_counter()
+        chunks = split_prompt(request.prompt, self.chunking.max_chars)
+        template = self.templates.get("optimize_chunk")
+        parts_outline = outline(chunks)
+        tasks = []
+        for index, chunk in enumerate(chunks, 1):
+            user_prompt = template.render_user(
+                request.optimization_goal, prompt=chunk, index=index, total=len(chunks), outline=parts_outline
+            )
+            if request.context:
+                user_prompt += f"\n\nAdditional context / User demand: {request.context}"
+            tasks.append(asyncio.ensure_future(
+                self._chat_completion(request, template.system_prompt, user_prompt, template.response_format)
+            ))
+        try:
+            completions = await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed chunk fails the request; stop paying for the others
+            for task in tasks:
+                task.cancel()
+            raise
 
-## Support (支持)
-- Offer guidance on how to approach the task
-- Provide relevant resources or references
-- Include troubleshooting tips or common pitfalls to avoid
+        results = [self._parse_chunk(request, chunk, completion) for chunk, completion in zip(chunks, completions)]
+        suggestions = list(dict.fromkeys(
+            suggestion for result in results for suggestion in result.get("suggestions") or [] if isinstance(suggestion, str)
+        ))
+        optimized = "\n\n".join(result["optimized_prompt"].strip() for result in results)
+        optimized, merged, final = await self._reconcile(request, optimized, suggestions)
+        if final is not None:
+            completions.append(final)
 
-## Technology (技术)
-- Use appropriate technical terminology for the domain
-- Leverage prompt engineering best practices
-- Structure the prompt for optimal AI understanding
+        confidences = []
+        for result in [merged] if merged else results:
+            try:
+                confidences.append(float(result.get("confidence_score")))
+            except (TypeError, ValueError):
+                continue
+        prompt_tokens = completion_tokens = 0
+        cost = 0.0
+        for completion in completions:
+            usage = completion.get("usage") or {}
+            prompt_tokens += usage.get("prompt_tokens") or 0
+            completion_tokens += usage.get("completion_tokens") or 0
+            if not completion.get("cached") and not completion.get("coalesced"):
+                cost += self.catalog.estimate_cost(completion.get("model") or request.model, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
+        model = completions[-1].get("model") or request.model
+        original_tokens, optimized_tokens = self.tokens.count_batch([request.prompt, optimized], model)
+        log_event(
+            "chunked_optimization",
+            model=model,
+            chunks=len(chunks),
+            longest_chunk_chars=max(len(chunk) for chunk in chunks),
+            reconciled=merged is not None,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
 
-Generate a comprehensive prompt that incorporates all these elements based on the user's requirements."""
+        return PromptResponse(
+            original_prompt=request.prompt,
+            optimized_prompt=optimized,
+            suggestions=(merged or {}).get("suggestions") or suggestions[:5],
+            reasoning=(merged or {}).get("reasoning") or f"Optimized in {len(chunks)} parts",
+            model_used=model,
+            tokens_saved=max(0, original_tokens - optimized_tokens),
+            confidence_score=sum(confidences) / len(confidences) if confidences else 0.0,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=cost,
+            cached=all(completion.get("cached") for completion in completions),
+            context_tokens_removed=context_tokens_removed,
+            chunks=len(chunks)
+        )
 
-        user_prompt = f"""
-Based on the following requirements, generate a high-quality prompt:
+    def _route(self, request, goal: str):
+        """
+        Resolve ``model: "auto"`` to a concrete model. Returns the request to
+        send and the routing decision, or None when the client chose the model.
+        """
+        if request.model != AUTO_MODEL:
+            return request, None
+        text = getattr(request, "prompt", None) or getattr(request, "requirements", "")
+        extras = [request.context, getattr(request, "constraints", None)] + list(getattr(request, "examples", None) or [])
+        input_tokens = self.tokens.count_batch([text] + [extra for extra in extras if extra], request.model)
+        decision = self.router.choose(sum(input_tokens), request.max_tokens, goal, request.api_key, request.routing_policy)
+        log_event("model_routed", model=decision["model"], policy=decision["policy"], reason=decision["reason"])
+        return request.model_copy(update={"model": decision["model"]}), decision
 
-# **Requirements**: {request.requirements}
+    async def optimize_prompt(self, request: PromptRequest) -> PromptResponse:
+        """
+        Optimize a prompt using OpenAI's API
+        """
+        request, route = self._route(request, request.optimization_goal)
+        response = await self._optimize(request)
+        if route is not None:
+            response.route = RouteDecision(**route)
+        self.router.record_spend(request.api_key, response.cost_usd)
+        return response
 
-# **Task Type**: {task_type_prompts[request.task_type]}
-# **Output Format**: {request.output_format}
+    async def _optimize(self, request: PromptRequest) -> PromptResponse:
+        self._preflight(request)
+        request, context_tokens_removed = await self._compress_request_async(request)
+        if self.chunking.applies(request.prompt, request.chunked):
+            try:
+                return await self._optimize_chunked(request, context_tokens_removed)
+            except ServiceError:
+                raise
+            except Exception as e:
+                raise Exception(f"Error optimizing prompt: {str(e)}")
+        system_prompt, user_prompt, response_format = self._build_optimize_messages(request)
+        n = request.candidates or 1
+        reuse = n == 1 and request.cache is None and (self.similarity_enabled if request.reuse_similar is None else request.reuse_similar)
+        try:
+            if reuse:
+                scope = self._similarity_scope(request, system_prompt, response_format)
+                completion = await self._similar_completion(request, scope)
+                if completion is not None:
+                    return self._build_optimize_response(request, completion, context_tokens_removed)
+            completion = await self._chat_completion(request, system_prompt, user_prompt, response_format, n)
+            if reuse and not completion["cached"] and not completion.get("coalesced"):
+                self.similar.add(scope, request.prompt, self._cache_key(request, system_prompt, user_prompt, response_format))
+            if n == 1:
+                # Sampled candidates are ranked instead; one that was cut off ranks last
+                completion = await self._complete_structured(request, system_prompt, user_prompt, completion, PolishSchems, "optimize")
+            return self._build_optimize_response(request, completion, context_tokens_removed)
+            
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error optimizing prompt: {str(e)}")
 
-"""
+    async def optimize_prompt_stream(self, request: PromptRequest) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Optimize a prompt while streaming progress as (event, data) pairs:
+        ``delta`` for new optimized_prompt text, ``item`` for each completed
+        suggestion and a final ``result`` carrying the PromptResponse
+        """
+        request, route = self._route(request, request.optimization_goal)
+        events = self._optimize_stream(request)
+        try:
+            async for event, data in events:
+                if event == "result":
+                    data["route"] = route
+                    self.router.record_spend(request.api_key, data["cost_usd"])
+                yield event, data
+        finally:
+            await events.aclose()
+
+    async def _optimize_stream(self, request: PromptRequest) -> AsyncIterator[Tuple[str, dict]]:
+        if (request.candidates or 1) > 1 or self.chunking.applies(request.prompt, request.chunked):
+            # Chunks finish out of order and candidates must all be ranked, so the result is sent at once
+            response = await self._optimize(request)
+            yield "delta", {"field": "optimized_prompt", "text": response.optimized_prompt}
+            for index, suggestion in enumerate(response.suggestions):
+                yield "item", {"field": "suggestions", "index": index, "value": suggestion}
+            yield "result", response.model_dump()
+            return
+        self._preflight(request)
+        request, context_tokens_removed = await self._compress_request_async(request)
+        system_prompt, user_prompt, response_format = self._build_optimize_messages(request)
+        parser = IncrementalJSONParser()
+        completion = {}
+        chunks = self._chat_completion_stream(request, system_prompt, user_prompt, response_format, completion)
+        try:
+            async for chunk in chunks:
+                for event in parser.feed(chunk):
+                    if event[0] == "delta" and event[1] == "optimized_prompt":
+                        yield "delta", {"field": event[1], "text": event[2]}
+                    elif event[0] == "item" and event[1] == "suggestions":
+                        yield "item", {"field": event[1], "index": event[2], "value": event[3]}
+            completion = await self._complete_structured(request, system_prompt, user_prompt, completion, PolishSchems, "optimize")
+            response = self._build_optimize_response(request, completion, context_tokens_removed)
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error optimizing prompt: {str(e)}")
+        finally:
+            await chunks.aclose()
+        yield "result", response.model_dump()
+    
+    async def list_upstream_models(self) -> List[str]:
+        """
+        IDs of the models the default upstream serves, for the model catalog
+        """
+        client = self.get_client()
+        return [model.id async for model in client.models.list()]
+
+    def build_batch_body(self, request) -> Tuple[object, dict, Optional[dict], int]:
+        """
+        Prepare an optimization or generation request for the upstream batch
+        API. Returns the request as sent (routed and compressed), the chat
+        completion body, the routing decision and the tokens compression
+        removed. Raises the same ServiceErrors the interactive path would.
+        """
+        optimize = isinstance(request, PromptRequest)
+        request, route = self._route(request, request.optimization_goal if optimize else request.task_type)
+        if optimize:
+            self._preflight(request)
+        request, context_tokens_removed = self._compress_request(request)
+        COMPRESSION_TOKENS_REMOVED.inc(context_tokens_removed)
+        if optimize:
+            system_prompt, user_prompt, response_format = self._build_optimize_messages(request)
+        else:
+            system_prompt, user_prompt, response_format = self._build_generation_messages(request)
+        # Long prompts are sent whole: a batch line cannot run the chunk/reconcile round trips
+        self._prompt_tokens(request, system_prompt, user_prompt)
+        n = (request.candidates or 1) if optimize else 1
+        body = {
+            "model": request.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            "max_tokens": request.max_tokens,
+            "temperature": self.temperature,
+            "response_format": response_format,
+            **({"n": n} if n > 1 else {}),
+        }
+        return request, body, route, context_tokens_removed
+
+    def build_batch_result(self, request, body: dict, context_tokens_removed: int = 0) -> dict:
+        """
+        Turn the chat completion body of a batch output line into the result
+        the interactive endpoint would have returned for ``request``
+        """
+        choices = body.get("choices") or []
+        if not choices:
+            raise UpstreamError("Batch completion has no choices")
+        content = choices[0]["message"]["content"]
+        model = body.get("model") or request.model
+        completion = {
+            "content": content,
+            "finish_reason": choices[0].get("finish_reason"),
+            "model": model,
+            "usage": self._usage(body.get("usage"), 0, content, model),
+        }
+        if len(choices) > 1:
+            completion["choices"] = [
+                {"content": c["message"]["content"], "finish_reason": c.get("finish_reason")} for c in choices
+            ]
+        if isinstance(request, PromptRequest):
+            return self._build_optimize_response(request, completion, context_tokens_removed).model_dump()
+        return PromptGenerationResponse(**self._build_generation_result(request, completion, context_tokens_removed)).model_dump()
+    
+    def _build_generation_messages(self, request) -> Tuple[str, str, dict]:
+        """
+        Build the system prompt, user prompt and response format for a generation request
+        """
+        template = self.templates.get("generate", request.template_version)
+        user_prompt = template.render_user(
+            "general",
+            requirements=request.requirements,
+            task_type=template.task_type(request.task_type),
+            output_format=request.output_format
+        )
 
         if request.context:
             user_prompt += f"# **Additional Context**: {request.context}\n\n"
@@ -226,90 +903,159 @@ Based on the following requirements, generate a high-quality prompt:
         if request.examples and len(request.examples) > 0:
             user_prompt += f"# **Examples**: {', '.join(request.examples)}\n\n"
 
-        user_prompt += """
-Generate a prompt that follows the COAST framework and is ready to use. Provide:
-1. The complete generated prompt
-2. A structured breakdown showing how each COAST element is addressed
-3. Usage tips for getting the best results
-4. 2-3 alternative variations of the prompt
-5. A confidence score (0.0-1.0) for how well the prompt addresses the requirements
-
-# **Output Format**:
-Return your results in the following JSON format:
-{
-    "generated_prompt": "the complete prompt here, output format: ## Context: ## Objectives: ## Action: ## Support: ## Technology:",
-    "prompt_structure": {
-        "context": "how context is addressed",
-        "objectives": "what objectives are defined",
-        "action": "what actions are specified",
-        "support": "what support is provided",
-        "technology": "technical considerations"
-    },
-    "usage_tips": ["tip 1", "tip 2", "tip 3"],
-    "alternatives": ["alternative prompt 1", "alternative prompt 2"],
-    "confidence_score": 0.0-1.0
-}
-"""
+        return template.system_prompt, user_prompt, template.response_format
+
+    def _build_generation_result(self, request, completion: dict, context_tokens_removed: int = 0) -> dict:
+        """
+        Turn the completion of a generation request into the result dict
+        """
+        content = completion["content"]
+        model = completion.get("model") or request.model
+        usage = completion.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        output = parse_structured(content, PromptGenerationSchema)
+        result = output.fields
+        if not output.complete:
+            JSON_PARSE_FALLBACKS.inc(kind="generate")
+            log_event("json_parse_fallback", logging.WARNING, kind="generate", model=model, missing=output.missing)
+            # A generated_prompt that was cut off is still returned, as far as it got
+            result = salvage(content, output, "generated_prompt")
+        if "generated_prompt" not in result:
+            raise UpstreamError("The generation response did not contain a generated_prompt")
+
+        return {
+            "generated_prompt": result["generated_prompt"],
+            "prompt_structure": result.get("prompt_structure", {}),
+            "usage_tips": result.get("usage_tips", []),
+            "alternatives": result.get("alternatives", []),
+            "model_used": model,
+            "confidence_score": parse_confidence(result.get("confidence_score")),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": 0.0 if completion.get("cached") or completion.get("coalesced") else self.catalog.estimate_cost(model, prompt_tokens, completion_tokens),
+            "cached": bool(completion.get("cached")),
+            "context_tokens_removed": context_tokens_removed
+        }
+
+    async def generate_prompt_from_requirements(self, request) -> dict:
+        """
+        Generate a prompt based on user requirements using the COAST framework structure
+        """
+        request, route = self._route(request, request.task_type)
+        result = await self._generate(request)
+        result["route"] = route
+        self.router.record_spend(request.api_key, result["cost_usd"])
+        return result
 
+    async def _generate(self, request) -> dict:
+        request, context_tokens_removed = await self._compress_request_async(request)
+        system_prompt, user_prompt, response_format = self._build_generation_messages(request)
         try:
-            class PromptGenerationSchema(BaseModel):
-                generated_prompt: str
-                prompt_structure: Dict[str, str]
-                usage_tips: List[str]
-                alternatives: List[str]
-                confidence_score: str
-
-            client = self.get_client(request.api_key, request.base_url)
-            response = client.chat.completions.create(
-                model=request.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=request.max_tokens,
-                temperature=0.7,
-                response_format={
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "PromptGenerationSchema",
-                        "schema": PromptGenerationSchema.model_json_schema()
-                    }
-                },
-            )
-            
-            content = response.choices[0].message.content
-            import json
-            try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
-                result = {
-                    "generated_prompt": content,
-                    "prompt_structure": {
-                        "context": "Based on user requirements",
-                        "objectives": "Address the specified task",
-                        "action": "Follow instructions provided",
-                        "support": "General guidance included",
-                        "technology": "Standard prompt engineering"
-                    },
-                    "usage_tips": ["Review the prompt for clarity", "Test with sample inputs", "Adjust based on results"],
-                    "alternatives": ["Simplified version of the prompt", "More detailed version of the prompt"],
-                    "confidence_score": "0.7"
-                }
-            
-            return {
-                "generated_prompt": result["generated_prompt"],
-                "prompt_structure": result["prompt_structure"],
-                "usage_tips": result["usage_tips"],
-                "alternatives": result["alternatives"],
-                "model_used": request.model,
-                "confidence_score": float(result.get("confidence_score", 0.8))
-            }
+            completion = await self._chat_completion(request, system_prompt, user_prompt, response_format)
+            completion = await self._complete_structured(request, system_prompt, user_prompt, completion, PromptGenerationSchema, "generate")
+            return self._build_generation_result(request, completion, context_tokens_removed)
             
+        except ServiceError:
+            raise
+        except Exception as e:
+            raise Exception(f"Error generating prompt: {str(e)}")
+
+    async def generate_prompt_stream(self, request) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Generate a prompt while streaming progress as (event, data) pairs:
+        ``delta`` for new generated_prompt text, ``item`` for each completed
+        usage tip or alternative and a final ``result`` with the full result
+        """
+        request, route = self._route(request, request.task_type)
+        events = self._generate_stream(request)
+        try:
+            async for event, data in events:
+                if event == "result":
+                    data["route"] = route
+                    self.router.record_spend(request.api_key, data["cost_usd"])
+                yield event, data
+        finally:
+            await events.aclose()
+
+    async def _generate_stream(self, request) -> AsyncIterator[Tuple[str, dict]]:
+        request, context_tokens_removed = await self._compress_request_async(request)
+        system_prompt, user_prompt, response_format = self._build_generation_messages(request)
+        parser = IncrementalJSONParser()
+        completion = {}
+        chunks = self._chat_completion_stream(request, system_prompt, user_prompt, response_format, completion)
+        try:
+            async for chunk in chunks:
+                for event in parser.feed(chunk):
+                    if event[0] == "delta" and event[1] == "generated_prompt":
+                        yield "delta", {"field": event[1], "text": event[2]}
+                    elif event[0] == "item" and event[1] in ("usage_tips", "alternatives"):
+                        yield "item", {"field": event[1], "index": event[2], "value": event[3]}
+            completion = await self._complete_structured(request, system_prompt, user_prompt, completion, PromptGenerationSchema, "generate")
+            result = self._build_generation_result(request, completion, context_tokens_removed)
+        except ServiceError:
+            raise
         except Exception as e:
             raise Exception(f"Error generating prompt: {str(e)}")
+        finally:
+            await chunks.aclose()
+        yield "result", result
+
+    def collect_metrics(self) -> List[MetricFamily]:
+        """
+        Export cache, admission and upstream state as metric families at scrape time
+        """
+        families = []
+        cache = self.cache.stats()
+        tiers = [("memory", cache["memory"])] + ([("shared", cache["shared"])] if cache["shared"] else [])
+        families.append(MetricFamily(
+            "cache_lookups_total", "counter", "Response cache lookups by tier and result",
+            [({"tier": tier, "result": result}, stats[key]) for tier, stats in tiers for result, key in (("hit", "hits"), ("miss", "misses"))]
+        ))
+        families.append(MetricFamily(
+            "cache_hit_ratio", "gauge", "Response cache hit ratio since startup",
+            [({"tier": tier}, stats["hit_ratio"]) for tier, stats in tiers]
+        ))
+        families.append(MetricFamily(
+            "singleflight_in_flight", "gauge", "Distinct upstream completions in flight, each possibly serving several requests",
+            [({}, self.inflight.stats()["in_flight"])]
+        ))
+        families.append(MetricFamily(
+            "cache_memory_bytes", "gauge", "Bytes held by the in-process response cache",
+            [({}, cache["memory"]["size_bytes"])]
+        ))
+
+        admission = self.admission.stats()
+        families.append(MetricFamily(
+            "admission_in_flight", "gauge", "Upstream calls currently holding a slot", [({}, admission["in_flight"])]
+        ))
+        families.append(MetricFamily(
+            "admission_queue_depth", "gauge", "Requests waiting for an upstream slot",
+            [({"lane": lane}, depth) for lane, depth in admission["queue_depth_by_lane"].items()]
+        ))
+        families.append(MetricFamily(
+            "admission_rejected_total", "counter", "Requests rejected before reaching the upstream",
+            [({"reason": reason}, count) for reason, count in admission["rejected"].items()]
+        ))
+
+        upstream = self.resilience.snapshot()
+        families.append(MetricFamily(
+            "upstream_events_total", "counter", "Upstream attempts, retries, failovers and hedges",
+            [({"event": event}, upstream[event]) for event in self.resilience.stats]
+        ))
+        # Targets carry caller-supplied models and endpoints, so they are counted per bounded label
+        circuits: Dict[Tuple[str, str], int] = {}
+        for t in upstream["targets"]:
+            labels = (self._metric_model(t["model"]), self._metric_base_url(t["base_url"]))
+            circuits[labels] = circuits.get(labels, 0) + (0 if t["circuit"] == "closed" else 1)
+        families.append(MetricFamily(
+            "upstream_circuit_open", "gauge", "Upstream targets whose circuit is not closed",
+            [({"model": model, "base_url": base_url}, count) for (model, base_url), count in circuits.items()]
+        ))
+        return families
 
-    def estimate_tokens(self, text: str) -> int:
+    def estimate_tokens(self, text: str, model: str = "gpt-4.1") -> int:
         """
-        Rough estimation of tokens in text (1 token ≈ 4 characters)
+        Count the tokens of text for the given model
         """
-        return len(text) // 4
\ No newline at end of file
+        return self.tokens.count(text, model)
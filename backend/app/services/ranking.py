@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional
+
+from app.services.analyzer import SEVERITY_ERROR, PromptAnalyzer
+from app.services.compression import NEAR_DUPLICATE_JACCARD, normalize
+from app.services.similarity import shingles
+
+# Weights of the local candidate score, summing to 1
+QUALITY_WEIGHT = 0.5
+CONFIDENCE_WEIGHT = 0.3
+COST_WEIGHT = 0.2
+# Quality lost per analyzer finding
+ERROR_PENALTY = 0.5
+WARNING_PENALTY = 0.1
+
+
+def _confidence(value) -> Optional[float]:
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def deduplicate(texts: List[str]) -> List[int]:
+    """
+    Indices of the texts to keep, dropping exact and near-duplicates of
+    earlier ones. There are only a handful of candidates, so shingle sets
+    are compared pairwise instead of through fingerprints.
+    """
+    kept: List[int] = []
+    features: List[set] = []
+    for i, text in enumerate(texts):
+        current = set(shingles(normalize(text))) or {text}
+        if any(len(current & other) >= NEAR_DUPLICATE_JACCARD * len(current | other) for other in features):
+            continue
+        features.append(current)
+        kept.append(i)
+    return kept
+
+
+class CandidateRanker:
+    """
+    Ranks optimization candidates sampled from one upstream call without
+    another model call. The score blends the local analyzer's verdict on
+    the optimized prompt, the model's own confidence and the prompt's token
+    cost relative to the cheapest candidate.
+    """
+
+    def __init__(self, analyzer: PromptAnalyzer):
+        self.analyzer = analyzer
+
+    def rank(self, candidates: List[Dict], model: str, max_tokens: int) -> List[Dict]:
+        """
+        Deduplicate and sort ``candidates`` (parsed optimization results),
+        best first. Each returned candidate carries ``tokens``, ``score``
+        and the analyzer's ``issues``; unparseable ones (``parsed`` false)
+        rank last.
+        """
+        candidates = [candidates[i] for i in deduplicate([c["optimized_prompt"] for c in candidates])]
+        tokens = self.analyzer.tokens.count_batch([c["optimized_prompt"] for c in candidates], model)
+        cheapest = min(tokens) or 1
+        ranked = []
+        for candidate, count in zip(candidates, tokens):
+            analysis = self.analyzer.analyze(candidate["optimized_prompt"], model, max_tokens)
+            findings = analysis["findings"]
+            errors = sum(1 for f in findings if f["severity"] == SEVERITY_ERROR)
+            quality = max(0.0, 1.0 - errors * ERROR_PENALTY - (len(findings) - errors) * WARNING_PENALTY)
+            confidence = _confidence(candidate.get("confidence_score"))
+            score = (
+                QUALITY_WEIGHT * quality
+                + CONFIDENCE_WEIGHT * (confidence if confidence is not None else 0.0)
+                + COST_WEIGHT * cheapest / max(count, 1)
+            )
+            if not candidate.get("parsed", True):
+                score -= 1.0
+            ranked.append({
+                **candidate,
+                "tokens": count,
+                "score": round(score, 4),
+                "issues": analysis["issues"],
+            })
+        ranked.sort(key=lambda c: c["score"], reverse=True)
+        return ranked
@@ -0,0 +1,385 @@
+import os
+import time
+import random
+import asyncio
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import openai
+
+from app.services.errors import ServiceError, UpstreamError, UpstreamUnavailable
+
+T = TypeVar("T")
+
+# Status codes worth retrying or failing over on; other 4xx are the caller's fault
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class Target:
+    """One upstream endpoint/model combination a call can be sent to"""
+
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None):
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.base_url, self.model)
+
+    def __repr__(self) -> str:
+        return f"Target({self.base_url!r}, {self.model!r})"
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted samples"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """Rolling windows of recent latencies and call outcomes for one target"""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.outcomes.append(True)
+
+    def record_failure(self):
+        self.outcomes.append(False)
+
+    def error_rate(self) -> Optional[float]:
+        if not self.outcomes:
+            return None
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, q: float) -> Optional[float]:
+        return percentile(sorted(self.samples), q)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After ``failure_threshold`` failures
+    the circuit opens for ``reset_timeout`` seconds, then lets a single probe
+    through (half-open); the probe's outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release_probe(self):
+        """Give up a probe that was cancelled before it had an outcome, so the next call can probe"""
+        self.probing = False
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """A 429 is usually the calling key's own limit, not a fault of the endpoint"""
+    return isinstance(error, openai.APIStatusError) and error.status_code == 429
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read Retry-After / retry-after-ms from an upstream error response"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def to_service_error(error: BaseException) -> ServiceError:
+    """Translate an upstream SDK error into a ServiceError with a sensible status"""
+    if isinstance(error, ServiceError):
+        return error
+    if isinstance(error, openai.APITimeoutError):
+        return UpstreamError(f"Upstream request timed out: {error}", status_code=504)
+    if isinstance(error, openai.APIStatusError):
+        # Client errors (bad key, unknown model, invalid request) keep their status;
+        # upstream overload and server errors become 503 / 502
+        status = error.status_code
+        if status == 429:
+            status = 503
+        elif status >= 500:
+            status = 502
+        return UpstreamError(f"Upstream error {error.status_code}: {error.message}", status_code=status)
+    return UpstreamError(f"Upstream request failed: {error}")
+
+
+def parse_model_fallbacks(value: str) -> Dict[str, List[str]]:
+    """
+    Parse MODEL_FALLBACKS, e.g. ``gpt-4.1:gpt-4.1-mini|gpt-4o-mini,gpt-4o:gpt-4o-mini``
+    """
+    fallbacks: Dict[str, List[str]] = {}
+    for entry in value.split(","):
+        if ":" not in entry:
+            continue
+        model, chain = entry.split(":", 1)
+        fallbacks[model.strip()] = [m.strip() for m in chain.split("|") if m.strip()]
+    return fallbacks
+
+
+class ResilientExecutor:
+    """
+    Runs upstream calls with retries, circuit breaking, optional hedging and
+    failover across an ordered list of targets.
+
+    Retryable failures back off exponentially with full jitter (honouring
+    the upstream Retry-After) and move on to the next target whose circuit
+    is not open. With hedging enabled, a second attempt is started on the
+    next target when the first has not answered within the target's
+    observed p95 latency, and whichever finishes first wins.
+
+    Breakers and latency windows are kept for the ``max_targets`` most
+    recently used targets; callers supply their own base URLs and models.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 1.0,
+        max_targets: int = 256,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.max_targets = max_targets
+        self.breakers: "OrderedDict[Tuple[str, str], CircuitBreaker]" = OrderedDict()
+        self.latencies: "OrderedDict[Tuple[str, str], LatencyTracker]" = OrderedDict()
+        self.stats = {"attempts": 0, "retries": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0, "circuit_rejections": 0}
+
+    @classmethod
+    def from_env(cls) -> "ResilientExecutor":
+        return cls(
+            max_attempts=int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.5")),
+            max_delay=float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "8")),
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+            hedge_enabled=os.getenv("HEDGE_ENABLED", "false").lower() == "true",
+            hedge_percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+            hedge_min_delay=float(os.getenv("HEDGE_MIN_DELAY", "1.0")),
+            max_targets=int(os.getenv("CIRCUIT_MAX_TARGETS", "256")),
+        )
+
+    def _entry(self, table: OrderedDict, target: Target, factory: Callable[[], object]):
+        """Per-target state from an LRU table, evicting the least recently used target beyond max_targets"""
+        entry = table.get(target.key)
+        if entry is not None:
+            table.move_to_end(target.key)
+            return entry
+        entry = table[target.key] = factory()
+        while len(table) > self.max_targets:
+            table.popitem(last=False)
+        return entry
+
+    def breaker(self, target: Target) -> CircuitBreaker:
+        return self._entry(self.breakers, target, lambda: CircuitBreaker(self.failure_threshold, self.reset_timeout))
+
+    def latency(self, target: Target) -> LatencyTracker:
+        return self._entry(self.latencies, target, LatencyTracker)
+
+    def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = retry_after_seconds(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def hedge_delay(self, target: Target) -> float:
+        observed = self.latency(target).percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, observed or 0.0)
+
+    def _next_target(self, targets: List[Target], start: int, exclude: Optional[Target] = None) -> Optional[int]:
+        for offset in range(len(targets)):
+            index = (start + offset) % len(targets)
+            if targets[index] is exclude:
+                continue
+            if self.breaker(targets[index]).allow():
+                return index
+        return None
+
+    async def _attempt(self, target: Target, fn: Callable[[Target], Awaitable[T]]) -> T:
+        self.stats["attempts"] += 1
+        started = time.monotonic()
+        try:
+            result = await fn(target)
+        except asyncio.CancelledError:
+            # A cancelled call (client gone, hedge lost) tells nothing about the target
+            self.breaker(target).release_probe()
+            raise
+        except Exception as e:
+            if is_rate_limited(e):
+                # One tenant's rate limit must not open the circuit for every tenant
+                self.breaker(target).release_probe()
+            elif is_retryable(e):
+                self.breaker(target).record_failure()
+                self.latency(target).record_failure()
+            else:
+                self.breaker(target).record_success()
+            raise
+        self.latency(target).record(time.monotonic() - started)
+        self.breaker(target).record_success()
+        return result
+
+    async def _hedged(self, targets: List[Target], index: int, fn: Callable[[Target], Awaitable[T]]) -> Tuple[T, Target]:
+        primary = targets[index]
+        tasks = {asyncio.ensure_future(self._attempt(primary, fn)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+            if not done:
+                # Hedge on another target when possible, otherwise repeat on the same one
+                hedge_index = self._next_target(targets, index + 1, exclude=primary)
+                if hedge_index is None:
+                    hedge_index = index
+                self.stats["hedges"] += 1
+                hedge_target = targets[hedge_index]
+                tasks[asyncio.ensure_future(self._attempt(hedge_target, fn))] = hedge_target
+
+            error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] is not primary:
+                            self.stats["hedge_wins"] += 1
+                        return task.result(), tasks[task]
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, targets: List[Target], fn: Callable[[Target], Awaitable[T]], hedge: bool = True) -> Tuple[T, Target]:
+        """
+        Call ``fn`` against the targets until one succeeds, returning the
+        result and the target that produced it
+        """
+        last_error: Optional[BaseException] = None
+        last_target: Optional[Target] = None
+        preferred = 0
+        for attempt in range(self.max_attempts):
+            index = self._next_target(targets, preferred)
+            if index is None:
+                self.stats["circuit_rejections"] += 1
+                if last_error is not None:
+                    break
+                retry_after = min(self.breaker(target).retry_after() for target in targets)
+                raise UpstreamUnavailable("All upstream endpoints are temporarily unavailable", retry_after)
+            if last_target is not None and targets[index] is not last_target:
+                self.stats["failovers"] += 1
+            last_target = targets[index]
+
+            try:
+                if hedge and self.hedge_enabled:
+                    return await self._hedged(targets, index, fn)
+                return await self._attempt(targets[index], fn), targets[index]
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e) or attempt == self.max_attempts - 1:
+                    break
+                self.stats["retries"] += 1
+                # Prefer a different target for the next attempt when one is configured
+                preferred = index + 1
+                await asyncio.sleep(self.backoff(attempt, e))
+        raise to_service_error(last_error)
+
+    def model_stats(self, model: str) -> Dict[str, object]:
+        """
+        Latency percentiles and error rate of a model across all endpoints,
+        and whether every endpoint serving it has an open circuit
+        """
+        keys = [key for key in set(self.breakers) | set(self.latencies) if key[1] == model]
+        trackers = [self.latencies[key] for key in keys if key in self.latencies]
+        samples = sorted(sample for tracker in trackers for sample in tracker.samples)
+        outcomes = [outcome for tracker in trackers for outcome in tracker.outcomes]
+        return {
+            "p50_seconds": percentile(samples, 50),
+            "p95_seconds": percentile(samples, 95),
+            "error_rate": outcomes.count(False) / len(outcomes) if outcomes else None,
+            "samples": len(outcomes),
+            "circuit_open": bool(keys) and all(key in self.breakers and self.breakers[key].state == "open" for key in keys),
+        }
+
+    def snapshot(self) -> Dict[str, object]:
+        targets = []
+        for key in sorted(set(self.breakers) | set(self.latencies)):
+            breaker = self.breakers.get(key)
+            tracker = self.latencies.get(key)
+            targets.append({
+                "base_url": key[0],
+                "model": key[1],
+                "circuit": breaker.state if breaker else "closed",
+                "p50_seconds": tracker.percentile(50) if tracker else None,
+                "p95_seconds": tracker.percentile(95) if tracker else None,
+                "error_rate": tracker.error_rate() if tracker else None,
+            })
+        return {**self.stats, "hedge_enabled": self.hedge_enabled, "targets": targets}
@@ -0,0 +1,192 @@
+import os
+import re
+import hashlib
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from app.services.metrics import SIMILARITY_LOOKUPS
+
+SIMHASH_BITS = 64
+# Prompts with fewer shingles than this are left to the exact cache; their fingerprints are too unstable
+MIN_SHINGLES = 6
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+# CJK characters are tokens on their own, everything else splits on word boundaries
+_TOKEN_PATTERN = re.compile(rf"[{_CJK}]|[^\W_{_CJK}]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Normalize case, width and punctuation, then split into word and CJK character tokens"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _TOKEN_PATTERN.findall(text)
+
+
+def shingles(text: str, size: int = 2) -> List[str]:
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return tokens
+    return [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(features: List[str]) -> int:
+    """64-bit SimHash of a feature list; near-identical inputs differ in few bits"""
+    hashes = [_hash64(feature) for feature in features]
+    if np is not None:
+        bits = np.unpackbits(np.array(hashes, dtype="<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        # Set bit i when more than half of the features have it set
+        votes = bits.sum(axis=0) * 2 > len(hashes)
+        return int(np.packbits(votes, bitorder="little").view("<u8")[0])
+    fingerprint = 0
+    half = len(hashes) / 2
+    for bit in range(SIMHASH_BITS):
+        mask = 1 << bit
+        if sum(1 for h in hashes if h & mask) > half:
+            fingerprint |= mask
+    return fingerprint
+
+
+def _band_masks(bands: int) -> List[Tuple[int, int]]:
+    """Split the 64 fingerprint bits into ``bands`` contiguous (shift, mask) ranges"""
+    masks = []
+    start = 0
+    for i in range(bands):
+        width = SIMHASH_BITS // bands + (1 if i < SIMHASH_BITS % bands else 0)
+        masks.append((start, (1 << width) - 1))
+        start += width
+    return masks
+
+
+class SimilarityIndex:
+    """
+    Near-duplicate index over SimHash fingerprints of prompts.
+
+    Similarity is ``1 - hamming_distance / 64``. The fingerprint is split
+    into ``max_distance + 1`` bands; by the pigeonhole principle any two
+    fingerprints within ``max_distance`` bits agree exactly on at least one
+    band, so looking up each band's bucket finds every match without a
+    scan. Each entry costs two 8-byte slots plus a 32-byte value digest;
+    when full the oldest entries are overwritten (ring buffer) and their
+    bucket references removed.
+
+    Entries are grouped by a scope (model, goal, context, template) so only
+    prompts sent with the same parameters can match.
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 1_000_000, max_bucket: int = 64):
+        self.threshold = threshold
+        self.max_distance = int((1.0 - threshold) * SIMHASH_BITS)
+        self.max_entries = max_entries
+        self.max_bucket = max_bucket
+        self.bands = _band_masks(self.max_distance + 1)
+        self._fingerprints = array("Q")
+        self._scopes = array("Q")
+        self._values: List[bytes] = []
+        self._next = 0
+        self._buckets: Dict[Tuple[int, int, int], array] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "SimilarityIndex":
+        return cls(
+            threshold=float(os.getenv("SIMILARITY_THRESHOLD", "0.9")),
+            max_entries=int(os.getenv("SIMILARITY_MAX_ENTRIES", "1000000")),
+        )
+
+    def fingerprint(self, text: str) -> Optional[int]:
+        features = shingles(text)
+        if len(features) < MIN_SHINGLES:
+            return None
+        return simhash(features)
+
+    def _bucket_keys(self, scope: int, fingerprint: int):
+        for band, (shift, mask) in enumerate(self.bands):
+            yield (scope, band, (fingerprint >> shift) & mask)
+
+    def _unlink(self, slot: int):
+        """Remove the references to ``slot`` from its buckets before the slot is reused"""
+        for key in self._bucket_keys(self._scopes[slot], self._fingerprints[slot]):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            try:
+                bucket.remove(slot)
+            except ValueError:
+                # Already trimmed off an overfull bucket
+                continue
+            if not bucket:
+                del self._buckets[key]
+
+    def add(self, scope: str, text: str, value: str):
+        """Index ``text`` under ``scope``; ``value`` is a hex digest such as a cache key"""
+        fingerprint = self.fingerprint(text)
+        if fingerprint is None:
+            return
+        scope_id = int(scope[:16], 16)
+        if len(self._values) < self.max_entries:
+            slot = len(self._values)
+            self._fingerprints.append(fingerprint)
+            self._scopes.append(scope_id)
+            self._values.append(bytes.fromhex(value))
+        else:
+            slot = self._next
+            self._next = (self._next + 1) % self.max_entries
+            self._unlink(slot)
+            self._fingerprints[slot] = fingerprint
+            self._scopes[slot] = scope_id
+            self._values[slot] = bytes.fromhex(value)
+        for key in self._bucket_keys(scope_id, fingerprint):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = array("I")
+            bucket.append(slot)
+            if len(bucket) > self.max_bucket:
+                # Keep the newest half; older references are the likeliest to be stale
+                del bucket[:len(bucket) - self.max_bucket // 2]
+
+    def lookup(self, scope: str, text: str) -> Optional[Tuple[str, float]]:
+        """Return the value and similarity of the closest indexed prompt above the threshold"""
+        fingerprint = self.fingerprint(text)
+        best: Optional[Tuple[int, int]] = None
+        if fingerprint is not None:
+            scope_id = int(scope[:16], 16)
+            seen = set()
+            for key in self._bucket_keys(scope_id, fingerprint):
+                for slot in self._buckets.get(key, ()):
+                    if slot in seen:
+                        continue
+                    seen.add(slot)
+                    distance = (self._fingerprints[slot] ^ fingerprint).bit_count()
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (slot, distance)
+        if best is None:
+            self.misses += 1
+            SIMILARITY_LOOKUPS.inc(result="miss")
+            return None
+        self.hits += 1
+        SIMILARITY_LOOKUPS.inc(result="hit")
+        return self._values[best[0]].hex(), round(1.0 - best[1] / SIMHASH_BITS, 4)
+
+    def stats(self) -> Dict[str, object]:
+        references = sum(len(bucket) for bucket in self._buckets.values())
+        return {
+            "entries": len(self._values),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "max_distance_bits": self.max_distance,
+            "bands": len(self.bands),
+            "buckets": len(self._buckets),
+            "hits": self.hits,
+            "misses": self.misses,
+            "approx_bytes": len(self._values) * (16 + 8 + 65) + references * 4 + len(self._buckets) * 120,
+        }
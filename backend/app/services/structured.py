@@ -0,0 +1,155 @@
+import json
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, Type
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
+
+from app.services.json_stream import IncrementalJSONParser
+from app.services.templates import CONTINUATION_CUT_TEMPLATE, CONTINUATION_TEMPLATE
+
+
+def loads(text) -> Any:
+    """Decode JSON with orjson when it is installed; raises ValueError either way"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def dumpb(value: Any) -> bytes:
+    """Compact UTF-8 JSON, non-ASCII kept as is"""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(value: Any) -> str:
+    return dumpb(value).decode("utf-8")
+
+
+@lru_cache(maxsize=None)
+def _field_validators(schema: Type[BaseModel]) -> Tuple[Tuple[str, type, TypeAdapter], ...]:
+    # Built once per response model; fields are validated one by one so a bad field does not discard the good ones
+    return tuple((name, field.annotation, TypeAdapter(field.annotation)) for name, field in schema.model_fields.items())
+
+
+def parse_confidence(value) -> float:
+    """The model's confidence_score as a number in [0, 1], or 0.0 when it gave none"""
+    try:
+        return min(1.0, max(0.0, float(value)))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class StructuredOutput:
+    """
+    Fields of a structured completion that validated against its response
+    model, and the ones that are missing or invalid. ``repaired`` is set
+    when the content was not valid JSON as a whole (usually cut off by
+    max_tokens) and the fields were recovered by the incremental parser.
+    ``partial`` holds the text of a string field the content broke off
+    inside; that field is still listed as missing.
+    """
+
+    def __init__(self, fields: Dict[str, Any], missing: List[str], repaired: bool, partial: Optional[Dict[str, str]] = None):
+        self.fields = fields
+        self.missing = missing
+        self.repaired = repaired
+        self.partial = partial or {}
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+
+def parse_structured(content: str, schema: Type[BaseModel]) -> StructuredOutput:
+    """
+    Parse a completion against ``schema``. Valid JSON takes the fast
+    decoder; anything else goes through the incremental parser, which keeps
+    every top-level field that was completed before the text broke off,
+    plus the text of a string field it broke off inside.
+    """
+    data, repaired, partial = None, False, {}
+    try:
+        data = loads(content or "")
+    except ValueError:
+        pass
+    if not isinstance(data, dict):
+        parser = IncrementalJSONParser()
+        parser.feed(content or "")
+        data, repaired = parser.fields, True
+        open_string = parser.open_string()
+        if open_string is not None:
+            name, text = open_string
+            field = schema.model_fields.get(name)
+            if field is not None and field.annotation is str:
+                partial = {name: text}
+    fields, missing = {}, []
+    for name, annotation, adapter in _field_validators(schema):
+        value = data.get(name)
+        # Models often write confidence_score as a number where the schema asks for a string
+        if annotation is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        try:
+            fields[name] = adapter.validate_python(value)
+        except ValidationError:
+            missing.append(name)
+    return StructuredOutput(fields, missing, repaired, partial)
+
+
+@lru_cache(maxsize=256)
+def continuation_schema(schema: Type[BaseModel], missing: FrozenSet[str]) -> Type[BaseModel]:
+    """Response model with only the ``missing`` fields of ``schema``"""
+    return create_model(
+        f"{schema.__name__}Continuation",
+        **{name: (field.annotation, ...) for name, field in schema.model_fields.items() if name in missing}
+    )
+
+
+@lru_cache(maxsize=256)
+def continuation_format(schema: Type[BaseModel], missing: FrozenSet[str]) -> dict:
+    model = continuation_schema(schema, missing)
+    return {"type": "json_schema", "json_schema": {"name": model.__name__, "schema": model.model_json_schema()}}
+
+
+def continuation_prompt(user_prompt: str, output: StructuredOutput) -> str:
+    """
+    User message asking for just the missing fields. It repeats the
+    original request after the same system prompt, so the upstream can
+    reuse its cached prefix, and shows the fields already written so the
+    new ones stay consistent with them. A field that was cut off is shown
+    as far as it got and only the rest of it is asked for.
+    """
+    return user_prompt + CONTINUATION_TEMPLATE.render(
+        partial=json.dumps({**output.fields, **output.partial}, ensure_ascii=False, indent=2),
+        cut="".join(CONTINUATION_CUT_TEMPLATE.render(field=name) for name in output.partial),
+        fields=", ".join(output.missing),
+    )
+
+
+def salvage(content: str, output: StructuredOutput, main_field: str) -> Dict[str, Any]:
+    """
+    Everything usable from a completion that stayed incomplete: the valid
+    fields, the text of a field that was cut off and, when the model wrote
+    plain text instead of JSON, that text as ``main_field``
+    """
+    fields = {**output.partial, **output.fields}
+    if main_field not in fields and output.repaired and "{" not in (content or "") and (content or "").strip():
+        fields[main_field] = content.strip()
+    return fields
+
+
+def merge_continuation(output: StructuredOutput, continuation: StructuredOutput) -> Dict[str, Any]:
+    """
+    Fields of a cut-off completion merged with those of the continuation
+    that asked for the rest. A field that was cut off is the text it got to
+    followed by the continued text, however far the continuation got.
+    """
+    fields = {**output.fields, **continuation.partial, **continuation.fields}
+    for name, text in output.partial.items():
+        fields[name] = text + fields[name] if name in fields else text
+    return fields
@@ -0,0 +1,527 @@
+import os
+import json
+import string
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from app.models.schemas import JudgeSchema, PolishSchems, PromptGenerationSchema, ReconcileSchema
+from app.services.errors import TemplateNotFound
+
+# Response models a template may reference by name
+RESPONSE_SCHEMAS = {
+    "PolishSchems": PolishSchems,
+    "PromptGenerationSchema": PromptGenerationSchema,
+    "ReconcileSchema": ReconcileSchema,
+    "JudgeSchema": JudgeSchema,
+}
+
+OPTIMIZE_SYSTEM_PROMPT = """You are a prompt optimization expert. Your task is to rewrite and enhance user-provided prompts to achieve clearer, more effective, and higher-quality outputs.
+
+# **Rules:**
+Follow the COAST framework and format when optimizing prompts:
+
+## Context (背景)
+- Understand the purpose, target audience, domain, and constraints of the original prompt.
+- Extract and incorporate relevant details from any supplementary text or user-provided background.
+
+## Objectives (目标)
+1. Ensure the optimized prompt is clear, specific, and unambiguous.
+2. Improve contextual richness for better model understanding.
+3. Break down complex tasks into manageable steps.
+4. Include examples, constraints, or formatting instructions when beneficial.
+5. If the original prompt is empty, generate a suitable prompt based on the supplementary text and user needs.
+
+## Action (行动)
+- Rewrite the prompt to maximize clarity, relevance, and usability.
+- Structure the prompt logically, following COAST principles.
+- Integrate relevant examples or reference points when needed.
+- Maintain alignment with user intent.
+
+## Support (支持)
+- Suggest additional information that could improve the prompt.
+- Provide recommendations for constraints, formats, or tone adjustments.
+- Highlight missing details that may hinder optimal results.
+
+## Technology (技术)
+- Leverage prompt-engineering best practices.
+- Apply domain-specific terminology when relevant.
+- Use structured response formatting to ensure consistency.
+
+# **Output format:**
+Return your results in the following JSON format:
+{
+    "optimized_prompt": "your optimized prompt here, output format: ## Context: ## Objectives: ## Action: ## Support: ## Technology:",
+    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
+    "reasoning": "explanation of why these changes improve the prompt",
+    "confidence_score": 0.0-1.0
+}
+"""
+
+OPTIMIZATION_GOAL_PROMPTS = {
+    "general": (
+        "Optimize this prompt for better clarity, effectiveness, and results.\n"
+        "Provide the optimized prompt along with specific suggestions for improvement.\n"
+        "Original prompt: {prompt}"
+    ),
+    "clarity": (
+        "Rewrite this prompt to be exceptionally clear and unambiguous.\n"
+        "Focus on precise language, clear instructions, and logical structure.\n"
+        "Original prompt: {prompt}"
+    ),
+    "conciseness": (
+        "Optimize this prompt to be more concise while maintaining its effectiveness.\n"
+        "Remove redundancy and unnecessary words without losing important details.\n"
+        "Original prompt: {prompt}"
+    ),
+    "creativity": (
+        "Enhance this prompt to encourage more creative and innovative responses.\n"
+        "Add elements that stimulate creative thinking and unique perspectives.\n"
+        "Original prompt: {prompt}"
+    ),
+    "specificity": (
+        "Make this prompt more specific and detailed to get more targeted and accurate responses.\n"
+        "Add specific constraints, examples, or requirements where appropriate.\n"
+        "Original prompt: {prompt}"
+    )
+}
+
+OPTIMIZE_CHUNK_SYSTEM_PROMPT = """You are a prompt optimization expert. A long prompt has been split into parts that are optimized separately and then joined back together in order. You receive one part together with an outline of all parts.
+
+# **Rules:**
+- Rewrite only the given part to be clearer, more specific and better structured, following the optimization goal.
+- Keep the part's headings, placeholders, examples and its role within the whole prompt.
+- Do not add an introduction, a summary or content that belongs to other parts of the outline.
+- Do not restructure the part into a full COAST prompt; the surrounding parts provide the rest.
+
+# **Output format:**
+Return your results in the following JSON format:
+{
+    "optimized_prompt": "the optimized part only",
+    "suggestions": ["suggestion 1", "suggestion 2"],
+    "reasoning": "explanation of why these changes improve the part",
+    "confidence_score": 0.0-1.0
+}
+"""
+
+OPTIMIZE_CHUNK_GOAL_PROMPTS = {
+    name: (
+        text.split("\n", 1)[0] + "\n"
+        "This is part {index} of {total}. Outline of all parts:\n{outline}\n\n"
+        "Part to optimize:\n{prompt}"
+    )
+    for name, text in OPTIMIZATION_GOAL_PROMPTS.items()
+}
+
+RECONCILE_SYSTEM_PROMPT = """You are a prompt optimization expert. A long prompt was optimized in parts that were rewritten independently and joined in order. Review the joined prompt for problems that only show across parts.
+
+# **Rules:**
+- Look for inconsistent terminology, contradictory requirements and instructions repeated in several parts.
+- Fix them with short replacements: "find" must be text copied exactly from the prompt that occurs only once in it (include enough surrounding words), "replace" the text to put in its place (empty to delete).
+- Propose only the replacements needed; return an empty list when the parts already read as one prompt.
+- Consolidate the suggestions made for the individual parts into at most five suggestions for the whole prompt.
+
+# **Output format:**
+Return your results in the following JSON format:
+{
+    "replacements": [{"find": "exact text from the prompt", "replace": "new text"}],
+    "suggestions": ["suggestion 1", "suggestion 2", "suggestion 3"],
+    "reasoning": "explanation of how the optimized prompt improves on the original",
+    "confidence_score": 0.0-1.0
+}
+"""
+
+RECONCILE_USER_TEMPLATE = """Optimization goal: {goal}
+
+# **Optimized prompt**:
+{prompt}
+
+# **Suggestions for the individual parts**:
+{suggestions}
+"""
+
+JUDGE_SYSTEM_PROMPT = """You are an impartial evaluator. Two assistants, A and B, answered the same input for the same task. Decide which answer serves the task better.
+
+# **Rules:**
+- Judge correctness, completeness, adherence to the task's instructions and requested format, and clarity, in that order.
+- Do not prefer an answer for being longer. Ignore the order the answers are shown in.
+- Score each answer from 0.0 to 1.0 and declare a tie when neither is clearly better.
+
+# **Output format:**
+Return your verdict in the following JSON format:
+{
+    "winner": "A", "B" or "tie",
+    "score_a": 0.0-1.0,
+    "score_b": 0.0-1.0,
+    "rationale": "one or two sentences on the deciding difference"
+}
+"""
+
+JUDGE_USER_TEMPLATE = """# **Task**:
+{task}
+
+# **Input**:
+{input}
+
+# **Answer A**:
+{answer_a}
+
+# **Answer B**:
+{answer_b}
+"""
+
+# Appended to the original user message when a structured answer came back
+# without some of its fields, asking for only those
+CONTINUATION_USER_TEMPLATE = """
+
+# **Continuation**:
+An earlier answer to this request was cut off. These fields were already written:
+{partial}
+
+{cut}Return a JSON object with only the missing fields: {fields}. Keep them consistent with the fields above and as concise as the task allows.
+"""
+CONTINUATION_CUT_USER_TEMPLATE = """The "{field}" field above stops partway. For "{field}", return only the text that continues it from exactly where it stops, not the whole value again.
+
+"""
+
+# The static instructions live in the system prompt so every request shares a
+# byte-identical prefix that upstream prompt caching can reuse
+GENERATE_SYSTEM_PROMPT = """You are an expert prompt engineer. Your task is to create high-quality prompts based on user requirements using the COAST framework. 
+
+# **Rules:**
+Follow the COAST framework and format when generating prompts:
+
+## Context (背景)
+- Establish the background, purpose, and relevant domain knowledge
+- Define the target audience and their expertise level
+- Include any necessary environmental or situational context
+
+## Objectives (目标)
+- Clearly state what the AI should accomplish
+- Define specific, measurable outcomes
+- Break complex tasks into clear, sequential steps when needed
+
+## Action (行动)
+- Provide clear, actionable instructions
+- Specify the format and structure of the response
+- Include examples or templates when helpful
+- Define any constraints or limitations
+
+## Support (支持)
+- Offer guidance on how to approach the task
+- Provide relevant resources or references
+- Include troubleshooting tips or common pitfalls to avoid
+
+## Technology (技术)
+- Use appropriate technical terminology for the domain
+- Leverage prompt engineering best practices
+- Structure the prompt for optimal AI understanding
+
+Generate a comprehensive prompt that incorporates all these elements based on the user's requirements.
+
+Generate a prompt that follows the COAST framework and is ready to use. Provide:
+1. The complete generated prompt
+2. A structured breakdown showing how each COAST element is addressed
+3. Usage tips for getting the best results
+4. 2-3 alternative variations of the prompt
+5. A confidence score (0.0-1.0) for how well the prompt addresses the requirements
+
+# **Output Format**:
+Return your results in the following JSON format:
+{
+    "generated_prompt": "the complete prompt here, output format: ## Context: ## Objectives: ## Action: ## Support: ## Technology:",
+    "prompt_structure": {
+        "context": "how context is addressed",
+        "objectives": "what objectives are defined",
+        "action": "what actions are specified",
+        "support": "what support is provided",
+        "technology": "technical considerations"
+    },
+    "usage_tips": ["tip 1", "tip 2", "tip 3"],
+    "alternatives": ["alternative prompt 1", "alternative prompt 2"],
+    "confidence_score": 0.0-1.0
+}
+"""
+
+GENERATE_USER_TEMPLATE = """
+Based on the following requirements, generate a high-quality prompt:
+
+# **Requirements**: {requirements}
+
+# **Task Type**: {task_type}
+# **Output Format**: {output_format}
+
+"""
+
+TASK_TYPE_PROMPTS = {
+    "general": "Create a general-purpose prompt that clearly communicates the user's needs.",
+    "creative": "Design a prompt that encourages creative, innovative, and imaginative responses.",
+    "technical": "Develop a precise technical prompt suitable for technical analysis or problem-solving.",
+    "analytical": "Create a structured prompt for analytical thinking and data-driven responses.",
+    "educational": "Design an educational prompt that facilitates learning and knowledge transfer."
+}
+
+BUILTIN_VERSION = "v1"
+TEMPLATE_KINDS = ("optimize", "generate", "optimize_chunk", "reconcile", "judge")
+# Fields each kind's callers supply to its user templates
+TEMPLATE_FIELDS = {
+    "optimize": frozenset({"prompt"}),
+    "generate": frozenset({"requirements", "task_type", "output_format"}),
+    "optimize_chunk": frozenset({"prompt", "index", "total", "outline"}),
+    "reconcile": frozenset({"goal", "prompt", "suggestions"}),
+    "judge": frozenset({"task", "input", "answer_a", "answer_b"}),
+}
+DEFAULT_SCHEMAS = {
+    "optimize": "PolishSchems",
+    "generate": "PromptGenerationSchema",
+    "optimize_chunk": "PolishSchems",
+    "reconcile": "ReconcileSchema",
+    "judge": "JudgeSchema",
+}
+
+
+class CompiledTemplate:
+    """
+    A ``str.format`` style template parsed once into literal text and field
+    names, so rendering is a single join instead of re-parsing the string
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.segments: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in string.Formatter().parse(source):
+            if spec or conversion:
+                raise ValueError(f"Unsupported format spec in template field {{{field}}}")
+            if field is not None and not field.isidentifier():
+                raise ValueError(f"Template fields must be plain names, got {{{field}}}")
+            self.segments.append((literal, field))
+        self.fields = {field for _, field in self.segments if field is not None}
+
+    def render(self, **values: str) -> str:
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(values[field]))
+        return "".join(parts)
+
+
+CONTINUATION_TEMPLATE = CompiledTemplate(CONTINUATION_USER_TEMPLATE)
+CONTINUATION_CUT_TEMPLATE = CompiledTemplate(CONTINUATION_CUT_USER_TEMPLATE)
+
+
+class PromptTemplate:
+    """
+    One versioned prompt template. The system prompt is static so it forms a
+    byte-stable prefix across requests; request data only ever goes into the
+    user message. The response_format payload is computed once.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        version: str,
+        system_prompt: str,
+        user_templates: Dict[str, str],
+        response_schema: str,
+        task_types: Optional[Dict[str, str]] = None,
+        source: str = "builtin",
+    ):
+        if kind not in TEMPLATE_KINDS:
+            raise ValueError(f"Unknown template kind: {kind}")
+        if "general" not in user_templates:
+            raise ValueError("Templates must define a 'general' user template")
+        if response_schema not in RESPONSE_SCHEMAS:
+            raise ValueError(f"Unknown response schema: {response_schema}")
+        self.kind = kind
+        self.version = version
+        self.system_prompt = system_prompt
+        self.user_templates = {name: CompiledTemplate(text) for name, text in user_templates.items()}
+        # Rendering a field the caller does not supply would fail every request using the template
+        for name, template in self.user_templates.items():
+            unknown = template.fields - TEMPLATE_FIELDS[kind]
+            if unknown:
+                raise ValueError(
+                    f"User template '{name}' uses fields {kind} templates are not given: "
+                    f"{', '.join(sorted(unknown))} (available: {', '.join(sorted(TEMPLATE_FIELDS[kind]))})"
+                )
+        self.task_types = dict(task_types or {})
+        self.source = source
+        self.response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": response_schema,
+                "schema": RESPONSE_SCHEMAS[response_schema].model_json_schema()
+            }
+        }
+
+    def render_user(self, name: str, **values: str) -> str:
+        """Render the named user template, falling back to ``general``"""
+        template = self.user_templates.get(name) or self.user_templates["general"]
+        return template.render(**values)
+
+    def task_type(self, name: str) -> str:
+        return self.task_types.get(name) or self.task_types.get("general", name)
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            "kind": self.kind,
+            "version": self.version,
+            "source": self.source,
+            "user_templates": sorted(self.user_templates),
+            "task_types": sorted(self.task_types),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, source: str) -> "PromptTemplate":
+        if not isinstance(data, dict):
+            raise ValueError("A template file must hold a JSON object")
+        kind = data["kind"]
+        if not isinstance(data["system_prompt"], str):
+            raise ValueError("system_prompt must be a string")
+        user_templates = data["user_templates"]
+        if not isinstance(user_templates, dict) or not all(isinstance(text, str) for text in user_templates.values()):
+            raise ValueError("user_templates must map names to strings")
+        task_types = data.get("task_types")
+        if task_types is not None and (not isinstance(task_types, dict) or not all(isinstance(text, str) for text in task_types.values())):
+            raise ValueError("task_types must map names to strings")
+        default_schema = DEFAULT_SCHEMAS.get(kind, "PromptGenerationSchema")
+        return cls(
+            kind=kind,
+            version=str(data["version"]),
+            system_prompt=data["system_prompt"],
+            user_templates=user_templates,
+            response_schema=data.get("response_schema", default_schema),
+            task_types=task_types,
+            source=source,
+        )
+
+
+def builtin_templates() -> List[PromptTemplate]:
+    return [
+        PromptTemplate(
+            "optimize", BUILTIN_VERSION, OPTIMIZE_SYSTEM_PROMPT, OPTIMIZATION_GOAL_PROMPTS, "PolishSchems"
+        ),
+        PromptTemplate(
+            "generate", BUILTIN_VERSION, GENERATE_SYSTEM_PROMPT, {"general": GENERATE_USER_TEMPLATE},
+            "PromptGenerationSchema", task_types=TASK_TYPE_PROMPTS
+        ),
+        PromptTemplate(
+            "optimize_chunk", BUILTIN_VERSION, OPTIMIZE_CHUNK_SYSTEM_PROMPT, OPTIMIZE_CHUNK_GOAL_PROMPTS, "PolishSchems"
+        ),
+        PromptTemplate(
+            "reconcile", BUILTIN_VERSION, RECONCILE_SYSTEM_PROMPT, {"general": RECONCILE_USER_TEMPLATE}, "ReconcileSchema"
+        ),
+        PromptTemplate(
+            "judge", BUILTIN_VERSION, JUDGE_SYSTEM_PROMPT, {"general": JUDGE_USER_TEMPLATE}, "JudgeSchema"
+        ),
+    ]
+
+
+class TemplateRegistry:
+    """
+    Versioned prompt templates, compiled once at startup.
+
+    Custom templates are JSON files in ``PROMPT_TEMPLATE_DIR``, one template
+    per file::
+
+        {
+            "kind": "optimize",
+            "version": "v2",
+            "default": true,
+            "system_prompt": "...",
+            "user_templates": {"general": "... {prompt}", "clarity": "..."}
+        }
+
+    Generation templates use ``{requirements}``, ``{task_type}`` and
+    ``{output_format}`` in their ``general`` user template and may override
+    ``task_types``. Long prompts are optimized per chunk with an
+    ``optimize_chunk`` template (``{prompt}``, ``{index}``, ``{total}``,
+    ``{outline}``) and merged with a ``reconcile`` template (``{goal}``,
+    ``{prompt}``, ``{suggestions}``); evaluation verdicts use a ``judge``
+    template (``{task}``, ``{input}``, ``{answer_a}``, ``{answer_b}``). A
+    template using any other field is rejected at load and listed in
+    ``errors``. A template marked ``default`` becomes the active version
+    of its kind; otherwise the builtin ``v1`` stays active. The directory is
+    re-read by reload(), or automatically by watch() when files change.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self.templates: Dict[str, Dict[str, PromptTemplate]] = {}
+        self.active: Dict[str, str] = {}
+        self.errors: List[str] = []
+        self._signature: Tuple = ()
+        self.reload()
+
+    @classmethod
+    def from_env(cls) -> "TemplateRegistry":
+        return cls(os.getenv("PROMPT_TEMPLATE_DIR") or None)
+
+    def _scan(self) -> Tuple:
+        if not self.directory or not os.path.isdir(self.directory):
+            return ()
+        entries = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(entries)
+
+    def reload(self) -> Dict[str, object]:
+        """
+        Rebuild the registry from the builtins and the template directory.
+        Invalid files are skipped and reported; the new set is swapped in
+        atomically so in-flight requests keep the template they started with.
+        """
+        templates = {kind: {} for kind in TEMPLATE_KINDS}
+        active = {kind: BUILTIN_VERSION for kind in TEMPLATE_KINDS}
+        for template in builtin_templates():
+            templates[template.kind][template.version] = template
+
+        errors = []
+        signature = self._scan()
+        for name, _, _ in signature:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                template = PromptTemplate.from_dict(data, source=name)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                errors.append(f"{name}: {e}")
+                continue
+            templates[template.kind][template.version] = template
+            if data.get("default"):
+                active[template.kind] = template.version
+
+        self.templates = templates
+        self.active = active
+        self.errors = errors
+        self._signature = signature
+        return self.stats()
+
+    def get(self, kind: str, version: Optional[str] = None) -> PromptTemplate:
+        versions = self.templates[kind]
+        template = versions.get(version or self.active[kind])
+        if template is None:
+            raise TemplateNotFound(
+                f"Unknown {kind} template version '{version}', available: {', '.join(sorted(versions))}"
+            )
+        return template
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "directory": self.directory,
+            "active": dict(self.active),
+            "templates": [t.describe() for kind in TEMPLATE_KINDS for t in self.templates[kind].values()],
+            "errors": list(self.errors),
+        }
+
+    async def watch(self, interval: float):
+        """Poll the template directory and reload when a file is added, changed or removed"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._scan() != self._signature:
+                    self.reload()
+            except OSError:
+                continue
@@ -0,0 +1,56 @@
+import time
+import hashlib
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+# Requests without their own API key share this tenant
+DEFAULT_TENANT = "default"
+
+
+def tenant_id(api_key: Optional[str]) -> str:
+    """Stable tenant identifier derived from the API key; the key itself is never stored"""
+    if not api_key:
+        return DEFAULT_TENANT
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class SpendTracker:
+    """
+    USD spent per tenant over a sliding window, kept as per-minute totals.
+    Idle tenants are evicted beyond ``max_tenants`` (least recently used).
+    """
+
+    def __init__(self, window: float = 86400.0, max_tenants: int = 10000, bucket_seconds: float = 60.0):
+        self.window = window
+        self.max_tenants = max_tenants
+        self.bucket_seconds = bucket_seconds
+        self._tenants: "OrderedDict[str, deque]" = OrderedDict()
+
+    def _buckets(self, tenant: str) -> deque:
+        buckets = self._tenants.get(tenant)
+        if buckets is None:
+            buckets = self._tenants[tenant] = deque()
+            if len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+        else:
+            self._tenants.move_to_end(tenant)
+        horizon = time.time() - self.window
+        while buckets and buckets[0][0] < horizon:
+            buckets.popleft()
+        return buckets
+
+    def add(self, tenant: str, usd: float):
+        if usd <= 0:
+            return
+        buckets = self._buckets(tenant)
+        start = time.time() // self.bucket_seconds * self.bucket_seconds
+        if buckets and buckets[-1][0] == start:
+            buckets[-1][1] += usd
+        else:
+            buckets.append([start, usd])
+
+    def spent(self, tenant: str) -> float:
+        return sum(amount for _, amount in self._buckets(tenant))
+
+    def stats(self) -> Dict[str, object]:
+        return {"tenants": len(self._tenants), "window_seconds": self.window}
@@ -0,0 +1,262 @@
+import os
+import re
+import math
+import hashlib
+import logging
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+    from tiktoken.load import load_tiktoken_bpe
+except ImportError:
+    tiktoken = None
+
+from app.services.logs import log_event
+
+# Pre-tokenizer patterns and special tokens of the OpenAI BPE encodings, so a
+# vocabulary shipped on disk can be loaded without tiktoken's network fetch
+ENCODING_SPECS = {
+    "o200k_base": {
+        "pat_str": "|".join([
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]*[\p{Ll}\p{Lm}\p{Lo}\p{M}]+(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""[^\r\n\p{L}\p{N}]?[\p{Lu}\p{Lt}\p{Lm}\p{Lo}\p{M}]+[\p{Ll}\p{Lm}\p{Lo}\p{M}]*(?i:'s|'t|'re|'ve|'m|'ll|'d)?""",
+            r"""\p{N}{1,3}""",
+            r""" ?[^\s\p{L}\p{N}]+[\r\n/]*""",
+            r"""\s*[\r\n]+""",
+            r"""\s+(?!\S)""",
+            r"""\s+""",
+        ]),
+        "special_tokens": {"<|endoftext|>": 199999, "<|endofprompt|>": 200018},
+    },
+    "cl100k_base": {
+        "pat_str": r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s""",
+        "special_tokens": {
+            "<|endoftext|>": 100257,
+            "<|fim_prefix|>": 100258,
+            "<|fim_middle|>": 100259,
+            "<|fim_suffix|>": 100260,
+            "<|endofprompt|>": 100276,
+        },
+    },
+}
+
+# Longest matching prefix wins
+MODEL_ENCODINGS = {
+    "gpt-4.1": "o200k_base",
+    "gpt-4o": "o200k_base",
+    "gpt-4.5": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "o4": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5": "cl100k_base",
+}
+DEFAULT_ENCODING = "o200k_base"
+
+# Tokens added per chat message by the chat format (role markers and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef"
+# Pieces the estimate prices, each counted with one findall over the text:
+# runs of CJK characters, words in pieces of up to five letters, digit runs
+# (which carry on into full-width digits), whitespace runs that span a line
+# or more than one character, and single other characters
+_ESTIMATE_CJK = re.compile(f"[{_CJK}]+")
+_ESTIMATE_WORD_PIECE = re.compile(rf"[^\W\d_{_CJK}]{{1,5}}")
+_ESTIMATE_DIGITS = re.compile(rf"[^\D{_CJK}]\d*")
+_ESTIMATE_SPACE = re.compile(r"\s{2,}|\n")
+_ESTIMATE_OTHER = re.compile(rf"[^\w\s{_CJK}]|_")
+# ASCII text is priced the same way with str.translate/split, which run in C
+_ASCII = [chr(i) for i in range(128)]
+_ASCII_LETTERS_ONLY = str.maketrans({c: " " for c in _ASCII if not c.isalpha()})
+_ASCII_DIGITS_ONLY = str.maketrans({c: " " for c in _ASCII if not c.isdigit()})
+_ASCII_DROP_OTHER = str.maketrans({c: None for c in _ASCII if not (c.isalnum() or c.isspace()) or c == "_"})
+_SPACE_RUN = re.compile(r"\s{2,}")
+# Approximate tokens per CJK character; newer vocabularies merge more CJK pairs
+_CJK_RATIO = {"o200k_base": 0.8, "cl100k_base": 1.2}
+
+
+def _lookup(table: Dict[str, object], model: str):
+    model = model.lower()
+    for prefix in sorted(table, key=len, reverse=True):
+        if model.startswith(prefix):
+            return table[prefix]
+    return None
+
+
+def encoding_for_model(model: str) -> str:
+    return _lookup(MODEL_ENCODINGS, model) or DEFAULT_ENCODING
+
+
+def _estimate_ascii(text: str) -> int:
+    """estimate_tokens for ASCII text without a regex pass per kind of piece"""
+    words = sum(count * ((n + 4) // 5) for n, count in Counter(map(len, text.translate(_ASCII_LETTERS_ONLY).split())).items())
+    digits = sum((len(run) + 2) // 3 for run in text.translate(_ASCII_DIGITS_ONLY).split())
+    other = len(text) - len(text.translate(_ASCII_DROP_OTHER))
+    lines = text.split("\n")
+    last = len(lines) - 1
+    spaces = 0
+    for i, line in enumerate(lines):
+        # A line break ends its whitespace run unless the next line is blank and followed by another break
+        if i < last and not (i + 1 < last and (not lines[i + 1] or lines[i + 1].isspace())):
+            spaces += 1
+        if last and (not line or line.isspace()):
+            continue
+        # Whitespace next to a line break belongs to that break's run
+        core = line.lstrip() if i else line
+        core = core.rstrip() if i < last else core
+        if " ".join(core.split()) != core:
+            spaces += len(_SPACE_RUN.findall(core))
+    return words + digits + other + spaces
+
+
+def estimate_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    Vocabulary-free token estimate used when no BPE vocabulary is available.
+    Splits text the way the BPE pre-tokenizer does and prices each piece, so
+    CJK text is counted per character instead of per whitespace-separated word:
+    0.8-1.2 tokens per CJK character, a token per five letters of a word and
+    per three digits, and one per line break, whitespace run or other
+    character. Each kind of piece is counted by one regex pass, or without
+    regexes for ASCII text.
+    """
+    if text.isascii():
+        return _estimate_ascii(text)
+    cjk = sum(map(len, _ESTIMATE_CJK.findall(text)))
+    digits = 0
+    for run in _ESTIMATE_DIGITS.findall(text):
+        digits += (len(run) + 2) // 3
+        if not run.isascii():
+            # Full-width digits continuing a digit run are priced with the run
+            cjk -= sum(map(len, _ESTIMATE_CJK.findall(run)))
+    # Single spaces merge into the following word, so only longer runs and line breaks count
+    total = (
+        cjk * _CJK_RATIO.get(encoding_name, 1.0) + len(_ESTIMATE_WORD_PIECE.findall(text)) + digits
+        + len(_ESTIMATE_SPACE.findall(text)) + len(_ESTIMATE_OTHER.findall(text))
+    )
+    return int(math.ceil(round(total, 6)))
+
+
+class TokenCounter:
+    """
+    Model-aware token counter.
+
+    Uses tiktoken with a BPE vocabulary loaded from TOKENIZER_VOCAB_DIR
+    (``<encoding>.tiktoken`` files, e.g. ``o200k_base.tiktoken``), from
+    tiktoken's own cache, or downloaded when TOKENIZER_ALLOW_DOWNLOAD is
+    enabled. Without a vocabulary it falls back to estimate_tokens, logs a
+    tokenizer_estimate_fallback warning once per encoding and reports
+    ``estimate`` from backend(); with ``require_vocab``
+    (TOKENIZER_REQUIRE_VOCAB) it raises instead. Counts are memoized by
+    a digest of the text, so the large static system prompts are only
+    tokenized once and the cache never holds the texts themselves.
+    """
+
+    def __init__(
+        self,
+        vocab_dir: Optional[str] = None,
+        allow_download: Optional[bool] = None,
+        cache_size: Optional[int] = None,
+        require_vocab: Optional[bool] = None,
+    ):
+        self.vocab_dir = vocab_dir if vocab_dir is not None else os.getenv("TOKENIZER_VOCAB_DIR", "")
+        if allow_download is None:
+            allow_download = os.getenv("TOKENIZER_ALLOW_DOWNLOAD", "false").lower() == "true"
+        self.allow_download = allow_download
+        if require_vocab is None:
+            require_vocab = os.getenv("TOKENIZER_REQUIRE_VOCAB", "false").lower() == "true"
+        self.require_vocab = require_vocab
+        self._encodings: Dict[str, object] = {}
+        self.cache_size = cache_size or int(os.getenv("TOKENIZER_CACHE_SIZE", "4096"))
+        self._counts: "OrderedDict[Tuple[bytes, str], int]" = OrderedDict()
+        # Counts are taken on the event loop and on compression worker threads
+        self._counts_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _load(self, encoding_name: str):
+        if encoding_name in self._encodings:
+            return self._encodings[encoding_name]
+        encoding = None
+        if tiktoken is not None:
+            path = os.path.join(self.vocab_dir, f"{encoding_name}.tiktoken") if self.vocab_dir else ""
+            spec = ENCODING_SPECS.get(encoding_name)
+            if path and spec and os.path.exists(path):
+                encoding = tiktoken.Encoding(
+                    name=encoding_name,
+                    pat_str=spec["pat_str"],
+                    mergeable_ranks=load_tiktoken_bpe(path),
+                    special_tokens=spec["special_tokens"],
+                )
+            elif self.allow_download or os.getenv("TIKTOKEN_CACHE_DIR"):
+                try:
+                    encoding = tiktoken.get_encoding(encoding_name)
+                except Exception:
+                    encoding = None
+        if encoding is None:
+            if tiktoken is None:
+                reason = "tiktoken is not installed"
+            elif self.vocab_dir:
+                reason = f"{encoding_name}.tiktoken is not in {self.vocab_dir}"
+            else:
+                reason = "TOKENIZER_VOCAB_DIR is not set"
+            if self.require_vocab:
+                raise RuntimeError(f"No BPE vocabulary for {encoding_name}: {reason}")
+            log_event("tokenizer_estimate_fallback", logging.WARNING, encoding=encoding_name, reason=reason)
+        self._encodings[encoding_name] = encoding
+        return encoding
+
+    def backend(self, model: str = "gpt-4.1") -> str:
+        return "tiktoken" if self._load(encoding_for_model(model)) is not None else "estimate"
+
+    def backends(self) -> Dict[str, str]:
+        """``tiktoken`` or ``estimate`` for every known encoding"""
+        return {name: "tiktoken" if self._load(name) is not None else "estimate" for name in ENCODING_SPECS}
+
+    def _count_uncached(self, text: str, encoding_name: str) -> int:
+        encoding = self._load(encoding_name)
+        if encoding is None:
+            return estimate_tokens(text, encoding_name)
+        return len(encoding.encode_ordinary(text))
+
+    def count(self, text: str, model: str = "gpt-4.1") -> int:
+        if not text:
+            return 0
+        return self._count(text, encoding_for_model(model))
+
+    def _count(self, text: str, encoding_name: str) -> int:
+        key = (hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), encoding_name)
+        with self._counts_lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self._hits += 1
+                return count
+            self._misses += 1
+        count = self._count_uncached(text, encoding_name)
+        with self._counts_lock:
+            self._counts[key] = count
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_batch(self, texts: List[str], model: str = "gpt-4.1") -> List[int]:
+        """
+        Count tokens for many texts at once. With a vocabulary loaded this
+        runs tiktoken's multi-threaded batch encoder outside the GIL.
+        """
+        encoding_name = encoding_for_model(model)
+        encoding = self._load(encoding_name)
+        if encoding is None:
+            return [estimate_tokens(text, encoding_name) for text in texts]
+        return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+    def count_messages(self, messages: List[Dict[str, str]], model: str = "gpt-4.1") -> int:
+        """Prompt tokens of a chat request, including the chat format overhead"""
+        return sum(self.count(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages) + REPLY_PRIMING_TOKENS
+
+    def cache_info(self) -> Dict[str, int]:
+        return {"hits": self._hits, "misses": self._misses, "size": len(self._counts), "max_size": self.cache_size}
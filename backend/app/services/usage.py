@@ -0,0 +1,443 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from app.services.errors import QuotaExceeded
+from app.services.logs import log_event
+from app.services.metrics import USAGE_COST, USAGE_QUOTA_EXCEEDED, USAGE_RECORDS_DROPPED
+from app.services.storage import connect, transaction
+from app.services.tenants import tenant_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_events (
+    ts REAL NOT NULL,
+    tenant TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    saved_usd REAL NOT NULL,
+    latency_ms REAL,
+    cached INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_events_ts ON usage_events (ts);
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    bucket INTEGER NOT NULL,
+    tenant TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    cached_requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cost_usd REAL NOT NULL,
+    saved_usd REAL NOT NULL,
+    latency_ms_sum REAL NOT NULL,
+    latency_samples INTEGER NOT NULL,
+    PRIMARY KEY (bucket, tenant, model)
+);
+"""
+
+EVENT_FIELDS = ("ts", "tenant", "model", "prompt_tokens", "completion_tokens", "cost_usd", "saved_usd", "latency_ms", "cached")
+# Rollups are kept per hour; /usage groups them further by day when asked
+ROLLUP_SECONDS = 3600
+GROUP_COLUMNS = {
+    "tenant": "tenant",
+    "model": "model",
+    "hour": "bucket",
+    "day": "bucket - bucket % 86400",
+}
+# Rows collected before a Parquet file is written, so flushes do not leave a trail of tiny files
+PARQUET_ROWS = 10000
+QUOTA_MODES = ("hard", "soft")
+QUOTA_PERIODS = ("day", "month")
+PURGE_INTERVAL = 3600.0
+
+
+def period_bounds(period: str, now: float) -> Tuple[float, float]:
+    """Start and end (UTC) of the quota period containing ``now``"""
+    current = datetime.fromtimestamp(now, timezone.utc)
+    if period == "day":
+        start = current.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + timedelta(days=1)
+    else:
+        start = current.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = (start + timedelta(days=32)).replace(day=1)
+    return start.timestamp(), end.timestamp()
+
+
+class UsageStore:
+    """
+    SQLite usage tables in WAL mode: raw events plus hourly rollups per
+    tenant and model that are updated in the same transaction, so /usage
+    reads a few pre-aggregated rows instead of scanning events. Runs on one
+    dedicated thread like the job store. With ``parquet_dir`` (requires
+    pyarrow) the events are also written as Parquet files.
+    """
+
+    def __init__(self, path: str, parquet_dir: Optional[str] = None):
+        self.path = path
+        self.parquet_dir = parquet_dir if parquet_dir and pa is not None else None
+        if parquet_dir and pa is None:
+            log_event("usage_parquet_unavailable", logging.WARNING, reason="pyarrow is not installed")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="usage-db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._parquet_rows: List[tuple] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.path, SCHEMA)
+        return self._conn
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._connect()))
+
+    def _write_parquet(self, force: bool = False):
+        if not self._parquet_rows or (len(self._parquet_rows) < PARQUET_ROWS and not force):
+            return
+        os.makedirs(self.parquet_dir, exist_ok=True)
+        columns = list(zip(*self._parquet_rows))
+        table = pa.table({field: list(values) for field, values in zip(EVENT_FIELDS, columns)})
+        pq.write_table(table, os.path.join(self.parquet_dir, f"usage-{int(time.time() * 1000)}.parquet"))
+        self._parquet_rows = []
+
+    async def write(self, records: List[tuple]):
+        """Insert events and fold them into the hourly rollups in one transaction"""
+        rollups: Dict[Tuple[int, str, str], List[float]] = {}
+        for ts, tenant, model, prompt_tokens, completion_tokens, cost, saved, latency, cached in records:
+            bucket = int(ts // ROLLUP_SECONDS * ROLLUP_SECONDS)
+            row = rollups.setdefault((bucket, tenant, model), [0, 0, 0, 0, 0.0, 0.0, 0.0, 0])
+            row[0] += 1
+            row[1] += cached
+            row[2] += prompt_tokens
+            row[3] += completion_tokens
+            row[4] += cost
+            row[5] += saved
+            if latency is not None:
+                row[6] += latency
+                row[7] += 1
+
+        def write(conn: sqlite3.Connection):
+            with transaction(conn):
+                conn.executemany(f"INSERT INTO usage_events VALUES ({', '.join('?' * len(EVENT_FIELDS))})", records)
+                conn.executemany(
+                    "INSERT INTO usage_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (bucket, tenant, model) DO UPDATE SET "
+                    "requests = requests + excluded.requests, cached_requests = cached_requests + excluded.cached_requests, "
+                    "prompt_tokens = prompt_tokens + excluded.prompt_tokens, completion_tokens = completion_tokens + excluded.completion_tokens, "
+                    "cost_usd = cost_usd + excluded.cost_usd, saved_usd = saved_usd + excluded.saved_usd, "
+                    "latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum, latency_samples = latency_samples + excluded.latency_samples",
+                    [key + tuple(row) for key, row in rollups.items()],
+                )
+            if self.parquet_dir:
+                self._parquet_rows.extend(records)
+                self._write_parquet()
+        await self._run(write)
+
+    async def totals_since(self, since: float) -> Dict[str, Tuple[float, int]]:
+        """USD and tokens per tenant from the rollups starting at ``since`` (hour-aligned)"""
+        rows = await self._run(lambda conn: conn.execute(
+            "SELECT tenant, SUM(cost_usd) AS usd, SUM(prompt_tokens + completion_tokens) AS tokens "
+            "FROM usage_rollups WHERE bucket >= ? GROUP BY tenant", (int(since),)
+        ).fetchall())
+        return {row["tenant"]: (row["usd"] or 0.0, row["tokens"] or 0) for row in rows}
+
+    async def query(self, group_by: List[str], since: Optional[float], until: Optional[float], tenant: Optional[str], model: Optional[str]) -> List[Dict[str, Any]]:
+        columns = [f"{GROUP_COLUMNS[name]} AS {name}" for name in group_by]
+        where, params = [], []
+        for clause, value in (("bucket >= ?", since and int(since // ROLLUP_SECONDS * ROLLUP_SECONDS)), ("bucket < ?", until), ("tenant = ?", tenant), ("model = ?", model)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = (
+            f"SELECT {', '.join(columns + [''])}SUM(requests) AS requests, SUM(cached_requests) AS cached_requests, "
+            "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens, "
+            "SUM(cost_usd) AS cost_usd, SUM(saved_usd) AS saved_usd, "
+            "SUM(latency_ms_sum) / NULLIF(SUM(latency_samples), 0) AS avg_latency_ms FROM usage_rollups"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + (f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else "")
+        )
+        rows = await self._run(lambda conn: conn.execute(sql, params).fetchall())
+        return [dict(row) for row in rows if row["requests"]]
+
+    async def purge(self, older_than: float) -> int:
+        """Delete raw events past retention; rollups are kept"""
+        def purge(conn: sqlite3.Connection) -> int:
+            with transaction(conn):
+                return conn.execute("DELETE FROM usage_events WHERE ts < ?", (time.time() - older_than,)).rowcount
+        return await self._run(purge)
+
+    async def close(self):
+        def close(_conn: sqlite3.Connection):
+            if self.parquet_dir:
+                self._write_parquet(force=True)
+            self._conn.close()
+            self._conn = None
+        if self._conn is not None:
+            await self._run(close)
+        self._executor.shutdown(wait=False)
+
+
+class UsageLedger:
+    """
+    Per-tenant record of upstream usage: tokens, cost, latency and the cost
+    cache hits avoided, per model. Tenants are identified by a hash of the
+    API key.
+
+    record() only appends to an in-memory buffer and updates the quota
+    counters, so the request path never waits on disk; a background task
+    flushes the buffer to the store every ``flush_interval`` seconds or as
+    soon as ``flush_batch`` records are waiting. While the store is failing
+    the buffer is kept up to ``max_buffer`` records, dropping the oldest.
+
+    Quotas limit USD and/or tokens per tenant and calendar period (UTC day
+    or month). check() compares the in-memory counters plus the call's
+    estimate against them before the upstream call: a hard quota raises
+    QuotaExceeded (429), a soft quota lets the call through and flags it.
+    Counters are reloaded from the rollups on start, so they survive a
+    restart, and dropped when the period rolls over.
+    """
+
+    def __init__(
+        self,
+        store: Optional[UsageStore] = None,
+        quota_usd: float = 0.0,
+        quota_tokens: int = 0,
+        quota_mode: str = "hard",
+        quota_period: str = "month",
+        quota_overrides: Optional[Dict[str, dict]] = None,
+        flush_interval: float = 2.0,
+        flush_batch: int = 500,
+        max_buffer: int = 100000,
+        retention: float = 30 * 86400.0,
+    ):
+        if quota_mode not in QUOTA_MODES:
+            raise ValueError(f"Unknown quota mode: {quota_mode}")
+        if quota_period not in QUOTA_PERIODS:
+            raise ValueError(f"Unknown quota period: {quota_period}")
+        self.store = store
+        self.default_quota = {"usd": quota_usd, "tokens": quota_tokens, "mode": quota_mode}
+        self.quota_overrides = quota_overrides or {}
+        self.quota_period = quota_period
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_buffer = max_buffer
+        self.retention = retention
+        self._buffer: List[tuple] = []
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._period = period_bounds(quota_period, time.time())
+        # tenant -> [usd, tokens] in the current period
+        self._spent: Dict[str, List[float]] = {}
+        self._soft_warned: set = set()
+        self.counts = {"recorded": 0, "flushed": 0, "dropped": 0, "flush_failures": 0, "hard_rejections": 0, "soft_exceeded": 0}
+
+    @classmethod
+    def from_env(cls) -> "UsageLedger":
+        path = os.getenv("USAGE_DB_PATH", "data/usage.db")
+        overrides = {}
+        overrides_path = os.getenv("USAGE_QUOTAS_PATH")
+        if overrides_path:
+            try:
+                with open(overrides_path, "r", encoding="utf-8") as f:
+                    overrides = json.load(f)
+            except (OSError, ValueError) as e:
+                log_event("usage_quotas_invalid", logging.WARNING, path=overrides_path, error=str(e))
+        return cls(
+            store=UsageStore(path, os.getenv("USAGE_PARQUET_DIR") or None) if path else None,
+            quota_usd=float(os.getenv("USAGE_QUOTA_USD", "0")),
+            quota_tokens=int(os.getenv("USAGE_QUOTA_TOKENS", "0")),
+            quota_mode=os.getenv("USAGE_QUOTA_MODE", "hard"),
+            quota_period=os.getenv("USAGE_QUOTA_PERIOD", "month"),
+            quota_overrides=overrides,
+            flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "2")),
+            flush_batch=int(os.getenv("USAGE_FLUSH_BATCH", "500")),
+            max_buffer=int(os.getenv("USAGE_MAX_BUFFER", "100000")),
+            retention=float(os.getenv("USAGE_RETENTION", str(30 * 86400))),
+        )
+
+    def _roll_period(self, now: float):
+        """Start a new quota period once ``now`` is past the current one, dropping the old counters"""
+        if now >= self._period[1]:
+            self._period = period_bounds(self.quota_period, now)
+            self._spent.clear()
+            self._soft_warned.clear()
+
+    def quota(self, tenant: str) -> dict:
+        return {**self.default_quota, **self.quota_overrides.get(tenant, {})}
+
+    def record(
+        self,
+        api_key: Optional[str],
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cost_usd: float,
+        latency_ms: Optional[float] = None,
+        cached: bool = False,
+        saved_usd: float = 0.0,
+        model_label: Optional[str] = None,
+    ):
+        """
+        Account one upstream call. A cache hit is recorded with ``cached``,
+        no tokens or cost and the cost it avoided as ``saved_usd``.
+        ``model_label`` replaces the model in the cost metric's labels.
+        """
+        now = time.time()
+        tenant = tenant_id(api_key)
+        self._roll_period(now)
+        # Cache hits cost nothing, so they do not add a counter for the tenant
+        if cost_usd or prompt_tokens or completion_tokens:
+            spent = self._spent.setdefault(tenant, [0.0, 0])
+            spent[0] += cost_usd
+            spent[1] += prompt_tokens + completion_tokens
+        USAGE_COST.inc(cost_usd, model=model_label or model, type="spent")
+        USAGE_COST.inc(saved_usd, model=model_label or model, type="saved")
+        self._buffer.append((now, tenant, model, prompt_tokens, completion_tokens, cost_usd, saved_usd, latency_ms, int(cached)))
+        self.counts["recorded"] += 1
+        if len(self._buffer) > self.max_buffer:
+            dropped = len(self._buffer) - self.max_buffer
+            del self._buffer[:dropped]
+            self.counts["dropped"] += dropped
+            USAGE_RECORDS_DROPPED.inc(dropped)
+        if len(self._buffer) >= self.flush_batch:
+            self._wakeup.set()
+
+    def check(self, api_key: Optional[str], estimated_usd: float, estimated_tokens: int):
+        """Enforce the tenant's quota for a call expected to cost about this much"""
+        now = time.time()
+        tenant = tenant_id(api_key)
+        quota = self.quota(tenant)
+        if not quota["usd"] and not quota["tokens"]:
+            return
+        self._roll_period(now)
+        usd, tokens = self._spent.get(tenant, (0.0, 0))
+        over = []
+        if quota["usd"] and usd + estimated_usd > quota["usd"]:
+            over.append(f"${usd:.4f} of ${quota['usd']:g} spent")
+        if quota["tokens"] and tokens + estimated_tokens > quota["tokens"]:
+            over.append(f"{tokens} of {quota['tokens']} tokens used")
+        if not over:
+            return
+        if quota["mode"] == "hard":
+            self.counts["hard_rejections"] += 1
+            USAGE_QUOTA_EXCEEDED.inc(mode="hard")
+            raise QuotaExceeded(f"Usage quota exceeded for this {self.quota_period}: {'; '.join(over)}", self._period[1] - now)
+        self.counts["soft_exceeded"] += 1
+        USAGE_QUOTA_EXCEEDED.inc(mode="soft")
+        if tenant not in self._soft_warned:
+            self._soft_warned.add(tenant)
+            log_event("usage_soft_quota_exceeded", logging.WARNING, tenant=tenant, period=self.quota_period, detail="; ".join(over))
+
+    async def flush(self):
+        if self.store is None:
+            self._buffer = []
+            return
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            records, self._buffer = self._buffer, []
+            try:
+                await self.store.write(records)
+            except Exception as e:
+                # Keep the records for the next flush, ahead of anything recorded meanwhile
+                self._buffer = (records + self._buffer)[-self.max_buffer:]
+                self.counts["flush_failures"] += 1
+                log_event("usage_flush_failed", logging.WARNING, records=len(records), error=str(e))
+                return
+            self.counts["flushed"] += len(records)
+
+    async def _flush_loop(self):
+        purged_at = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            # Idle tenants' counters from an earlier period go even when no call comes in
+            self._roll_period(time.time())
+            await self.flush()
+            if time.monotonic() - purged_at > PURGE_INTERVAL:
+                purged_at = time.monotonic()
+                try:
+                    await self.store.purge(self.retention)
+                except Exception as e:
+                    log_event("usage_purge_failed", logging.WARNING, error=str(e))
+
+    async def start(self):
+        """Reload this period's counters from the rollups and start flushing"""
+        if self.store is None:
+            return
+        self._roll_period(time.time())
+        totals = await self.store.totals_since(self._period[0])
+        for tenant, (usd, tokens) in totals.items():
+            if not usd and not tokens:
+                continue
+            spent = self._spent.setdefault(tenant, [0.0, 0])
+            spent[0] += usd
+            spent[1] += tokens
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+        if self.store is not None:
+            await self.store.close()
+
+    async def query(
+        self,
+        group_by: List[str],
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        tenant: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Usage from the rollups, including records still waiting in the buffer"""
+        if self.store is None:
+            return []
+        await self.flush()
+        return await self.store.query(group_by, since, until, tenant, model)
+
+    def quotas(self) -> Dict[str, object]:
+        """Current-period usage of every tenant seen, against its quota"""
+        self._roll_period(time.time())
+        tenants = []
+        for tenant, (usd, tokens) in sorted(self._spent.items()):
+            quota = self.quota(tenant)
+            tenants.append({
+                "tenant": tenant,
+                "cost_usd": round(usd, 8),
+                "tokens": tokens,
+                "quota_usd": quota["usd"] or None,
+                "quota_tokens": quota["tokens"] or None,
+                "mode": quota["mode"],
+                "exceeded": bool((quota["usd"] and usd >= quota["usd"]) or (quota["tokens"] and tokens >= quota["tokens"])),
+            })
+        return {
+            "period": self.quota_period,
+            "period_start": self._period[0],
+            "period_end": self._period[1],
+            "default": self.default_quota,
+            "tenants": tenants,
+        }
+
+    def stats(self) -> Dict[str, object]:
+        return {**self.counts, "buffered": len(self._buffer), "persistent": self.store is not None,
+                "parquet": bool(self.store and self.store.parquet_dir)}
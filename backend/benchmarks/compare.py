@@ -0,0 +1,79 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.1
+
+Exits with status 1 when throughput drops or p95/p99 latency grows by more
+than the threshold for any scenario present in both files.
+"""
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+# (label, getter, higher_is_better)
+METRICS = [
+    ("rps", lambda r: r["throughput_rps"], True),
+    ("p50 ms", lambda r: r["latency_ms"]["p50"], False),
+    ("p95 ms", lambda r: r["latency_ms"]["p95"], False),
+    ("p99 ms", lambda r: r["latency_ms"]["p99"], False),
+    ("lag p99 ms", lambda r: r.get("loop_lag_ms", {}).get("p99"), False),
+    ("peak RSS MB", lambda r: r["peak_rss_bytes"] / 1048576 if "peak_rss_bytes" in r else None, False),
+]
+# Only these gate the exit status; lag and RSS are too noisy on shared machines
+GATED = {"rps", "p95 ms", "p99 ms"}
+
+
+def load_runs(path: str) -> Dict[Tuple[str, int], dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {(run["scenario"], run["concurrency"]): run for run in data["runs"]}
+
+
+def change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before
+
+
+def compare(baseline: Dict, candidate: Dict, threshold: float) -> Tuple[List[str], List[str]]:
+    lines = []
+    regressions = []
+    for key in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[key], candidate[key]
+        cells = []
+        for label, getter, higher_is_better in METRICS:
+            delta = change(getter(before), getter(after))
+            if delta is None:
+                continue
+            worse = -delta if higher_is_better else delta
+            marker = ""
+            if worse > threshold:
+                marker = " !"
+                if label in GATED:
+                    regressions.append(f"{key[0]} c={key[1]} {label} {delta:+.1%}")
+            cells.append(f"{label} {getter(before):.1f}->{getter(after):.1f} ({delta:+.1%}){marker}")
+        lines.append(f"{key[0]:>18} c={key[1]:<4} " + "  ".join(cells))
+    return lines, regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change treated as a regression")
+    args = parser.parse_args(argv)
+
+    lines, regressions = compare(load_runs(args.baseline), load_runs(args.candidate), args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+"""
+Local OpenAI-compatible server for benchmarks and offline development.
+
+Answers ``/v1/chat/completions`` (plain, ``n`` > 1 and streamed),
+``/v1/models`` and the batch API (``/v1/files`` and ``/v1/batches``) with
+schema-shaped JSON content, so the backend's parsing path runs exactly as
+it does against the real API. Behaviour is configured
+through environment variables:
+
+    FAKE_LATENCY          latency distribution of a completion, one of
+                          ``fixed:<s>``, ``uniform:<lo>,<hi>``,
+                          ``exp:<mean>`` or ``lognormal:<median>,<sigma>``
+                          (default ``fixed:0.5``)
+    FAKE_ERROR_RATE       fraction of requests answered with an error (0)
+    FAKE_ERROR_STATUS     status code of those errors (503)
+    FAKE_INVALID_JSON_RATE fraction of completions that are not valid JSON (0)
+    FAKE_CHUNK_SIZE       characters per streamed chunk (16)
+    FAKE_CHUNK_DELAY      seconds between streamed chunks (0.005)
+    FAKE_BATCH_LATENCY    seconds a submitted batch takes to complete (1.0);
+                          FAKE_ERROR_RATE applies to each of its requests
+
+Run with ``uvicorn benchmarks.fake_openai:app --port 9901`` from ``backend/``
+and point OPENAI_BASE_URL at ``http://127.0.0.1:9901/v1``.
+"""
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import itertools
+from typing import Callable, Dict, Optional
+
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Build a sampler from a latency distribution spec such as ``uniform:0.2,1.5``"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1.0 / values[0])
+    if kind == "lognormal":
+        # Parameterised by median, which is easier to reason about than mu
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class FakeSettings:
+    def __init__(self):
+        self.latency = parse_latency(os.getenv("FAKE_LATENCY", "fixed:0.5"))
+        self.error_rate = float(os.getenv("FAKE_ERROR_RATE", "0"))
+        self.error_status = int(os.getenv("FAKE_ERROR_STATUS", "503"))
+        self.invalid_json_rate = float(os.getenv("FAKE_INVALID_JSON_RATE", "0"))
+        self.chunk_size = int(os.getenv("FAKE_CHUNK_SIZE", "16"))
+        self.chunk_delay = float(os.getenv("FAKE_CHUNK_DELAY", "0.005"))
+        self.batch_latency = float(os.getenv("FAKE_BATCH_LATENCY", "1.0"))
+
+
+settings = FakeSettings()
+stats = {"requests": 0, "errors": 0, "streams_completed": 0, "streams_aborted": 0, "batches": 0}
+files: Dict[str, dict] = {}
+batches: Dict[str, dict] = {}
+
+app = FastAPI(title="Fake OpenAI")
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _content(body: dict, index: int) -> str:
+    if random.random() < settings.invalid_json_rate:
+        return "Here is an improved prompt without the requested JSON wrapper."
+    user = body["messages"][-1]["content"]
+    if not body.get("response_format"):
+        # Plain-text executions, e.g. from /evaluate
+        return f"Answer {index} to: {user[:120]}"
+    schema = json.dumps(body["response_format"])
+    if "JudgeSchema" in schema:
+        score_a, score_b = round(random.random(), 2), round(random.random(), 2)
+        winner = "tie" if abs(score_a - score_b) < 0.05 else ("A" if score_a > score_b else "B")
+        return json.dumps({"winner": winner, "score_a": score_a, "score_b": score_b, "rationale": "Simulated verdict."})
+    if "PromptGenerationSchema" in schema:
+        return json.dumps({
+            "generated_prompt": f"## Context: variant {index}\n## Objectives: {user[:80]}\n## Action: ...",
+            "prompt_structure": {
+                "context": "background", "objectives": "goals", "action": "steps",
+                "support": "guidance", "technology": "terminology"
+            },
+            "usage_tips": ["Provide concrete inputs", "Iterate on the output format"],
+            "alternatives": ["A shorter variant", "A more detailed variant"],
+            "confidence_score": "0.86",
+        }, ensure_ascii=False)
+    return json.dumps({
+        "optimized_prompt": f"## Context: variant {index}\n## Objectives: {user[-120:]}\n## Action: ...",
+        "suggestions": ["Add an example", "State the audience", "Specify the output length"],
+        "reasoning": "Structured the prompt with COAST sections.",
+        "confidence_score": "0.82",
+    }, ensure_ascii=False)
+
+
+def _error(status: int) -> JSONResponse:
+    stats["errors"] += 1
+    return JSONResponse(
+        {"error": {"message": "Simulated upstream failure", "type": "server_error", "code": None}},
+        status_code=status,
+        headers={"retry-after": "0"},
+    )
+
+
+def _chunk(body: dict, delta: dict, finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> str:
+    payload = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if random.random() < settings.error_rate:
+        await asyncio.sleep(settings.latency() / 10)
+        return _error(settings.error_status)
+
+    prompt_tokens = sum(_approx_tokens(m["content"]) for m in body["messages"])
+
+    if body.get("stream"):
+        content = _content(body, 0)
+
+        async def events():
+            try:
+                # Time to first token is the sampled latency; the rest is chunk pacing
+                await asyncio.sleep(settings.latency())
+                for i in range(0, len(content), settings.chunk_size):
+                    yield _chunk(body, {"content": content[i:i + settings.chunk_size]})
+                    await asyncio.sleep(settings.chunk_delay)
+                yield _chunk(body, {}, finish_reason="stop")
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    completion_tokens = _approx_tokens(content)
+                    yield _chunk(body, {}, usage={
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    })
+                yield "data: [DONE]\n\n"
+                stats["streams_completed"] += 1
+            except asyncio.CancelledError:
+                stats["streams_aborted"] += 1
+                raise
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(settings.latency())
+    return _completion(body)
+
+
+def _completion(body: dict) -> dict:
+    prompt_tokens = sum(_approx_tokens(m["content"]) for m in body["messages"])
+    contents = [_content(body, i) for i in range(body.get("n") or 1)]
+    completion_tokens = sum(_approx_tokens(c) for c in contents)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [
+            {"index": i, "message": {"role": "assistant", "content": c}, "finish_reason": "stop"}
+            for i, c in enumerate(contents)
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+_ids = itertools.count(1)
+
+
+def _store_file(filename: str, purpose: str, content: bytes) -> dict:
+    file = {
+        "id": f"file-fake{next(_ids)}", "object": "file", "bytes": len(content),
+        "created_at": int(time.time()), "filename": filename, "purpose": purpose,
+    }
+    files[file["id"]] = {**file, "content": content}
+    return file
+
+
+async def _run_batch(batch: dict):
+    batch["status"] = "in_progress"
+    batch["in_progress_at"] = int(time.time())
+    lines = [json.loads(line) for line in files[batch["input_file_id"]]["content"].decode("utf-8").splitlines() if line.strip()]
+    batch["request_counts"]["total"] = len(lines)
+    await asyncio.sleep(settings.batch_latency)
+    if batch["status"] == "cancelling":
+        batch["status"] = "cancelled"
+        return
+    outputs, errors = [], []
+    for line in lines:
+        stats["requests"] += 1
+        record = {"id": f"batch_req_{next(_ids)}", "custom_id": line["custom_id"], "error": None}
+        if random.random() < settings.error_rate:
+            stats["errors"] += 1
+            error = {"message": "Simulated upstream failure", "type": "server_error", "code": None}
+            errors.append({**record, "response": {"status_code": settings.error_status, "request_id": record["id"], "body": {"error": error}}})
+            batch["request_counts"]["failed"] += 1
+        else:
+            outputs.append({**record, "response": {"status_code": 200, "request_id": record["id"], "body": _completion(line["body"])}})
+            batch["request_counts"]["completed"] += 1
+    for records, field in ((outputs, "output_file_id"), (errors, "error_file_id")):
+        if records:
+            content = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+            batch[field] = _store_file(f"{batch['id']}_{field}.jsonl", "batch_output", content)["id"]
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+@app.post("/v1/files")
+async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    return _store_file(file.filename, purpose, await file.read())
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        return JSONResponse({"error": {"message": f"No such file: {file_id}"}}, status_code=404)
+    return Response(files[file_id]["content"], media_type="application/jsonl")
+
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    if body.get("input_file_id") not in files:
+        return JSONResponse({"error": {"message": "Unknown input_file_id"}}, status_code=400)
+    stats["batches"] += 1
+    batch = {
+        "id": f"batch_fake{next(_ids)}", "object": "batch", "endpoint": body["endpoint"],
+        "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+        "status": "validating", "output_file_id": None, "error_file_id": None, "errors": None,
+        "created_at": int(time.time()), "metadata": body.get("metadata"),
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+    }
+    batches[batch["id"]] = batch
+    asyncio.ensure_future(_run_batch(batch))
+    return batch
+
+
+@app.get("/v1/batches")
+async def list_batches(limit: int = 20):
+    data = sorted(batches.values(), key=lambda b: b["created_at"], reverse=True)[:limit]
+    return {"object": "list", "data": data, "has_more": len(batches) > limit}
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    if batch_id not in batches:
+        return JSONResponse({"error": {"message": f"No such batch: {batch_id}"}}, status_code=404)
+    return batches[batch_id]
+
+
+@app.post("/v1/batches/{batch_id}/cancel")
+async def cancel_batch(batch_id: str):
+    batch = batches[batch_id]
+    if batch["status"] in ("validating", "in_progress"):
+        batch["status"] = "cancelling"
+    return batch
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {
+        "object": "list",
+        "data": [
+            {"id": model, "object": "model", "created": 0, "owned_by": "fake"}
+            for model in ("gpt-4.1", "gpt-4.1-mini", "gpt-4o", "gpt-4o-mini")
+        ],
+    }
+
+
+@app.get("/fake/stats")
+async def fake_stats():
+    return stats
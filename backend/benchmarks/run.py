@@ -0,0 +1,302 @@
+"""
+Load-test the backend against the fake OpenAI server.
+
+Starts ``benchmarks.fake_openai`` and ``benchmarks.serve`` as subprocesses,
+drives each scenario at each concurrency level and writes throughput,
+latency percentiles, event-loop lag and RSS to a JSON file that
+``benchmarks.compare`` can diff against another run. Run from ``backend/``:
+
+    python -m benchmarks.run --concurrency 1,16,64 --requests 300 \\
+        --latency lognormal:0.4,0.5 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import itertools
+import subprocess
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import httpx
+
+# Choices per optimize_candidates request, and requests per optimize_best_of_n iteration
+CANDIDATES = 4
+GOALS = ["general", "clarity", "conciseness", "creativity", "specificity"]
+TASK_TYPES = ["general", "creative", "technical", "analytical", "educational"]
+
+
+def _prompt(i: int) -> str:
+    return f"Write a product description for item #{i} aimed at first-time buyers, mention price and warranty."
+
+
+def _optimize(i: int) -> Tuple[str, str, dict]:
+    return "POST", "/api/v1/optimize", {"json": {"prompt": _prompt(i), "optimization_goal": GOALS[i % len(GOALS)]}}
+
+
+def _optimize_candidates(i: int) -> Tuple[str, str, dict]:
+    return "POST", "/api/v1/optimize", {"json": {"prompt": _prompt(i), "candidates": CANDIDATES}}
+
+
+def _optimize_best_of_n(i: int) -> List[Tuple[str, str, dict]]:
+    # What clients did before candidates existed: the same request several times in a row
+    return [("POST", "/api/v1/optimize", {"json": {"prompt": _prompt(i), "cache": "bypass"}})] * CANDIDATES
+
+
+def _optimize_stream(i: int) -> Tuple[str, str, dict]:
+    return "POST", "/api/v1/optimize/stream", {"json": {"prompt": _prompt(i)}}
+
+
+def _optimize_advanced(i: int) -> Tuple[str, str, dict]:
+    return "POST", "/api/v1/optimize/advanced", {"json": {"prompt": _prompt(i), "target_model": "gpt-4.1"}}
+
+
+def _generate(i: int) -> Tuple[str, str, dict]:
+    return "POST", "/api/v1/generate", {"json": {
+        "requirements": f"A prompt that summarises support ticket #{i} for an on-call engineer",
+        "task_type": TASK_TYPES[i % len(TASK_TYPES)],
+    }}
+
+
+def _validate(i: int) -> Tuple[str, str, dict]:
+    return "POST", "/api/v1/validate", {"params": {"prompt": _prompt(i)}}
+
+
+# Scenario name -> request builder; a list of requests is sent sequentially and timed as one
+SCENARIOS: Dict[str, Callable[[int], Union[Tuple[str, str, dict], List[Tuple[str, str, dict]]]]] = {
+    "optimize": _optimize,
+    "optimize_candidates": _optimize_candidates,
+    "optimize_best_of_n": _optimize_best_of_n,
+    "optimize_stream": _optimize_stream,
+    "optimize_advanced": _optimize_advanced,
+    "generate": _generate,
+    "validate": _validate,
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def pct(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000, 3)
+
+    return {
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def _send(client: httpx.AsyncClient, scenario: str, index: int) -> Tuple[bool, int, Optional[float]]:
+    """Send one request, returning success, status and time to first streamed event"""
+    built = SCENARIOS[scenario](index)
+    if isinstance(built, list):
+        for method, path, kwargs in built:
+            response = await client.request(method, path, **kwargs)
+            if response.status_code != 200:
+                return False, response.status_code, None
+        return True, response.status_code, None
+    method, path, kwargs = built
+    if scenario.endswith("_stream"):
+        started = time.perf_counter()
+        first_event = None
+        ok = False
+        async with client.stream(method, path, **kwargs) as response:
+            async for line in response.aiter_lines():
+                if line.startswith("event:") and first_event is None:
+                    first_event = time.perf_counter() - started
+                if line == "event: result":
+                    ok = True
+                elif line == "event: error":
+                    ok = False
+        return ok and response.status_code == 200, response.status_code, first_event
+    response = await client.request(method, path, **kwargs)
+    ok = response.status_code == 200
+    if ok and scenario == "optimize_advanced":
+        # This route reports failures in the body with a 200
+        ok = response.json().get("success", False)
+    return ok, response.status_code, None
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: str, concurrency: int, requests: int, offset: int) -> dict:
+    latencies: List[float] = []
+    first_events: List[float] = []
+    statuses: Dict[str, int] = {}
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            started = time.perf_counter()
+            try:
+                ok, status, first_event = await _send(client, scenario, offset + i)
+            except httpx.HTTPError as e:
+                ok, status, first_event = False, type(e).__name__, None
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if first_event is not None:
+                first_events.append(first_event)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "status_counts": statuses,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": percentiles(latencies),
+    }
+    if first_events:
+        result["first_event_ms"] = percentiles(first_events)
+    return result
+
+
+async def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def _start(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable] + args, env={**os.environ, **env}, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    processes = []
+    target = args.target
+    try:
+        if not target:
+            fake_env = {
+                "FAKE_LATENCY": args.latency,
+                "FAKE_ERROR_RATE": str(args.error_rate),
+                "FAKE_INVALID_JSON_RATE": str(args.invalid_json_rate),
+                "FAKE_CHUNK_SIZE": str(args.chunk_size),
+                "FAKE_CHUNK_DELAY": str(args.chunk_delay),
+            }
+            processes.append(_start(
+                ["-m", "uvicorn", "benchmarks.fake_openai:app", "--port", str(args.fake_port), "--log-level", "warning"],
+                fake_env,
+            ))
+            app_env = {
+                "OPENAI_API_KEY": "sk-benchmark",
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{args.fake_port}/v1",
+                "LOG_LEVEL": "WARNING",
+            }
+            app_env.update(dict(item.split("=", 1) for item in args.app_env))
+            processes.append(_start(["-m", "benchmarks.serve", "--port", str(args.app_port)], app_env))
+            target = f"http://127.0.0.1:{args.app_port}"
+            await _wait_ready(f"http://127.0.0.1:{args.fake_port}/v1/models")
+        await _wait_ready(f"{target}/api/v1/health")
+
+        limits = httpx.Limits(max_connections=max(args.concurrency) * 2, max_keepalive_connections=max(args.concurrency))
+        runs = []
+        offset = 0
+        async with httpx.AsyncClient(base_url=target, timeout=args.timeout, limits=limits) as client:
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    if args.warmup:
+                        await run_scenario(client, scenario, min(concurrency, args.warmup), args.warmup, offset)
+                        offset += args.warmup
+                    has_probe = (await client.post("/_bench/reset")).status_code == 200
+                    result = await run_scenario(client, scenario, concurrency, args.requests, offset)
+                    # Unique prompts per run so the response cache does not skew results
+                    offset += args.requests
+                    if has_probe:
+                        result.update((await client.get("/_bench/stats")).json())
+                    runs.append(result)
+                    print(
+                        f"{scenario:>18} c={concurrency:<4} {result['throughput_rps']:>9.1f} req/s  "
+                        f"p50={result['latency_ms']['p50']:.1f}ms p95={result['latency_ms']['p95']:.1f}ms "
+                        f"p99={result['latency_ms']['p99']:.1f}ms errors={result['errors']}",
+                        file=sys.stderr,
+                    )
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.target or "local",
+            "latency": args.latency,
+            "error_rate": args.error_rate,
+            "invalid_json_rate": args.invalid_json_rate,
+            "chunk_size": args.chunk_size,
+            "chunk_delay": args.chunk_delay,
+            "app_env": args.app_env,
+        },
+        "runs": runs,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the Prompt Optimizer backend")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=list(SCENARIOS),
+                        help=f"Comma-separated scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 16, 64],
+                        help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="Warm-up requests before each measured run")
+    parser.add_argument("--latency", default="lognormal:0.3,0.4", help="Fake upstream latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake upstream errors")
+    parser.add_argument("--invalid-json-rate", type=float, default=0.0, help="Fraction of non-JSON completions")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Characters per streamed chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.005, help="Seconds between streamed chunks")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the backend, e.g. MAX_CONCURRENT_REQUESTS=64")
+    parser.add_argument("--target", help="Benchmark an already running backend instead of starting one")
+    parser.add_argument("--app-port", type=int, default=18192)
+    parser.add_argument("--fake-port", type=int, default=18901)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
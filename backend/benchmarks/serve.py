@@ -0,0 +1,106 @@
+"""
+Serve ``app.main:app`` with an event-loop lag probe for benchmark runs.
+
+Adds ``GET /_bench/stats`` (loop lag percentiles and RSS) and
+``POST /_bench/reset`` so the runner can attribute lag to each scenario.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+from collections import deque
+from contextlib import asynccontextmanager
+
+import uvicorn
+
+from app.main import app
+
+
+def rss_bytes() -> int:
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopLagProbe:
+    """Measures how late a periodic timer fires, i.e. how long the loop was blocked"""
+
+    def __init__(self, interval: float = 0.01, window: int = 100000):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.peak_rss = 0
+
+    def reset(self):
+        self.samples.clear()
+        self.peak_rss = rss_bytes()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+            if len(self.samples) % 50 == 0:
+                self.peak_rss = max(self.peak_rss, rss_bytes())
+
+    def stats(self) -> dict:
+        ordered = sorted(self.samples)
+
+        def pct(q: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] * 1000, 3)
+
+        rss = rss_bytes()
+        self.peak_rss = max(self.peak_rss, rss)
+        return {
+            "loop_lag_ms": {"p50": pct(50), "p99": pct(99), "max": pct(100), "samples": len(ordered)},
+            "rss_bytes": rss,
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+
+probe = LoopLagProbe()
+_app_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan(application):
+    task = asyncio.create_task(probe.run())
+    try:
+        async with _app_lifespan(application):
+            yield
+    finally:
+        task.cancel()
+
+
+app.router.lifespan_context = lifespan
+
+
+@app.get("/_bench/stats", include_in_schema=False)
+async def bench_stats():
+    return probe.stats()
+
+
+@app.post("/_bench/reset", include_in_schema=False)
+async def bench_reset():
+    probe.reset()
+    return {"reset_at": time.time()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8192)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Shared fixtures: the benchmark fake upstream served on a local port, and
+OpenAIService instances configured against it.
+
+Run from ``backend/`` with ``python -m pytest``.
+"""
+import socket
+import asyncio
+import threading
+import time
+
+import pytest
+import uvicorn
+
+from benchmarks import fake_openai
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def fake_server():
+    """benchmarks/fake_openai.py on a free port; yields its base URL"""
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_openai.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("The fake upstream did not start")
+        time.sleep(0.02)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def fake(fake_server):
+    """The fake upstream's base URL, with fast answers and no injected errors"""
+    settings = fake_openai.settings
+    saved = dict(vars(settings))
+    settings.latency = fake_openai.parse_latency("fixed:0.01")
+    settings.error_rate = 0.0
+    settings.error_status = 503
+    settings.invalid_json_rate = 0.0
+    settings.batch_latency = 0.05
+    yield fake_server
+    vars(settings).update(saved)
+
+
+@pytest.fixture
+def dead_url():
+    """Base URL of a port nothing listens on; connections are refused"""
+    return f"http://127.0.0.1:{_free_port()}/v1"
+
+
+@pytest.fixture
+def service_env(fake, monkeypatch, tmp_path):
+    """
+    Environment of an OpenAIService that talks to the fake upstream, keeps
+    its SQLite files in ``tmp_path`` and retries without sleeping
+    """
+    for name, value in {
+        "OPENAI_API_KEY": "sk-test",
+        "OPENAI_BASE_URL": fake,
+        "OPENAI_FAILOVER_BASE_URLS": "",
+        "USAGE_DB_PATH": str(tmp_path / "usage.db"),
+        "CACHE_ENABLED": "true",
+        "SIMILARITY_ENABLED": "false",
+        "UPSTREAM_RETRY_BASE_DELAY": "0",
+        "UPSTREAM_RETRY_MAX_DELAY": "0",
+        "HEDGE_ENABLED": "false",
+    }.items():
+        monkeypatch.setenv(name, value)
+    return monkeypatch
+
+
+@pytest.fixture
+def run_service(service_env):
+    """
+    Run ``scenario(service)`` on a fresh event loop against a new
+    OpenAIService, closing the service afterwards. Set environment
+    variables through ``service_env`` before calling.
+    """
+    from app.services.openai_service import OpenAIService
+
+    def run(scenario):
+        async def main():
+            service = OpenAIService()
+            try:
+                return await scenario(service)
+            finally:
+                await service.close()
+        return asyncio.run(main())
+    return run
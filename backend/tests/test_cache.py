@@ -0,0 +1,93 @@
+from benchmarks import fake_openai
+from app.models.schemas import PromptRequest
+from app.services.cache import SharedCache
+
+
+class DictRedis:
+    """Redis-compatible client over a dict, standing in for the shared tier"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+
+def test_repeated_request_is_served_from_memory(run_service):
+    async def scenario(service):
+        before = fake_openai.stats["requests"]
+        first = await service.optimize_prompt(PromptRequest(prompt="Write a haiku about tea"))
+        second = await service.optimize_prompt(PromptRequest(prompt="Write  a haiku about tea "))
+        return first, second, fake_openai.stats["requests"] - before, service.cache.stats()
+
+    first, second, upstream, stats = run_service(scenario)
+    assert not first.cached
+    assert second.cached
+    assert second.optimized_prompt == first.optimized_prompt
+    assert upstream == 1
+    assert stats["memory"]["hits"] == 1
+
+
+def test_shared_tier_hit_is_promoted_to_memory(run_service):
+    async def scenario(service):
+        service.cache.shared = SharedCache(DictRedis(), ttl=60)
+        before = fake_openai.stats["requests"]
+        await service.optimize_prompt(PromptRequest(prompt="Summarize the release notes"))
+        # Another process: same shared tier, empty local tier
+        service.cache.memory.clear()
+        shared_hit = await service.optimize_prompt(PromptRequest(prompt="Summarize the release notes"))
+        memory_hit = await service.optimize_prompt(PromptRequest(prompt="Summarize the release notes"))
+        return shared_hit, memory_hit, fake_openai.stats["requests"] - before, service.cache.stats()
+
+    shared_hit, memory_hit, upstream, stats = run_service(scenario)
+    assert shared_hit.cached and memory_hit.cached
+    assert upstream == 1
+    assert stats["shared"]["hits"] == 1
+    assert stats["shared"]["writes"] == 1
+    assert stats["memory"]["hits"] == 1
+
+
+def test_shared_tier_failures_are_misses(run_service):
+    class BrokenRedis(DictRedis):
+        async def get(self, key):
+            raise ConnectionError("redis is down")
+
+    async def scenario(service):
+        service.cache.shared = SharedCache(BrokenRedis(), ttl=60)
+        response = await service.optimize_prompt(PromptRequest(prompt="List three onboarding steps"))
+        return response, service.cache.stats()
+
+    response, stats = run_service(scenario)
+    assert not response.cached
+    assert stats["shared"]["errors"] == 1
+
+
+def test_cache_key_includes_caller_base_url(run_service, fake):
+    async def scenario(service):
+        before = fake_openai.stats["requests"]
+        default = await service.optimize_prompt(PromptRequest(prompt="Draft a welcome email"))
+        # Same endpoint, but named by the caller: it may serve other models under the same name
+        custom = await service.optimize_prompt(PromptRequest(prompt="Draft a welcome email", base_url=fake))
+        slash = await service.optimize_prompt(PromptRequest(prompt="Draft a welcome email", base_url=fake + "/"))
+        return default, custom, slash, fake_openai.stats["requests"] - before
+
+    default, custom, slash, upstream = run_service(scenario)
+    assert not default.cached
+    assert not custom.cached
+    assert slash.cached
+    assert upstream == 2
+
+
+def test_bypass_skips_the_cache(run_service):
+    async def scenario(service):
+        before = fake_openai.stats["requests"]
+        await service.optimize_prompt(PromptRequest(prompt="Explain recursion to a child"))
+        bypassed = await service.optimize_prompt(PromptRequest(prompt="Explain recursion to a child", cache="bypass"))
+        return bypassed, fake_openai.stats["requests"] - before
+
+    bypassed, upstream = run_service(scenario)
+    assert not bypassed.cached
+    assert upstream == 2
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from benchmarks import fake_openai
+from app.services.offline_batch import BatchAPI, OfflineBatchRunner
+
+PROMPTS = ["Write a haiku about tea", "Plan a weekend in Lisbon", "Explain DNS to a child", "Name a bakery", "Draft a standup update"]
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    """Five optimization requests with an invalid line in the middle"""
+    lines = [{"custom_id": f"req-{i}", "prompt": prompt} for i, prompt in enumerate(PROMPTS)]
+    lines.insert(2, {"custom_id": "no-prompt"})
+    path = tmp_path / "input.jsonl"
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+    return path
+
+
+def _runner(service, fake, input_path, **kwargs):
+    return OfflineBatchRunner(
+        service, BatchAPI(fake, "sk-test"), str(input_path), str(input_path.with_name("output.jsonl")),
+        max_requests=2, poll_interval=0.01, **kwargs,
+    )
+
+
+def _run(run_service, fake, input_path, restart=False, prepare=None):
+    async def scenario(service):
+        runner = _runner(service, fake, input_path)
+        if prepare is not None:
+            prepare(runner)
+        try:
+            return await runner.run(restart=restart)
+        finally:
+            await runner.api.aclose()
+    return run_service(scenario)
+
+
+def _records(input_path):
+    with open(input_path.with_name("output.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_results_are_written_in_input_order(run_service, fake, input_path):
+    before = fake_openai.stats["batches"]
+    summary = _run(run_service, fake, input_path)
+
+    records = _records(input_path)
+    assert [r["index"] for r in records] == list(range(6))
+    assert [r["custom_id"] for r in records] == ["req-0", "req-1", "no-prompt", "req-2", "req-3", "req-4"]
+    assert [r["status"] for r in records] == ["ok", "ok", "error", "ok", "ok", "ok"]
+    assert all(r["result"]["optimized_prompt"] for r in records if r["status"] == "ok")
+    assert "prompt" in records[2]["error"]
+    # Five requests in chunks of at most two; the invalid line is never sent
+    assert summary["chunks"] == 3
+    assert summary["written_this_run"] == {"ok": 5, "error": 1}
+    assert fake_openai.stats["batches"] - before == 3
+
+
+def test_failed_batch_requests_become_error_records(run_service, fake, input_path):
+    fake_openai.settings.error_rate = 1.0
+    _run(run_service, fake, input_path)
+
+    records = _records(input_path)
+    assert [r["status"] for r in records] == ["error"] * 6
+    assert records[0]["error"] == "Simulated upstream failure"
+
+
+def test_rerun_after_completion_does_nothing(run_service, fake, input_path):
+    _run(run_service, fake, input_path)
+    output = input_path.with_name("output.jsonl").read_bytes()
+    before = fake_openai.stats["batches"]
+
+    summary = _run(run_service, fake, input_path)
+
+    assert summary["written_this_run"] == {"ok": 0, "error": 0}
+    assert fake_openai.stats["batches"] == before
+    assert input_path.with_name("output.jsonl").read_bytes() == output
+
+
+def test_interrupted_run_resumes_without_resubmitting(run_service, fake, input_path):
+    def crash_after_first_chunk(runner):
+        collect = runner._collect
+
+        async def collect_once(chunk, out):
+            if chunk["index"] > 0:
+                raise KeyboardInterrupt
+            return await collect(chunk, out)
+        runner._collect = collect_once
+
+    before = fake_openai.stats["batches"]
+    with pytest.raises(KeyboardInterrupt):
+        _run(run_service, fake, input_path, prepare=crash_after_first_chunk)
+    assert len(_records(input_path)) == 3
+
+    summary = _run(run_service, fake, input_path)
+
+    assert summary["written_this_run"] == {"ok": 3, "error": 0}
+    assert fake_openai.stats["batches"] - before == 3
+    assert [r["index"] for r in _records(input_path)] == list(range(6))
+
+
+def test_restart_submits_again(run_service, fake, input_path):
+    _run(run_service, fake, input_path)
+    before = fake_openai.stats["batches"]
+
+    _run(run_service, fake, input_path, restart=True)
+
+    assert fake_openai.stats["batches"] - before == 3
+    assert [r["index"] for r in _records(input_path)] == list(range(6))
@@ -0,0 +1,123 @@
+import pytest
+
+from benchmarks import fake_openai
+from app.models.schemas import PromptRequest
+from app.services.errors import ServiceError, UpstreamUnavailable
+
+
+def _target(snapshot, base_url):
+    return next(t for t in snapshot["targets"] if t["base_url"] == base_url)
+
+
+def test_retryable_errors_are_retried_up_to_max_attempts(run_service, service_env):
+    service_env.setenv("UPSTREAM_MAX_ATTEMPTS", "3")
+    service_env.setenv("CIRCUIT_FAILURE_THRESHOLD", "10")
+    fake_openai.settings.error_rate = 1.0
+
+    async def scenario(service):
+        before = fake_openai.stats["requests"]
+        with pytest.raises(ServiceError) as error:
+            await service.optimize_prompt(PromptRequest(prompt="Plan a team offsite"))
+        return error.value, fake_openai.stats["requests"] - before, service.resilience.snapshot()
+
+    error, upstream, snapshot = run_service(scenario)
+    assert error.status_code == 502
+    assert upstream == 3
+    assert snapshot["retries"] == 2
+
+
+def test_recovers_when_a_retry_succeeds(run_service, service_env):
+    service_env.setenv("UPSTREAM_MAX_ATTEMPTS", "2")
+
+    async def scenario(service):
+        attempt = service.resilience._attempt
+        calls = []
+
+        async def first_attempt_fails(target, fn):
+            calls.append(target)
+            fake_openai.settings.error_rate = 1.0 if len(calls) == 1 else 0.0
+            return await attempt(target, fn)
+
+        service.resilience._attempt = first_attempt_fails
+        response = await service.optimize_prompt(PromptRequest(prompt="Write a product tagline"))
+        return response, len(calls), service.resilience.snapshot()
+
+    response, attempts, snapshot = run_service(scenario)
+    assert response.optimized_prompt
+    assert attempts == 2
+    assert snapshot["retries"] == 1
+
+
+def test_open_circuit_fails_fast_without_calling_upstream(run_service, service_env, fake):
+    service_env.setenv("UPSTREAM_MAX_ATTEMPTS", "2")
+    service_env.setenv("CIRCUIT_FAILURE_THRESHOLD", "2")
+    service_env.setenv("CIRCUIT_RESET_TIMEOUT", "60")
+    fake_openai.settings.error_rate = 1.0
+
+    async def scenario(service):
+        with pytest.raises(ServiceError):
+            await service.optimize_prompt(PromptRequest(prompt="Outline a talk on caching"))
+        before = fake_openai.stats["requests"]
+        with pytest.raises(UpstreamUnavailable) as error:
+            await service.optimize_prompt(PromptRequest(prompt="Outline a talk on testing"))
+        return error.value, fake_openai.stats["requests"] - before, service.resilience.snapshot()
+
+    error, upstream, snapshot = run_service(scenario)
+    assert upstream == 0
+    assert error.status_code == 503
+    assert 0 < float(error.headers["Retry-After"]) <= 60
+    assert _target(snapshot, fake)["circuit"] == "open"
+    assert snapshot["circuit_rejections"] == 1
+
+
+def test_rate_limits_do_not_open_the_circuit(run_service, service_env, fake):
+    service_env.setenv("UPSTREAM_MAX_ATTEMPTS", "1")
+    service_env.setenv("CIRCUIT_FAILURE_THRESHOLD", "1")
+    fake_openai.settings.error_rate = 1.0
+    fake_openai.settings.error_status = 429
+
+    async def scenario(service):
+        with pytest.raises(ServiceError) as error:
+            await service.optimize_prompt(PromptRequest(prompt="Name a new coffee blend"))
+        circuit = _target(service.resilience.snapshot(), fake)["circuit"]
+        fake_openai.settings.error_rate = 0.0
+        response = await service.optimize_prompt(PromptRequest(prompt="Name a new tea blend"))
+        return error.value, circuit, response
+
+    error, circuit, response = run_service(scenario)
+    # Upstream overload is reported as our own unavailability, not the caller's rate limit
+    assert error.status_code == 503
+    assert circuit == "closed"
+    assert response.optimized_prompt
+
+
+def test_fails_over_to_the_next_endpoint(run_service, service_env, fake, dead_url):
+    service_env.setenv("OPENAI_BASE_URL", dead_url)
+    service_env.setenv("OPENAI_FAILOVER_BASE_URLS", fake)
+    service_env.setenv("UPSTREAM_MAX_ATTEMPTS", "2")
+
+    async def scenario(service):
+        before = fake_openai.stats["requests"]
+        response = await service.optimize_prompt(PromptRequest(prompt="Describe a hiking trail"))
+        return response, fake_openai.stats["requests"] - before, service.resilience.snapshot()
+
+    response, upstream, snapshot = run_service(scenario)
+    assert response.optimized_prompt
+    assert upstream == 1
+    assert snapshot["failovers"] == 1
+    assert _target(snapshot, dead_url)["error_rate"] == 1.0
+
+
+def test_caller_base_url_is_never_failed_over(run_service, service_env, fake, dead_url):
+    service_env.setenv("OPENAI_FAILOVER_BASE_URLS", fake)
+    service_env.setenv("UPSTREAM_MAX_ATTEMPTS", "2")
+
+    async def scenario(service):
+        before = fake_openai.stats["requests"]
+        with pytest.raises(ServiceError):
+            await service.optimize_prompt(PromptRequest(prompt="Suggest a book title", base_url=dead_url))
+        return fake_openai.stats["requests"] - before, service.resilience.snapshot()
+
+    upstream, snapshot = run_service(scenario)
+    assert upstream == 0
+    assert snapshot["failovers"] == 0
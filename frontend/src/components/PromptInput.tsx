@@ -88,10 +88,6 @@ const PromptInput: React.FC<PromptInputProps> = ({ onOptimize, loading }) => {
       setPromptError('Prompt is too short');
       return false;
     }
-    if (combinedPrompt.length > 4000) {
-      setPromptError('Prompt is too long');
-      return false;
-    }
     if (!/[a-zA-Z0-9]/.test(combinedPrompt)) {
       setPromptError('Prompt contains no alphanumeric characters');
       return false;
@@ -25,12 +25,17 @@ export interface PromptResponse {
   model_used: string;
   tokens_saved: number;
   confidence_score: number;
+  prompt_tokens?: number;
+  completion_tokens?: number;
+  cost_usd?: number;
+  cached?: boolean;
 }
 
 export interface ModelInfo {
   model_name: string;
   description: string;
   max_tokens: number;
+  context_window: number;
   pricing_per_1k_tokens: {
     input: number;
     output: number;
@@ -68,6 +73,15 @@ export interface PromptGenerationResponse {
   alternatives: string[];
   model_used: string;
   confidence_score: number;
+  prompt_tokens?: number;
+  completion_tokens?: number;
+  cost_usd?: number;
+  cached?: boolean;
+}
+
+export interface StreamEvent {
+  event: 'delta' | 'item' | 'result' | 'error';
+  data: any;
 }
 
 export interface TaskType {
@@ -80,6 +94,38 @@ export interface OutputFormat {
   description: string;
 }
 
+async function readEventStream(path: string, body: unknown, onEvent: (event: StreamEvent) => void, signal?: AbortSignal): Promise<void> {
+  const response = await fetch(`${API_BASE_URL}${path}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify(body),
+    signal,
+  });
+  if (!response.ok || !response.body) {
+    throw new Error(`Request failed: ${response.status} ${response.statusText}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = block.match(/^event: (.*)$/m)?.[1];
+      const data = block.match(/^data: (.*)$/m)?.[1];
+      if (event && data) {
+        onEvent({ event: event as StreamEvent['event'], data: JSON.parse(data) });
+      }
+      boundary = buffer.indexOf('\n\n');
+    }
+  }
+}
+
 class ApiService {
   private api = axios.create({
     baseURL: API_BASE_URL,
@@ -106,6 +152,15 @@ class ApiService {
     }
   }
 
+  // Aborting the signal closes the connection, which also stops the upstream completion
+  async optimizePromptStream(request: PromptRequest, onEvent: (event: StreamEvent) => void, signal?: AbortSignal): Promise<void> {
+    return readEventStream('/optimize/stream', request, onEvent, signal);
+  }
+
+  async generatePromptStream(request: PromptGenerationRequest, onEvent: (event: StreamEvent) => void, signal?: AbortSignal): Promise<void> {
+    return readEventStream('/generate/stream', request, onEvent, signal);
+  }
+
   async getModels(): Promise<ModelInfo[]> {
     try {
       const response = await this.api.get('/models');